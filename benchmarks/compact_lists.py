@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""Memory benchmark of the compact storage of homogeneous lists.
+
+Long list of sensors is loaded from an additional config file, with and
+without the compaction (``compact_lists`` option), and the memory retained
+by the ConfigManager is measured with tracemalloc.
+
+Usage::
+
+    $ python benchmarks/compact_lists.py --sensors 20000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from onacol import ConfigManager  # noqa: E402
+
+DEFAULT_FILE = os.path.join(os.path.dirname(__file__), os.pardir, "tests",
+                            "test_yamls", "test_schema.yaml")
+
+
+def generate_overlay(sensors: int) -> str:
+    """ Config file with long list of sensors (as in the test
+        configuration).
+    """
+    lines = ["sensor_config:", "    sensors:"]
+    for i in range(sensors):
+        lines.extend([f"        - id: {i}",
+                      f"          name: \"Sensor {i}\"",
+                      f"          min_trigger_limit: {i % 100}",
+                      f"          max_trigger_limit: {100 + i % 100}"])
+    return "\n".join(lines) + "\n"
+
+
+def measure(overlay_file: str, compact_lists, repeat: int) -> tuple:
+    def load():
+        cm = ConfigManager(DEFAULT_FILE, compact_lists=compact_lists,
+                           validator_backend="compiled",
+                           incremental_validation=False)
+        cm.config_from_file(overlay_file)
+        return cm
+
+    load()  # Warm up imports and caches
+    tracemalloc.start()
+    try:
+        cm = load()
+        retained = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    validation = min(timeit.repeat(cm.validate, number=1, repeat=repeat))
+    return retained, validation
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sensors", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        overlay_file = os.path.join(tmp_dir, "sensors.yaml")
+        with open(overlay_file, "w") as f:
+            f.write(generate_overlay(args.sensors))
+
+        results = {"lists": measure(overlay_file, None, args.repeat),
+                   "compact": measure(overlay_file, 1, args.repeat)}
+
+    print(f"Config with {args.sensors} sensors (compiled validation):")
+    for name, (retained, validation) in results.items():
+        print(f"  {name:<8} retained {retained / 1024:10.1f} kB  "
+              f"validation {validation * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""Benchmark of the YAML loaders available for the overlay files.
+
+Usage::
+
+    $ python benchmarks/overlay_loading.py --sensors 5000 --repeat 3
+"""
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from onacol.config_file import ConfigFileHandler, YAML_LOADERS  # noqa: E402
+
+
+def generate_overlay(sensors: int) -> str:
+    """ Generate large overlay YAML with a long list of sensors. """
+    lines = ["general:", "    log_level: DEBUG", "sensor_config:",
+             "    sensors:"]
+    for i in range(sensors):
+        lines.extend([
+            f"        - id: {i}      # Sensor ID",
+            f"          name: \"Sensor {i}\"",
+            f"          min_trigger_limit: {i % 100}",
+            f"          max_trigger_limit: {100 + i % 100}",
+        ])
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sensors", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile("w", suffix=".yaml",
+                                     delete=False) as overlay_file:
+        overlay_file.write(generate_overlay(args.sensors))
+
+    try:
+        fh = ConfigFileHandler(None)
+        results = {}
+        for name, loader in YAML_LOADERS.items():
+            results[name] = min(timeit.repeat(
+                lambda: fh._load_yaml_file(overlay_file.name, loader=loader),
+                number=1, repeat=args.repeat))
+
+        print(f"Overlay with {args.sensors} sensors "
+              f"({os.path.getsize(overlay_file.name)} bytes):")
+        for name, duration in results.items():
+            print(f"  {name:<6} {duration * 1000:10.1f} ms  "
+                  f"({results['rt'] / duration:.1f}x vs. rt)")
+    finally:
+        os.unlink(overlay_file.name)
+
+
+if __name__ == "__main__":
+    main()
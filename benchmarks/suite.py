@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+"""Benchmark suite of the configuration load, merge, validate and export paths.
+
+Synthetic default (schema) files of several shapes and sizes are generated,
+and the main phases are timed on each of them:
+
+* ``load_files``  - ``ConfigFileHandler`` construction (parsing of the
+  default file into the schema).
+* ``flat_schema`` - ``FlatSchemaHandler`` construction.
+* ``load_artifact`` - ``ConfigFileHandler`` construction from the compiled
+  artifact.
+* ``env_vars``    - ``ConfigManager.config_from_env_vars()``.
+* ``cli_args``    - ``ConfigManager.config_from_cli_args()``.
+* ``validate``    - full ``ConfigManager.validate()``.
+* ``export``      - ``ConfigManager.export_current_config()``
+  (``save_with_schema``).
+
+Memory (peak and retained by the loaded ``ConfigManager``) is measured with
+tracemalloc in a separate run.
+
+Usage::
+
+    $ python benchmarks/suite.py --sizes 100 500 --save
+    $ python benchmarks/suite.py --sizes 100 500 --compare
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from onacol import ConfigManager  # noqa: E402
+from onacol.config_file import ConfigFileHandler  # noqa: E402
+from onacol.flat_schema import FlatSchemaHandler  # noqa: E402
+
+DEFAULT_BASELINE_FILE = os.path.join(os.path.dirname(__file__),
+                                     "baselines.json")
+ENV_VAR_PREFIX = "ONACOL_BENCH"
+
+# Maximal number of env vars/CLI options set in the merge benchmarks
+MAX_OVERRIDES = 200
+
+# Nesting depth of the "deep" schema. Cost of the nested CascaDict creation
+# grows exponentially with the depth, so it's fixed.
+DEEP_LEVELS = 5
+
+
+def _leaf(indent: str, name: str, default: str, data_type: str) -> list:
+    return [f"{indent}{name}:    # {name} description",
+            f"{indent}    oc_default: {default}",
+            f"{indent}    oc_schema:",
+            f"{indent}        type: {data_type}"]
+
+
+def generate_wide(size: int) -> str:
+    """ Single section with `size` items (all with schema). """
+    lines = ["wide:"]
+    for i in range(size):
+        lines.extend(_leaf("    ", f"item_{i}", str(i), "integer"))
+    return "\n".join(lines) + "\n"
+
+
+def generate_deep(size: int) -> str:
+    """ `size // DEEP_LEVELS` sections, each nested `DEEP_LEVELS` levels
+        deep with single item per level.
+    """
+    lines = []
+    for group in range(max(size // DEEP_LEVELS, 1)):
+        indent = ""
+        for level in range(DEEP_LEVELS):
+            lines.append(f"{indent}level_{group}_{level}:")
+            indent += "    "
+            lines.extend(_leaf(indent, "item", f"value{level}", "string"))
+    return "\n".join(lines) + "\n"
+
+
+def generate_list(size: int) -> str:
+    """ Long list of `size` sensors (schema defined by the first item). """
+    lines = ["sensor_config:", "    sensors:",
+             "        - id:",
+             "            oc_default: 0",
+             "            oc_schema:",
+             "                type: integer",
+             "          name:",
+             "            oc_default: \"Sensor 0\"",
+             "            oc_schema:",
+             "                type: string",
+             "          limit:",
+             "            oc_default: 100",
+             "            oc_schema:",
+             "                type: integer",
+             "                min: 0"]
+    for i in range(1, size):
+        lines.extend([f"        - id: {i}",
+                      f"          name: \"Sensor {i}\"",
+                      f"          limit: {i % 1000}"])
+    lines.append("    enabled:")
+    lines.extend(_leaf("        ", "all", "true", "boolean"))
+    return "\n".join(lines) + "\n"
+
+
+def generate_reuse(size: int) -> str:
+    """ `size // 4` devices sharing single referenced schema
+        (``oc_schema_id``), 4 items each.
+    """
+    lines = ["devices:", "    device_0:"]
+    for name, default, data_type in (("address", "10", "integer"),
+                                     ("channel", "can0", "string"),
+                                     ("enabled", "true", "boolean"),
+                                     ("timeout", "1.5", "float")):
+        lines.extend(_leaf("        ", name, default, data_type))
+    lines.extend(["        oc_schema_id: device_def",
+                  "        oc_schema:",
+                  "            allow_unknown: false"])
+    for i in range(1, max(size // 4, 2)):
+        lines.extend([f"    device_{i}:",
+                      f"        address: {i}",
+                      "        channel: can1",
+                      "        enabled: false",
+                      "        timeout: 2.5",
+                      "        oc_schema: device_def"])
+    return "\n".join(lines) + "\n"
+
+
+GENERATORS = {
+    "wide": generate_wide,
+    "deep": generate_deep,
+    "list": generate_list,
+    "reuse": generate_reuse,
+}
+
+
+def _overrides(cm: ConfigManager) -> list:
+    """ Tuples (env_var_name, cli_opt_name, value) of scalar values. """
+    env_var_mapping, cli_opt_mapping = cm._flat_schema_handler.mappings
+    cli_opts = {path: name for name, path in cli_opt_mapping.items()}
+    overrides = []
+    for env_var_name, path in env_var_mapping.items():
+        value = cm.get_env_var_conf_value(env_var_name)
+        if isinstance(value, (str, int, float)):
+            overrides.append((env_var_name, cli_opts[path], str(value)))
+        if len(overrides) >= MAX_OVERRIDES:
+            break
+    return overrides
+
+
+def _time(func, repeat: int) -> float:
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def run_case(default_file: str, repeat: int) -> dict:
+    """ Time all the phases on a single default file. """
+    results = {}
+    results["load_files"] = _time(lambda: ConfigFileHandler(default_file),
+                                  repeat)
+
+    fh = ConfigFileHandler(default_file)
+    results["flat_schema"] = _time(
+        lambda: FlatSchemaHandler(fh.flat_schema,
+                                  env_var_prefix=ENV_VAR_PREFIX).mappings,
+        repeat)
+
+    def manager():
+        return ConfigManager(default_file, env_var_prefix=ENV_VAR_PREFIX,
+                             incremental_validation=False)
+
+    artifact = default_file + ".onacol"
+    ConfigManager(default_file, env_var_prefix=ENV_VAR_PREFIX,
+                  load=False).compile_artifact(artifact)
+    results["load_artifact"] = _time(
+        lambda: ConfigFileHandler(default_file, artifact_path=artifact),
+        repeat)
+
+    cm = manager()
+    overrides = _overrides(cm)
+    saved_environ = os.environ.copy()
+    os.environ.update({name: value for name, _, value in overrides})
+    try:
+        managers = [manager() for _ in range(repeat)]
+        results["env_vars"] = min(
+            timeit.timeit(m.config_from_env_vars, number=1)
+            for m in managers)
+    finally:
+        os.environ.clear()
+        os.environ.update(saved_environ)
+
+    cli_args = []
+    for _, cli_opt_name, value in overrides:
+        cli_args.extend([f"--{cli_opt_name}", value])
+    managers = [manager() for _ in range(repeat)]
+    results["cli_args"] = min(
+        timeit.timeit(lambda: m.config_from_cli_args(cli_args), number=1)
+        for m in managers)
+
+    results["validate"] = _time(cm.validate, repeat)
+    results["export"] = _time(
+        lambda: cm.export_current_config(io.StringIO()), repeat)
+
+    tracemalloc.start()
+    try:
+        loaded = manager()
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del loaded
+    results["memory_peak"] = peak
+    results["memory_retained"] = retained
+    return results
+
+
+def run_suite(sizes: list, generators: list, repeat: int) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name in generators:
+            for size in sizes:
+                default_file = os.path.join(tmp_dir, f"{name}_{size}.yaml")
+                with open(default_file, "w") as f:
+                    f.write(GENERATORS[name](size))
+                case = f"{name}/{size}"
+                results[case] = run_case(default_file, repeat)
+                print_case(case, results[case])
+    return results
+
+
+def _format(metric: str, value: float) -> str:
+    if metric.startswith("memory"):
+        return f"{value / 1024:10.1f} kB"
+    return f"{value * 1000:10.2f} ms"
+
+
+def print_case(case: str, results: dict) -> None:
+    print(case)
+    for metric, value in results.items():
+        print(f"  {metric:<16}{_format(metric, value)}")
+
+
+def compare(results: dict, baselines: dict, tolerance: float) -> list:
+    """ Compare results with the baselines.
+
+    :return: List of regressions - tuples (case, metric, baseline, result).
+    """
+    regressions = []
+    for case, metrics in results.items():
+        for metric, value in metrics.items():
+            baseline = baselines.get(case, {}).get(metric)
+            if baseline and value > baseline * tolerance:
+                regressions.append((case, metric, baseline, value))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 500])
+    parser.add_argument("--generators", nargs="+", choices=GENERATORS,
+                        default=list(GENERATORS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baseline-file", default=DEFAULT_BASELINE_FILE)
+    parser.add_argument("--save", action="store_true",
+                        help="Store the results as the new baselines.")
+    parser.add_argument("--compare", action="store_true",
+                        help="Compare the results with the baselines, "
+                             "exit with 1 on regression.")
+    parser.add_argument("--tolerance", type=float, default=1.25,
+                        help="Allowed ratio of result/baseline.")
+    args = parser.parse_args()
+
+    results = run_suite(args.sizes, args.generators, args.repeat)
+
+    if args.compare:
+        with open(args.baseline_file) as f:
+            baselines = json.load(f)
+        regressions = compare(results, baselines, args.tolerance)
+        for case, metric, baseline, value in regressions:
+            print(f"REGRESSION {case} {metric}: {_format(metric, baseline)}"
+                  f" -> {_format(metric, value)}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions.")
+
+    if args.save:
+        baselines = {}
+        if os.path.exists(args.baseline_file):
+            with open(args.baseline_file) as f:
+                baselines = json.load(f)
+        baselines.update(results)
+        with open(args.baseline_file, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f"Baselines saved to {args.baseline_file}")
+
+
+if __name__ == "__main__":
+    main()
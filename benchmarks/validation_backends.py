@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+"""Benchmark of the configuration validation backends.
+
+Usage::
+
+    $ python benchmarks/validation_backends.py --sensors 5000 --repeat 3
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from onacol import ConfigManager  # noqa: E402
+from onacol.validation import VALIDATOR_BACKENDS  # noqa: E402
+
+DEFAULT_FILE = os.path.join(os.path.dirname(__file__), os.pardir, "tests",
+                            "test_yamls", "test_schema.yaml")
+
+
+def generate_sensors(sensors: int) -> list:
+    """ Generate long list of sensors (as in the test configuration). """
+    return [{"id": i, "name": f"Sensor {i}",
+             "min_trigger_limit": i % 100,
+             "max_trigger_limit": 100 + i % 100} for i in range(sensors)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sensors", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    sensors = generate_sensors(args.sensors)
+    results = {}
+    for backend in VALIDATOR_BACKENDS:
+        cm = ConfigManager(DEFAULT_FILE, validator_backend=backend,
+                           incremental_validation=False)
+        cm.config_from_dict({"sensor_config": {"sensors": sensors}})
+        results[backend] = min(timeit.repeat(cm.validate, number=1,
+                                             repeat=args.repeat))
+
+    print(f"Full validation of config with {args.sensors} sensors:")
+    for name, duration in results.items():
+        print(f"  {name:<9} {duration * 1000:10.1f} ms  "
+              f"({results['cerberus'] / duration:.1f}x vs. cerberus)")
+
+
+if __name__ == "__main__":
+    main()
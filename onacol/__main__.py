@@ -0,0 +1,11 @@
+"""
+.. module: onacol.__main__
+   :synopsis: Runs the command line tool (``python -m onacol``).
+
+.. moduleauthor:: Josef Nevrly <josef.nevrly@gmail.com>
+"""
+import sys
+
+from .cli import main
+
+sys.exit(main())
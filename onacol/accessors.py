@@ -0,0 +1,219 @@
+"""
+.. module: onacol.accessors
+   :synopsis: Typed attribute access to the configuration through classes
+                generated from the configuration schema.
+
+.. moduleauthor:: Josef Nevrly <josef.nevrly@gmail.com>
+"""
+from typing import Any, Union, Type, cast
+from collections import abc
+import keyword
+
+from cerberus import Validator  # type: ignore
+from cascadict import CascaDict  # type: ignore
+
+from .snapshot import _materialize
+
+_MISSING = object()
+
+
+class ConfigAccessor:
+    """ Base class of the accessor classes generated by
+        :func:`accessor_class`. Configuration items (with keys that are valid
+        Python identifiers not starting with underscore) are stored in slots,
+        so reading them is a plain attribute load. Sub-sections are nested
+        accessors. All the items can be also read by the key::
+
+            >>> config.can_bus.sensor_can.channel
+            'can0'
+            >>> config["can_bus"]["sensor_can"]["channel"]
+            'can0'
+
+        Accessors are read-only.
+    """
+
+    __slots__ = ("_data",)
+
+    # Configuration section the accessor is bound to
+    _data: abc.Mapping
+    # Config key mapped to the attribute name
+    _attributes: dict = {}
+    # Config key mapped to the accessor class of the sub-section
+    _children: dict = {}
+
+    def __getitem__(self, key: Any) -> Any:
+        if key in self._attributes:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        return self._data[key]
+
+    def __contains__(self, key: Any) -> bool:
+        if key in self._attributes:
+            return hasattr(self, key)
+        return key in self._data
+
+    def __setattr__(self, name: str, value: Any):
+        raise AttributeError(
+            f"Configuration accessor is read-only, cannot set {name}")
+
+    def __delattr__(self, name: str):
+        raise AttributeError(
+            f"Configuration accessor is read-only, cannot delete {name}")
+
+    def __repr__(self):
+        items = dict(self._data)
+        items.update((key, getattr(self, key)) for key in self._attributes
+                     if hasattr(self, key))
+        return f"<{type(self).__name__} {items}>"
+
+
+def _is_attribute_name(key: Any) -> bool:
+    return isinstance(key, str) and key.isidentifier() and \
+        not keyword.iskeyword(key) and not key.startswith("_")
+
+
+def _class_name(path: tuple) -> str:
+    return "".join(part.title().replace("_", "")
+                   for part in ("config",) + path) + "Accessor"
+
+
+def _annotation(item_schema: Any) -> Any:
+    """ Python type(s) of the configuration item by its schema. """
+    if not isinstance(item_schema, abc.Mapping) or \
+            not isinstance(item_schema.get("type"), str):
+        return Any
+    try:
+        types = Validator.types_mapping[item_schema["type"]].included_types
+    except KeyError:
+        return Any
+    # Cerberus wraps some of the types (int) into an additional tuple
+    types = tuple(t[0] if isinstance(t, tuple) else t for t in types)
+    return types[0] if len(types) == 1 else Union[types]
+
+
+def accessor_class(schema: Union[dict, None], defaults: abc.Mapping,
+                   path: tuple = ()) -> Type[ConfigAccessor]:
+    """ Generate accessor class (and classes of all the sub-sections) from
+        the configuration schema.
+
+    :param schema:   Schema of the section items (e.g.
+                     :attr:`onacol.config_schema.ConfigSchema.schema`).
+    :param defaults: Default values of the section - they define the
+                     items and sub-sections.
+    :param path:     Configuration path of the section.
+    :return: Subclass of :class:`ConfigAccessor`.
+    """
+    schema = schema if isinstance(schema, abc.Mapping) else {}
+    attributes = {}
+    children: dict = {}
+    annotations = {}
+    for key, default in defaults.items():
+        if not _is_attribute_name(key):
+            continue
+        attributes[key] = key
+        item_schema = schema.get(key)
+        if isinstance(default, abc.Mapping):
+            sub_schema = item_schema.get("schema") \
+                if isinstance(item_schema, abc.Mapping) else None
+            children[key] = accessor_class(sub_schema, default,
+                                           path + (key,))
+            annotations[key] = children[key]
+        else:
+            annotations[key] = _annotation(item_schema)
+
+    namespace = {
+        "__slots__": tuple(attributes.values()),
+        "__annotations__": annotations,
+        "__module__": __name__,
+        "_attributes": attributes,
+        "_children": children,
+    }
+    return cast(Type[ConfigAccessor],
+                type(_class_name(path), (ConfigAccessor,), namespace))
+
+
+def _bind_value(accessor_cls: Type[ConfigAccessor], key: Any,
+                value: Any) -> Any:
+    child_cls = accessor_cls._children.get(key)
+    if child_cls is not None and isinstance(value, abc.Mapping):
+        return bind_accessor(child_cls, value)
+    return value
+
+
+def _set_item(accessor: ConfigAccessor, key: Any, value: Any) -> None:
+    if value is _MISSING:
+        if hasattr(accessor, key):
+            object.__delattr__(accessor, key)
+    else:
+        object.__setattr__(accessor, key,
+                           _bind_value(type(accessor), key, value))
+
+
+def rebind_accessor(accessor: ConfigAccessor, data: abc.Mapping) -> None:
+    """ Bind existing accessor to new (materialized) configuration data.
+
+    :param accessor: Accessor instance.
+    :param data:     Configuration section, typically from
+                     :attr:`onacol.snapshot.ConfigSnapshot.data`.
+    """
+    object.__setattr__(accessor, "_data", data)
+    for key in accessor._attributes:
+        _set_item(accessor, key, data.get(key, _MISSING))
+
+
+def bind_accessor(accessor_cls: Type[ConfigAccessor],
+                  data: abc.Mapping) -> ConfigAccessor:
+    """ Create accessor instance bound to the (materialized) configuration
+        data.
+
+    :param accessor_cls: Class generated by :func:`accessor_class`.
+    :param data:         Configuration section, typically from
+                         :attr:`onacol.snapshot.ConfigSnapshot.data`.
+    :return: Accessor instance.
+    """
+    accessor = accessor_cls.__new__(accessor_cls)
+    rebind_accessor(accessor, data)
+    return accessor
+
+
+def rebind_path(accessor: ConfigAccessor, config: abc.Mapping,
+                path: tuple) -> bool:
+    """ Rebind single changed configuration path of the accessor (the other
+        items are kept).
+
+    :param accessor: Root accessor.
+    :param config:   The changed configuration (:class:`CascaDict` or
+                     plain dict).
+    :param path:     Changed configuration path.
+    :return: False if the path cannot be rebound separately (the item is not
+             an attribute, or the structure above the path changed) - then
+             the whole accessor needs to be rebound.
+    """
+    if not path:
+        return False
+    value: Any = config
+    section = accessor
+    for key in path[:-1]:
+        if key not in section._attributes:
+            return False
+        child: Union[ConfigAccessor, None] = getattr(section, key, None)
+        try:
+            value = value[key]
+        except (KeyError, TypeError, IndexError):
+            return False
+        if not isinstance(child, ConfigAccessor) or \
+                not isinstance(value, abc.Mapping):
+            return False
+        section = child
+
+    if path[-1] not in section._attributes:
+        return False
+    value = value.get(path[-1], _MISSING)
+    if isinstance(value, CascaDict):
+        value = value.copy_flat()
+    if value is not _MISSING:
+        value = _materialize(value, (), {}, True)
+    _set_item(section, path[-1], value)
+    return True
@@ -0,0 +1,169 @@
+"""
+.. module: onacol.artifact
+   :synopsis: Compiled configuration artifact - default file and overlays
+                parsed ahead of time (e.g. in a deploy build step).
+
+.. moduleauthor:: Josef Nevrly <josef.nevrly@gmail.com>
+"""
+from typing import Union, List, Iterable
+import hashlib
+import os
+import pickle
+import struct
+import sys
+import tempfile
+
+from . import __version__
+from .base import OnacolException
+from .config_schema import ConfigSchema
+
+# File layout: magic, format version, pickled artifact dict
+_MAGIC = b"ONACOLCA"
+_HEADER = struct.Struct("<8sI")
+ARTIFACT_FORMAT = 1
+
+
+class ArtifactError(OnacolException):
+    pass
+
+
+def _python_version() -> str:
+    return f"{sys.version_info[0]}.{sys.version_info[1]}"
+
+
+def file_digest(yaml_string: str) -> str:
+    """ Hash of the config file content (the same as the file layers
+        use for the change detection).
+    """
+    return hashlib.sha256(yaml_string.encode("utf-8")).hexdigest()
+
+
+def referenced_env_vars(yaml_strings: Iterable[str]) -> dict:
+    """ Values of the explicit environment variables referenced in the config
+        files (they are resolved before parsing, so they are part of
+        the compiled result).
+
+    :param yaml_strings: Raw content of the config files.
+    :return: Dict of env var name mapped to its current value (None if not
+             set).
+    """
+    return {match.group("var_name"):
+            os.environ.get(match.group("var_name"))
+            for yaml_string in yaml_strings
+            for match in ConfigSchema.OC_ENV_REGEX.finditer(yaml_string)}
+
+
+def new_artifact(default_file: tuple, files: List[tuple], env_vars: dict,
+                 sections: Union[tuple, None], schema_yaml: bytes,
+                 compiled_schema: dict, flat_mappings: dict) -> dict:
+    """ Create the artifact content.
+
+    :param default_file:    Tuple (path, digest) of the default file.
+    :param files:           Tuples (path, digest, parsed content) of
+                            the optional files, digest and content are None
+                            for files that did not exist.
+    :param env_vars:        See :func:`referenced_env_vars`.
+    :param sections:        Selected schema sections.
+    :param schema_yaml:     Pickled round-trip form of the default file (for
+                            the export). It's unpickled only when needed,
+                            the round-trip form is expensive to restore.
+    :param compiled_schema: See
+                            :meth:`onacol.config_schema.ConfigSchema.to_compiled`.
+    :param flat_mappings:   Env var prefix mapped to the flat schema mappings.
+    :return: Artifact dict.
+    """
+    return {
+        "onacol_version": __version__,
+        "python_version": _python_version(),
+        "default_file": default_file,
+        "files": files,
+        "env_vars": env_vars,
+        "sections": sections,
+        "schema_yaml": schema_yaml,
+        "schema": compiled_schema,
+        "flat_mappings": flat_mappings,
+    }
+
+
+def write_artifact(artifact: dict, artifact_path: str) -> None:
+    """ Atomically write the artifact file.
+
+    :param artifact:      Artifact dict (see :func:`new_artifact`).
+    :param artifact_path: Destination path.
+    """
+    artifact_path = str(artifact_path)
+    artifact_dir = os.path.dirname(os.path.abspath(artifact_path))
+    with tempfile.NamedTemporaryFile(dir=artifact_dir,
+                                     delete=False) as tmp_file:
+        tmp_file.write(_HEADER.pack(_MAGIC, ARTIFACT_FORMAT))
+        pickle.dump(artifact, tmp_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file.name, artifact_path)
+
+
+def read_artifact(artifact_path: str) -> dict:
+    """ Read the artifact file.
+
+    .. note:: Artifacts are pickled, they must come from a trusted source
+              (as the config files themselves).
+
+    :param artifact_path: Artifact path.
+    :return: Artifact dict.
+    :raises FileNotFoundError: If the artifact does not exist.
+    :raises ArtifactError: If the file is not a valid artifact (or it has
+                           an unsupported format).
+    """
+    with open(artifact_path, "rb") as artifact_file:
+        header = artifact_file.read(_HEADER.size)
+        if len(header) != _HEADER.size or \
+                header[:len(_MAGIC)] != _MAGIC:
+            raise ArtifactError(
+                f"Not a compiled configuration artifact: {artifact_path}")
+        _, artifact_format = _HEADER.unpack(header)
+        if artifact_format != ARTIFACT_FORMAT:
+            raise ArtifactError(
+                f"Unsupported format {artifact_format} of the configuration "
+                f"artifact {artifact_path}")
+        try:
+            artifact = pickle.load(artifact_file)
+        except Exception as e:
+            raise ArtifactError(
+                f"Cannot read configuration artifact {artifact_path}: "
+                f"{str(e)}")
+    if not isinstance(artifact, dict):
+        raise ArtifactError(
+            f"Invalid configuration artifact: {artifact_path}")
+    return artifact
+
+
+def stale_reason(artifact: dict, default_yaml: str,
+                 file_contents: List[Union[str, None]],
+                 sections: Union[tuple, None]) -> Union[str, None]:
+    """ Check if the artifact was compiled from the current config files.
+        Files are compared by content, not by path or modification time
+        (artifact is typically compiled on another machine).
+
+    :param artifact:      Artifact dict.
+    :param default_yaml:  Current content of the default file.
+    :param file_contents: Current content of the optional files (None for
+                          files that do not exist).
+    :param sections:      Selected schema sections.
+    :return: Description why the artifact is stale, None if it's current.
+    """
+    if artifact.get("onacol_version") != __version__:
+        return f"compiled by onacol {artifact.get('onacol_version')}"
+    if artifact.get("python_version") != _python_version():
+        return f"compiled for Python {artifact.get('python_version')}"
+    if artifact["sections"] != sections:
+        return "different schema sections"
+    if artifact["default_file"][1] != file_digest(default_yaml):
+        return "default file changed"
+    if len(artifact["files"]) != len(file_contents):
+        return "different optional files"
+    for (path, digest, _), content in zip(artifact["files"], file_contents):
+        if digest != (None if content is None else file_digest(content)):
+            return f"optional file {path} changed"
+    if referenced_env_vars([default_yaml] + [content for content in
+                                             file_contents if content]
+                           ) != artifact["env_vars"]:
+        return "referenced environment variables changed"
+    return None
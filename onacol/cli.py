@@ -0,0 +1,228 @@
+"""
+.. module: onacol.cli
+   :synopsis: Command line tool for checking, exporting and compiling
+                of the configuration files.
+
+.. moduleauthor:: Josef Nevrly <josef.nevrly@gmail.com>
+"""
+from typing import List, TextIO, Union
+import argparse
+import io
+import json
+import logging
+import sys
+
+from .onacol import ConfigManager
+from .stats import ConfigStats
+from .validation import VALIDATOR_BACKENDS
+from .base import OnacolException
+
+logger = logging.getLogger("onacol")
+
+
+def _common_arguments() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("default_file",
+                        help="default configuration file (with the schema)")
+    parser.add_argument("-l", "--overlay", action="append", default=[],
+                        metavar="FILE", dest="overlays",
+                        help="optional configuration file merged on top of "
+                             "the defaults (can be repeated)")
+    parser.add_argument("-e", "--env-prefix", metavar="PREFIX",
+                        help="merge environment variables with the prefix")
+    parser.add_argument("-s", "--section", action="append",
+                        metavar="SECTION", dest="sections",
+                        help="use only the top-level section of the default "
+                             "file (can be repeated)")
+    parser.add_argument("--schema-cache", metavar="DIR",
+                        help="compiled schema cache directory")
+    parser.add_argument("--artifact", metavar="FILE",
+                        help="compiled configuration artifact")
+    return parser
+
+
+def _output_argument(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("-o", "--output", metavar="FILE",
+                        help="output file (standard output by default)")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """ Create parser of the command line arguments. """
+    parser = argparse.ArgumentParser(
+        prog="onacol",
+        description="Check, export and compile onacol configuration files.")
+    subparsers = parser.add_subparsers(dest="command", required=True,
+                                       metavar="COMMAND")
+    common = _common_arguments()
+
+    validate = subparsers.add_parser(
+        "validate", parents=[common],
+        help="validate the configuration")
+    validate.add_argument("--validator", choices=sorted(VALIDATOR_BACKENDS),
+                          default="cerberus", help="validation backend")
+
+    show = subparsers.add_parser(
+        "show", parents=[common],
+        help="print the resolved configuration")
+    show.add_argument("--delta", action="store_true",
+                      help="print only values that differ from the defaults")
+    _output_argument(show)
+
+    example = subparsers.add_parser(
+        "example", parents=[common],
+        help="print example configuration file (the defaults)")
+    _output_argument(example)
+
+    compile_ = subparsers.add_parser(
+        "compile", parents=[common],
+        help="compile the schema cache (--schema-cache) and/or "
+             "the configuration artifact (--artifact)")
+    compile_.add_argument("--output-artifact", metavar="FILE",
+                          help="artifact path, if different from "
+                               "--artifact")
+
+    timing = subparsers.add_parser(
+        "timing", parents=[common],
+        help="measure durations of the configuration processing phases")
+    timing.add_argument("-n", "--repeat", type=int, default=1,
+                        help="number of runs (default: %(default)s)")
+    timing.add_argument("--json", action="store_true",
+                        help="print the stats as JSON")
+    timing.add_argument("--validator", choices=sorted(VALIDATOR_BACKENDS),
+                        default="cerberus", help="validation backend")
+    return parser
+
+
+def _load(args: argparse.Namespace, **kwargs) -> ConfigManager:
+    """ Create ConfigManager from the common arguments and merge
+        the environment variables.
+    """
+    config_manager = ConfigManager(
+        args.default_file, args.overlays,
+        env_var_prefix=args.env_prefix or "",
+        schema_cache_dir=args.schema_cache,
+        schema_sections=args.sections,
+        artifact=args.artifact, **kwargs)
+    if args.env_prefix:
+        config_manager.config_from_env_vars()
+    return config_manager
+
+
+def _open_output(args: argparse.Namespace, stdout: TextIO) -> TextIO:
+    if args.output is None:
+        return stdout
+    return open(args.output, "w")
+
+
+def _cmd_validate(args: argparse.Namespace, stdout: TextIO) -> None:
+    config_manager = _load(args, validator_backend=args.validator)
+    config_manager.validate()
+    print(f"{args.default_file}: configuration is valid", file=stdout)
+
+
+def _cmd_show(args: argparse.Namespace, stdout: TextIO) -> None:
+    config_manager = _load(args)
+    output = _open_output(args, stdout)
+    try:
+        if args.delta:
+            config_manager.export_config_delta(output)
+        else:
+            config_manager.export_current_config(output)
+    finally:
+        if output is not stdout:
+            output.close()
+
+
+def _cmd_example(args: argparse.Namespace, stdout: TextIO) -> None:
+    config_manager = _load(args)
+    output = _open_output(args, stdout)
+    try:
+        config_manager.generate_config_example(output)
+    finally:
+        if output is not stdout:
+            output.close()
+
+
+def _cmd_compile(args: argparse.Namespace, stdout: TextIO) -> None:
+    artifact = args.output_artifact or args.artifact
+    if args.schema_cache is None and artifact is None:
+        raise OnacolException(
+            "Nothing to compile, use --schema-cache and/or --artifact.")
+    config_manager = ConfigManager(
+        args.default_file, args.overlays,
+        env_var_prefix=args.env_prefix or "",
+        schema_cache_dir=args.schema_cache,
+        schema_sections=args.sections,
+        load=args.schema_cache is not None)
+    if args.schema_cache is not None:
+        print(f"Schema cache stored in {args.schema_cache}", file=stdout)
+    if artifact is not None:
+        config_manager.compile_artifact(artifact)
+        print(f"Configuration artifact stored in {artifact}", file=stdout)
+
+
+def _format_stats(stats: dict, repeat: int) -> str:
+    lines = [f"{'phase':<24}{'runs':>8}{'total ms':>12}{'per run ms':>12}"]
+    for name, phase in stats["phases"].items():
+        lines.append(f"{name:<24}{phase['count']:>8}"
+                     f"{phase['duration'] * 1000:>12.2f}"
+                     f"{phase['duration'] * 1000 / repeat:>12.2f}")
+    if stats["counters"]:
+        lines.append("")
+        lines.append(f"{'counter':<24}{'total':>8}")
+        for name, value in stats["counters"].items():
+            lines.append(f"{name:<24}{value:>8}")
+    return "\n".join(lines)
+
+
+def _cmd_timing(args: argparse.Namespace, stdout: TextIO) -> None:
+    if args.repeat < 1:
+        raise OnacolException("Number of runs must be at least 1.")
+    stats = ConfigStats()
+    for _ in range(args.repeat):
+        config_manager = _load(args, stats=stats,
+                               validator_backend=args.validator)
+        config_manager.validate()
+        config_manager.export_current_config(io.StringIO())
+    if args.json:
+        print(json.dumps(stats.as_dict(), indent=2), file=stdout)
+    else:
+        print(_format_stats(stats.as_dict(), args.repeat), file=stdout)
+
+
+COMMANDS = {
+    "validate": _cmd_validate,
+    "show": _cmd_show,
+    "example": _cmd_example,
+    "compile": _cmd_compile,
+    "timing": _cmd_timing,
+}
+
+
+def main(argv: Union[List[str], None] = None,
+         stdout: Union[TextIO, None] = None,
+         stderr: Union[TextIO, None] = None) -> int:
+    """ Run the command line tool.
+
+    :param argv:   Command line arguments (without the program name),
+                   defaults to ``sys.argv``.
+    :param stdout: Output of the commands, defaults to ``sys.stdout``.
+    :param stderr: Output of the errors, defaults to ``sys.stderr``.
+    :return: Exit code - 0 on success, 1 if the configuration is invalid or
+             cannot be loaded.
+    """
+    stdout = sys.stdout if stdout is None else stdout
+    stderr = sys.stderr if stderr is None else stderr
+    args = build_parser().parse_args(argv)
+    # Warnings (e.g. missing optional files) are reported with the errors
+    handler = logging.StreamHandler(stderr)
+    handler.setFormatter(logging.Formatter("%(levelname)s: %(message)s"))
+    logger.addHandler(handler)
+    try:
+        COMMANDS[args.command](args, stdout)
+    except (OnacolException, OSError) as e:
+        print(f"onacol {args.command}: {e}", file=stderr)
+        return 1
+    finally:
+        logger.removeHandler(handler)
+    return 0
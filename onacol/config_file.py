@@ -5,28 +5,277 @@
 
 .. moduleauthor:: Josef Nevrly <josef.nevrly@gmail.com>
 """
-from typing import Union, List, TextIO
+from typing import Union, List, TextIO, Any, Callable, Iterable, Dict
+import asyncio
 import logging
+import os
+import pickle
+import re
+import threading
 
 from ruamel.yaml import YAML, YAMLError
+from ruamel.yaml.nodes import ScalarNode
+from ruamel.yaml.representer import RoundTripRepresenter
 from cascadict import CascaDict  # type: ignore
 
 from .base import OnacolException
 from .config_schema import ConfigSchema
+from .schema_cache import SchemaCache
+from .artifact import (
+    ArtifactError,
+    file_digest,
+    new_artifact,
+    read_artifact,
+    referenced_env_vars,
+    stale_reason,
+    write_artifact,
+)
+from .flat_schema import FlatSchemaHandler
+from .layers import cascade_layers, rebase_layer
+from .stats import ConfigStats, DISABLED_STATS
+from .records import Record, RecordList, compact_records
 
+# Round-trip access, used for the default/schema file (preserves comments)
 YAML_ACCESS = YAML()
 
+
+def _represent_record_list(representer, data: RecordList):
+    return representer.represent_sequence("tag:yaml.org,2002:seq",
+                                          data.to_list())
+
+
+def _represent_record(representer, data: Record):
+    return representer.represent_mapping("tag:yaml.org,2002:map",
+                                         data.copy())
+
+
+# Compact record lists are exported as lists of dicts
+RoundTripRepresenter.add_representer(RecordList, _represent_record_list)
+RoundTripRepresenter.add_representer(Record, _represent_record)
+
+# Loaders that can be used for the overlay (optional/additional) files.
+# "safe" uses the libyaml based parser if ruamel.yaml.clib is available,
+# otherwise it falls back to the pure-Python one.
+YAML_LOADERS = {
+    "rt": YAML_ACCESS,
+    "safe": YAML(typ="safe"),
+    "pure": YAML(typ="safe", pure=True),
+}
+
 logger = logging.getLogger("onacol")
 
+# YAML instances are not thread-safe - threads other than the main one use
+# their own instances of the predefined loaders. Custom loaders are shared,
+# so their use is serialized.
+_thread_local = threading.local()
+_custom_loader_lock = threading.Lock()
+
+
+# Characters starting a scalar in the YAML source that is not a plain one
+# (quoted, block or explicitly tagged scalar).
+NON_PLAIN_SCALAR_INDICATORS = "\"'|>!"
+
+# Plain top-level key starting a section of the YAML document
+_TOP_LEVEL_KEY_REGEX = re.compile(r"([A-Za-z_][\w\-]*)[ \t]*:(?:[ \t]|$)")
+# Anchor/alias (may refer across the sections)
+_ANCHOR_REGEX = re.compile(r"[&*][\w\-]")
+
 
 class ConfigFileException(OnacolException):
     pass
 
 
+def _thread_loader(loader: YAML) -> YAML:
+    """ Get instance of the (predefined) loader, that can be used in the
+        current thread.
+    """
+    if threading.current_thread() is threading.main_thread():
+        return loader
+    try:
+        loaders = _thread_local.loaders
+    except AttributeError:
+        loaders = _thread_local.loaders = {}
+    try:
+        return loaders[id(loader)]
+    except KeyError:
+        loaders[id(loader)] = YAML(typ=loader.typ, pure=loader.pure)
+        return loaders[id(loader)]
+
+
+def _resolve_env_var_scalar(value: Any, position: Union[tuple, None],
+                            source_lines: List[str],
+                            loader: YAML = YAML_ACCESS) -> Any:
+    """ Resolve explicit env_var references in a single scalar of the parsed
+        YAML document, the same way as if they were substituted in the YAML
+        string before parsing.
+
+    :param value:         Scalar value.
+    :param position:      Tuple (line, column) of the scalar in the source.
+    :param source_lines:  Lines of the YAML source.
+    :param loader:        YAML instance used for the type resolution.
+    :return: Resolved value (or the value itself if no reference is present).
+    """
+    if not isinstance(value, str) or \
+            ConfigSchema.OC_ENV_REGEX.search(value) is None:
+        return value
+
+    resolved = ConfigSchema.resolve_explicit_env_vars(value)
+
+    # Substitution in the plain scalars is subject to YAML type resolution
+    try:
+        line, column = position  # type: ignore
+        is_plain = source_lines[line][column] not in \
+            NON_PLAIN_SCALAR_INDICATORS
+    except (TypeError, ValueError, IndexError):
+        is_plain = True
+
+    if is_plain:
+        tag = loader.resolver.resolve(ScalarNode, resolved, (True, False))
+        return loader.constructor.construct_object(
+            ScalarNode(tag, resolved))
+
+    return resolved
+
+
+def _get_position(element: Any, position_getter: str, key: Any
+                  ) -> Union[tuple, None]:
+    try:
+        return getattr(element.lc, position_getter)(key)
+    except (AttributeError, KeyError, IndexError, TypeError):
+        return None
+
+
+def _select_sections(yaml_string: str, sections: tuple) -> str:
+    """ Cut the selected top-level sections out of the YAML source (without
+        parsing it), so the other sections do not need to be parsed at all.
+
+        The whole source is returned if it cannot be split safely - i.e. if
+        there is anything else than a plain key (or comment) on the top
+        level, or if anchors/aliases are used.
+
+    :param yaml_string: YAML source.
+    :param sections:    Names of the top-level sections to keep.
+    :return: YAML source with only the selected sections.
+    """
+    if _ANCHOR_REGEX.search(yaml_string) is not None:
+        return yaml_string
+
+    selected = []
+    keep = True  # Leading comments are kept
+    for line in yaml_string.splitlines(keepends=True):
+        if line[:1] in " \t#\r\n":
+            # Section content, comment or empty line
+            if keep:
+                selected.append(line)
+            continue
+        key_match = _TOP_LEVEL_KEY_REGEX.match(line)
+        if key_match is None:
+            return yaml_string
+        keep = key_match.group(1) in sections
+        if keep:
+            selected.append(line)
+    return "".join(selected)
+
+
+def _resolve_env_vars_in_element(element: Any,
+                                 source_lines: List[str],
+                                 loader: YAML = YAML_ACCESS) -> Any:
+    """ Recursively resolve explicit env_var references in the parsed
+        (round-trip) YAML document.
+
+        Sub-trees without any reference are not copied - the same object
+        is returned, so the resolved document is just a thin overlay
+        of the original one.
+
+    :param element:       Element of the parsed YAML document.
+    :param source_lines:  Lines of the YAML source.
+    :param loader:        YAML instance used for the type resolution.
+    :return: Element with resolved env_var references.
+    """
+    if isinstance(element, dict):
+        resolved_dict = {}
+        changed = False
+        for k, v in element.items():
+            resolved_k = _resolve_env_var_scalar(
+                k, _get_position(element, "key", k), source_lines, loader)
+            if isinstance(v, (dict, list)):
+                resolved_v = _resolve_env_vars_in_element(v, source_lines,
+                                                          loader)
+            else:
+                resolved_v = _resolve_env_var_scalar(
+                    v, _get_position(element, "value", k), source_lines,
+                    loader)
+            changed = changed or (resolved_k is not k) or \
+                (resolved_v is not v)
+            resolved_dict[resolved_k] = resolved_v
+        return resolved_dict if changed else element
+
+    elif isinstance(element, list):
+        resolved_list = []
+        changed = False
+        for i, v in enumerate(element):
+            if isinstance(v, (dict, list)):
+                resolved_v = _resolve_env_vars_in_element(v, source_lines,
+                                                          loader)
+            else:
+                resolved_v = _resolve_env_var_scalar(
+                    v, _get_position(element, "item", i), source_lines,
+                    loader)
+            changed = changed or (resolved_v is not v)
+            resolved_list.append(resolved_v)
+        return resolved_list if changed else element
+
+    return element
+
+
+def _file_signature(file_path: str) -> Union[tuple, None]:
+    """ Cheap file change indicator - (mtime, size), None if not exists. """
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+_content_digest = file_digest
+
+
+class FileLayer:
+    """ Configuration file loaded as a layer of the configuration. """
+
+    __slots__ = ("path", "signature", "digest", "layer")
+
+    def __init__(self, path: str, signature: Union[tuple, None] = None,
+                 digest: Union[str, None] = None,
+                 layer: Union[CascaDict, None] = None):
+        """
+        :param path:      File path.
+        :param signature: File (mtime, size) when it was loaded.
+        :param digest:    Hash of the loaded file content.
+        :param layer:     Configuration layer created from the file (None if
+                          the file did not exist).
+        """
+        self.path = path
+        self.signature = signature
+        self.digest = digest
+        self.layer = layer
+
+    def __repr__(self):
+        return f"<FileLayer {self.path}>"
+
+
 class ConfigFileHandler:
 
     def __init__(self, default_file_path: str,
-                 optional_file_paths: Union[List[str], None] = None):
+                 optional_file_paths: Union[List[str], None] = None,
+                 schema_cache_dir: Union[str, None] = None,
+                 overlay_loader: Union[str, YAML] = "safe",
+                 env_var_prefix: Union[str, None] = None,
+                 load: bool = True,
+                 stats: Union[ConfigStats, None] = None,
+                 compact_lists: Union[int, None] = None,
+                 schema_sections: Union[Iterable[str], None] = None,
+                 artifact_path: Union[str, None] = None):
         """
 
         :param default_file_path:   Path with default configuration file that
@@ -34,13 +283,75 @@ class ConfigFileHandler:
         :param optional_file_paths: List of additional/optional configuration
                                     files that will be merged on top of the
                                     default configuration file.
+        :param schema_cache_dir:    Directory for the compiled schema cache
+                                    (see
+                                    :class:`onacol.schema_cache.SchemaCache`).
+                                    If None, schema is always parsed from
+                                    the default file.
+        :param overlay_loader:      YAML loader for the optional/additional
+                                    files - either name from
+                                    :data:`YAML_LOADERS` or ruamel YAML
+                                    instance. Default file is always loaded
+                                    with the round-trip loader.
+        :param env_var_prefix:      Environment variable prefix, for which
+                                    the flat schema mappings are stored
+                                    in the schema cache together with the
+                                    compiled schema (so the cache entry is
+                                    written only once).
+        :param load:                If False, the files are not loaded
+                                    (see :meth:`load_files` and
+                                    :meth:`load_files_async`).
+        :param stats:               Stats collecting durations of file
+                                    reading, parsing etc.
+        :param compact_lists:       Minimal length of homogeneous lists of
+                                    dicts in the default and optional/
+                                    additional configuration, that are
+                                    stored as compact
+                                    :class:`onacol.records.RecordList`.
+                                    None to keep all lists.
+        :param schema_sections:     Names of the top-level sections of the
+                                    default file to be used, the other
+                                    sections are not parsed and are
+                                    dropped from the optional/additional
+                                    files. None for all sections.
+        :param artifact_path:       Compiled configuration artifact (see
+                                    :meth:`compile_artifact`), that is
+                                    loaded instead of the files if it was
+                                    compiled from their current content.
+                                    Files are loaded if it's stale or
+                                    missing.
         """
+        self._compact_lists = compact_lists
+        self._schema_sections = None if schema_sections is None \
+            else tuple(schema_sections)
+        self._stats = stats if stats is not None else DISABLED_STATS
         self._default_file_path = default_file_path
+        try:
+            self._overlay_loader = YAML_LOADERS[overlay_loader] \
+                if isinstance(overlay_loader, str) else overlay_loader
+        except KeyError:
+            raise ConfigFileException(
+                f"Unknown YAML loader: {overlay_loader}")
+        self._schema_cache = SchemaCache(schema_cache_dir) \
+            if schema_cache_dir is not None else None
+        self._schema_cache_entry: Union[dict, None] = None
+        self._artifact_path = artifact_path
+        self._artifact_mappings: dict = {}
+        self._artifact_loaded = False
+        self._env_var_prefix = env_var_prefix
         self._config = CascaDict({})
+        # Guards replacing (and in-place changes) of the configuration,
+        # version is increased by every change
+        self._config_lock = threading.RLock()
+        self._config_version = 0
         self._schema: ConfigSchema = ConfigSchema({})
         self._schema_yaml: dict = {}  # Stored separately to preserve comments
+        # Pickled schema_yaml from the artifact, loaded on the first export
+        self._pending_schema_yaml: Union[bytes, None] = None
         self._optional_file_paths = optional_file_paths or []
-        self.load_files()
+        self._file_layers: List[FileLayer] = []
+        if load:
+            self.load_files()
 
     @property
     def default_config_file(self) -> str:
@@ -60,7 +371,24 @@ class ConfigFileHandler:
 
     @configuration.setter
     def configuration(self, value: dict):
-        self._config = value
+        with self._config_lock:
+            self._config = value
+            self._config_version += 1
+
+    @property
+    def config_lock(self) -> threading.RLock:
+        """ Lock to be held while the configuration is changed (it's
+            replaced or modified in place).
+        """
+        return self._config_lock
+
+    def configuration_modified(self) -> None:
+        """ Register in-place change of the configuration (with
+            :attr:`config_lock` held), so a reload running meanwhile
+            does not drop it.
+        """
+        with self._config_lock:
+            self._config_version += 1
 
     @property
     def config_schema(self) -> ConfigSchema:
@@ -74,40 +402,402 @@ class ConfigFileHandler:
     def has_defaults(self) -> bool:
         return self._default_file_path is not None
 
-    def _load_yaml_file(self, yaml_file_path: str,
-                        resolve_env_vars=True) -> dict:
+    @property
+    def schema_cache(self) -> Union[SchemaCache, None]:
+        return self._schema_cache
+
+    @property
+    def artifact_path(self) -> Union[str, None]:
+        return self._artifact_path
+
+    @property
+    def artifact_loaded(self) -> bool:
+        """ Whether the configuration was loaded from the artifact (not from
+            the files).
+        """
+        return self._artifact_loaded
+
+    @property
+    def file_layers(self) -> List[FileLayer]:
+        """ Optional and additional files loaded as configuration layers
+            (in the loading order).
+        """
+        return self._file_layers
+
+    @staticmethod
+    def _read_file(file_path: str) -> str:
+        with open(file_path) as text_file:
+            return text_file.read()
+
+    @staticmethod
+    def _parse_yaml_string(yaml_string: str, resolve_env_vars=True,
+                           loader: YAML = YAML_ACCESS) -> dict:
         try:
-            with open(yaml_file_path) as yaml_file:
-                yaml_string = yaml_file.read()
-                if resolve_env_vars:
-                    yaml_string = ConfigSchema.resolve_explicit_env_vars(
-                        yaml_string)
-                return YAML_ACCESS.load(yaml_string)
+            if resolve_env_vars:
+                yaml_string = ConfigSchema.resolve_explicit_env_vars(
+                    yaml_string)
+            if loader in YAML_LOADERS.values():
+                return _thread_loader(loader).load(yaml_string)
+            with _custom_loader_lock:
+                return loader.load(yaml_string)
         except YAMLError as ye:
             raise ConfigFileException(f"Cannot parse config file: {str(ye)}")
         # except FileNotFoundError as fnf:
         #     raise ConfigFileException(f"Error reading file: {str(fnf)}")
 
+    def _read_config_file(self, file_path: str) -> str:
+        with self._stats.phase("read_file"):
+            yaml_string = self._read_file(file_path)
+        if self._stats.enabled:
+            self._stats.count("files_read")
+            self._stats.count("bytes_read", len(yaml_string.encode()))
+        return yaml_string
+
+    def _parse_config_file(self, yaml_string: str, resolve_env_vars=True,
+                           loader: YAML = YAML_ACCESS) -> dict:
+        with self._stats.phase("parse_yaml"):
+            return self._parse_yaml_string(yaml_string,
+                                           resolve_env_vars=resolve_env_vars,
+                                           loader=loader)
+
+    def _load_yaml_file(self, yaml_file_path: str,
+                        resolve_env_vars=True,
+                        loader: YAML = YAML_ACCESS) -> dict:
+        return self._parse_yaml_string(self._read_file(yaml_file_path),
+                                       resolve_env_vars=resolve_env_vars,
+                                       loader=loader)
+
+    def _load_schema(self) -> None:
+        """ Parse the default file into the schema (or restore the schema
+            from the schema cache).
+        """
+        yaml_string = self._read_config_file(self._default_file_path)
+
+        cache_key = None
+        if self._schema_cache is not None:
+            cache_key = self._schema_cache.cache_key(yaml_string,
+                                                     self._schema_sections)
+            with self._stats.phase("schema_cache_load"):
+                entry = self._schema_cache.load(self._default_file_path,
+                                                cache_key)
+            self._stats.count("schema_cache_hits" if entry is not None
+                              else "schema_cache_misses")
+            if entry is not None:
+                self._schema_cache_entry = entry
+                self._schema_yaml = entry["schema_yaml"]
+                self._schema = ConfigSchema.from_compiled(entry["schema"])
+                return
+
+        if self._schema_sections is not None:
+            yaml_string = _select_sections(yaml_string, self._schema_sections)
+
+        # The document is parsed only once, in the round-trip form
+        # (to preserve comments for the export). Explicit env_vars are then
+        # resolved directly in the parsed tree.
+        self._schema_yaml = self._parse_config_file(yaml_string,
+                                                    resolve_env_vars=False)
+        if ConfigSchema.OC_ENV_REGEX.search(yaml_string) is None:
+            resolved_schema = self._schema_yaml
+        else:
+            with self._stats.phase("resolve_env_vars"):
+                resolved_schema = _resolve_env_vars_in_element(
+                    self._schema_yaml, yaml_string.splitlines(),
+                    _thread_loader(YAML_ACCESS))
+        self._schema = ConfigSchema(resolved_schema, stats=self._stats,
+                                    sections=self._schema_sections)
+
+        if self._schema_cache is not None:
+            self._schema_cache_entry = {
+                "key": cache_key,
+                "schema_yaml": self._schema_yaml,
+                "schema": self._schema.to_compiled(),
+                "flat_mappings": {},
+            }
+            if self._env_var_prefix is not None:
+                self._schema_cache_entry["flat_mappings"][
+                    self._env_var_prefix] = FlatSchemaHandler(
+                        self._schema.flat_schema,
+                        env_var_prefix=self._env_var_prefix,
+                        stats=self._stats).mappings
+            with self._stats.phase("schema_cache_store"):
+                self._schema_cache.store(self._default_file_path,
+                                         self._schema_cache_entry)
+
+    def get_cached_flat_mappings(self, env_var_prefix: str
+                                 ) -> Union[tuple, None]:
+        """ Get flat schema mappings (env_var and CLI option mapping) stored
+            in the schema cache for given env_var prefix.
+
+        :param env_var_prefix: Environment variable prefix.
+        :return: Tuple (env_var_mapping, cli_opt_mapping) or None if not
+                 cached.
+        """
+        if env_var_prefix in self._artifact_mappings:
+            return self._artifact_mappings[env_var_prefix]
+        if self._schema_cache_entry is None:
+            return None
+        return self._schema_cache_entry["flat_mappings"].get(env_var_prefix)
+
+    def store_flat_mappings(self, env_var_prefix: str,
+                            mappings: tuple) -> None:
+        """ Store flat schema mappings for given env_var prefix in the schema
+            cache (no-op if schema cache is not used).
+
+        :param env_var_prefix: Environment variable prefix.
+        :param mappings: Tuple (env_var_mapping, cli_opt_mapping).
+        """
+        if self._schema_cache is None or self._schema_cache_entry is None:
+            return
+        self._schema_cache_entry["flat_mappings"][env_var_prefix] = mappings
+        self._schema_cache.store(self._default_file_path,
+                                 self._schema_cache_entry)
+
     def load_files(self) -> None:
         """ Load default and optional config file and parse them into the
             configuration.
         """
+        if self._artifact_path is not None and \
+                self._load_artifact(self._artifact_path):
+            return
+        self._artifact_mappings = {}
+        self._pending_schema_yaml = None
         if self.has_defaults:
-            self._schema_yaml = self._load_yaml_file(
-                self._default_file_path, resolve_env_vars=False)
-            tmp_schema = self._load_yaml_file(self._default_file_path)
-            self._schema = ConfigSchema(tmp_schema)
-            self._config = CascaDict(self._schema.defaults)
-        else:
-            self._config = CascaDict({})
-            self._schema = ConfigSchema({})
+            self._load_schema()
+        self._merge_file_layers([self._read_optional_file(opt_file)
+                                 for opt_file in self._optional_file_paths])
+
+    async def load_files_async(self, executor: Any = None) -> None:
+        """ Asynchronous :meth:`load_files` - default and optional files are
+            read and parsed concurrently in the executor, then merged
+            in the declared order (also in the executor).
+
+        :param executor: :class:`concurrent.futures.Executor`, None for the
+                         default executor of the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        if self._artifact_path is not None and \
+                await loop.run_in_executor(executor, self._load_artifact,
+                                           self._artifact_path):
+            return
+        self._artifact_mappings = {}
+        self._pending_schema_yaml = None
+        jobs = [loop.run_in_executor(executor, self._read_optional_file,
+                                     opt_file)
+                for opt_file in self._optional_file_paths]
+        if self.has_defaults:
+            jobs.append(loop.run_in_executor(executor, self._load_schema))
+        results = await asyncio.gather(*jobs)
+        await loop.run_in_executor(
+            executor, self._merge_file_layers,
+            results[:len(self._optional_file_paths)])
+
+    def compile_artifact(self, artifact_path: str) -> None:
+        """ Compile the default file and the optional files into a binary
+            artifact - parsed schema, defaults, schema registry, flat schema
+            mappings (for the handler's env_var prefix), parsed optional
+            files and the round-trip form of the default file (for
+            the export). Loading the artifact skips the YAML parsing and
+            schema processing.
+
+            The artifact is valid only for the same onacol and Python
+            version, the same content of the files and the same values of
+            referenced explicit env vars.
+
+        :param artifact_path: Destination path of the artifact.
+        """
+        if not self.has_defaults:
+            raise ConfigFileException(
+                "Artifact can be compiled only with a default file.")
+        # Compiled by a separate handler, so the current state is kept
+        compiler = ConfigFileHandler(
+            self._default_file_path, self._optional_file_paths,
+            overlay_loader=self._overlay_loader,
+            env_var_prefix=self._env_var_prefix, load=False,
+            stats=self._stats, compact_lists=self._compact_lists,
+            schema_sections=self._schema_sections)
+        compiler._write_artifact(artifact_path)
+
+    def _write_artifact(self, artifact_path: str) -> None:
+        default_yaml = self._read_file(self._default_file_path)
+        yaml_strings = [default_yaml]
+        self._load_schema()
+
+        files: List[tuple] = []
+        for file_path in self._optional_file_paths:
+            try:
+                yaml_string = self._read_config_file(file_path)
+            except FileNotFoundError:
+                files.append((file_path, None, None))
+                continue
+            yaml_strings.append(yaml_string)
+            files.append((file_path, _content_digest(yaml_string),
+                          self._parse_overlay(yaml_string)))
+
+        flat_mappings = {}
+        if self._env_var_prefix is not None:
+            flat_mappings[self._env_var_prefix] = FlatSchemaHandler(
+                self._schema.flat_schema,
+                env_var_prefix=self._env_var_prefix).mappings
+
+        write_artifact(new_artifact(
+            (self._default_file_path, _content_digest(default_yaml)),
+            files, referenced_env_vars(yaml_strings), self._schema_sections,
+            pickle.dumps(self._schema_yaml, protocol=pickle.HIGHEST_PROTOCOL),
+            self._schema.to_compiled(), flat_mappings
+        ), artifact_path)
+
+    def _load_artifact(self, artifact_path: str) -> bool:
+        """ Load the configuration from the artifact.
 
-        for opt_file in self._optional_file_paths:
+        :param artifact_path: Artifact path.
+        :return: False if the artifact is missing, invalid or stale
+                 (the files need to be loaded).
+        """
+        if not self.has_defaults:
+            return False
+        with self._stats.phase("artifact_load"):
             try:
-                self.load_additional_file(opt_file)
+                artifact = read_artifact(artifact_path)
             except FileNotFoundError:
-                logger.warning("Optional config file at %s not found.",
-                               opt_file)
+                logger.warning("Configuration artifact %s not found, "
+                               "loading configuration files.",
+                               artifact_path)
+                artifact = None
+            except (ArtifactError, OSError) as e:
+                logger.warning("%s, loading configuration files.", str(e))
+                artifact = None
+
+            if artifact is not None:
+                default_yaml = self._read_config_file(
+                    self._default_file_path)
+                file_contents: List[Union[str, None]] = []
+                for file_path in self._optional_file_paths:
+                    try:
+                        file_contents.append(
+                            self._read_config_file(file_path))
+                    except FileNotFoundError:
+                        file_contents.append(None)
+                reason = stale_reason(artifact, default_yaml, file_contents,
+                                      self._schema_sections)
+                if reason is not None:
+                    logger.info("Configuration artifact %s is stale (%s), "
+                                "loading configuration files.",
+                                artifact_path, reason)
+                    artifact = None
+
+            self._artifact_loaded = artifact is not None
+            if artifact is None:
+                self._stats.count("artifact_misses")
+                return False
+            self._stats.count("artifact_hits")
+
+            self._schema_cache_entry = None
+            self._artifact_mappings = artifact["flat_mappings"]
+            self._schema_yaml = {}
+            self._pending_schema_yaml = artifact["schema_yaml"]
+            self._schema = ConfigSchema.from_compiled(artifact["schema"])
+            self._merge_file_layers([
+                None if digest is None else
+                (_file_signature(file_path), digest, parsed)
+                for file_path, (_, digest, parsed) in zip(
+                    self._optional_file_paths, artifact["files"])
+            ], from_artifact=True)
+        return True
+
+    def _read_optional_file(self, file_path: str) -> Union[tuple, None]:
+        try:
+            return self.read_file_layer(file_path)
+        except FileNotFoundError:
+            logger.warning("Optional config file at %s not found.",
+                           file_path)
+            return None
+
+    def _merge_file_layers(self, file_data_list: List[Union[tuple, None]],
+                           from_artifact: bool = False) -> None:
+        with self._config_lock:
+            if self.has_defaults:
+                if self._compact_lists is not None:
+                    self._schema.compact_records(self._compact_lists)
+                self.configuration = CascaDict(self._schema.defaults)
+            else:
+                self.configuration = CascaDict({})
+                self._schema = ConfigSchema({})
+
+            self._file_layers = []
+            for opt_file, file_data in zip(self._optional_file_paths,
+                                           file_data_list):
+                if file_data is None:
+                    # Tracked, so it's loaded by reload when it appears
+                    self._file_layers.append(FileLayer(opt_file))
+                elif from_artifact:
+                    # Restored from the artifact (lists are pickled expanded)
+                    signature, digest, parsed = file_data
+                    if self._compact_lists is not None:
+                        parsed = compact_records(parsed, self._compact_lists)
+                    self._add_layer(opt_file, signature, digest,
+                                    self.cascade_file_layer(
+                                        (signature, None, parsed)))
+                else:
+                    self.add_file_layer(opt_file, file_data)
+
+    def read_file_layer(self, file_path: str) -> tuple:
+        """ Read and parse config file (can be called from any thread).
+
+        :param file_path:  Config file path.
+        :return: Tuple (file signature, file content, parsed configuration)
+                 to be added by :meth:`add_file_layer`.
+        """
+        signature = _file_signature(file_path)
+        yaml_string = self._read_config_file(file_path)
+        return signature, yaml_string, self._parse_overlay(yaml_string)
+
+    def _parse_overlay(self, yaml_string: str) -> dict:
+        parsed = self._parse_config_file(yaml_string,
+                                         loader=self._overlay_loader)
+        if self._schema_sections is not None and isinstance(parsed, dict):
+            parsed = {k: v for k, v in parsed.items()
+                      if k in self._schema_sections}
+        if self._compact_lists is not None:
+            parsed = compact_records(parsed, self._compact_lists)
+        return parsed
+
+    def cascade_file_layer(self, file_data: tuple,
+                           config: Union[CascaDict, None] = None
+                           ) -> CascaDict:
+        """ Create configuration layer from the parsed file (the handler's
+            configuration is not changed).
+
+        :param file_data: Parsed file (see :meth:`read_file_layer`).
+        :param config:    Base configuration, defaults to the current one.
+        :return: New top layer.
+        """
+        config = self._config if config is None else config
+        if config:
+            return config.cascade(file_data[2])
+        return CascaDict(file_data[2])
+
+    def add_file_layer(self, file_path: str, file_data: tuple,
+                       layer: Union[CascaDict, None] = None) -> None:
+        """ Merge the parsed file on top of the current configuration.
+
+        :param file_path: Config file path.
+        :param file_data: Parsed file (see :meth:`read_file_layer`).
+        :param layer:     Layer created by :meth:`cascade_file_layer` (it's
+                          created from the `file_data` if None).
+        """
+        signature, yaml_string, _ = file_data
+        with self._config_lock:
+            self._add_layer(file_path, signature,
+                            _content_digest(yaml_string),
+                            self.cascade_file_layer(file_data)
+                            if layer is None else layer)
+
+    def _add_layer(self, file_path: str, signature: Union[tuple, None],
+                   digest: str, layer: CascaDict) -> None:
+        self.configuration = layer
+        self._stats.count("layers_created")
+        self._file_layers.append(FileLayer(file_path, signature, digest,
+                                           layer))
 
     def load_additional_file(self, file_path):
         """ Load additional config file. If previous config is defined, it will
@@ -115,10 +805,151 @@ class ConfigFileHandler:
 
         :param file_path:  Config file path.
         """
-        if self._config:
-            self._config = self._config.cascade(self._load_yaml_file(file_path))
-        else:
-            self._config = CascaDict(self._load_yaml_file(file_path))
+        self.add_file_layer(file_path, self.read_file_layer(file_path))
+
+    def top_file_layer(self, config: Union[CascaDict, None] = None
+                       ) -> Union[CascaDict, None]:
+        """ Get the top-most configuration layer loaded from a file.
+
+        :param config: Configuration (top layer), defaults to the current one.
+        :return: The layer or None if no file layer is in the configuration.
+        """
+        file_layer_ids = {id(f.layer) for f in self._file_layers
+                          if f.layer is not None}
+        for layer in reversed(cascade_layers(
+                self._config if config is None else config)):
+            if id(layer) in file_layer_ids:
+                return layer
+        return None
+
+    def changed_files(self) -> dict:
+        """ Check the file layers for changes. File content is read and
+            compared only if the file modification time or size changed.
+
+        :return: Dict of changed :class:`FileLayer` mapped to tuple
+                 (new file signature, new file content), content is None
+                 if the file was deleted.
+        """
+        changes: Dict[FileLayer, tuple] = {}
+        for file_layer in self._file_layers:
+            signature = _file_signature(file_layer.path)
+            if signature == file_layer.signature:
+                continue
+            try:
+                if signature is None:
+                    raise FileNotFoundError
+                yaml_string = self._read_config_file(file_layer.path)
+            except FileNotFoundError:
+                changes[file_layer] = (None, None)
+                continue
+            if _content_digest(yaml_string) == file_layer.digest:
+                # Touched only
+                file_layer.signature = signature
+            else:
+                changes[file_layer] = (signature, yaml_string)
+        return changes
+
+    def reload_files(self, check: Union[Callable, None] = None,
+                     on_reload: Union[Callable, None] = None) -> bool:
+        """ Reload changed optional/additional files. Only the changed files
+            are parsed, the configuration chain is then rebuilt from the
+            layers already in the configuration - layers of unchanged files
+            and runtime layers (env vars, CLI options, dicts) are re-created
+            on top of the reloaded ones.
+
+            The chain is rebuilt and the new configuration replaces
+            the current one with :attr:`config_lock` held. If
+            the configuration is changed while the new one is checked,
+            the chain is rebuilt again (the change is not lost).
+
+            Default file is not reloaded (it defines the schema).
+
+        :param check:     Optional callable, that gets the new configuration
+                          before it replaces the current one. If it raises,
+                          the current configuration is kept (and
+                          the changes are reported again by the next
+                          reload).
+        :param on_reload: Optional callable (without arguments) called right
+                          after the new configuration replaced the current
+                          one, with :attr:`config_lock` still held.
+        :return: True if the configuration was reloaded.
+        """
+        changes = self.changed_files()
+        if not changes:
+            return False
+
+        parsed = {}
+        for file_layer, (_, yaml_string) in changes.items():
+            parsed[file_layer] = {} if yaml_string is None else \
+                (self._parse_overlay(yaml_string) or {})
+
+        while True:
+            with self._config_lock:
+                version = self._config_version
+                top, new_layers = self._rebuild_layers(parsed)
+
+            if check is not None:
+                check(top)
+
+            with self._config_lock:
+                if self._config_version != version:
+                    # Changed meanwhile, rebuild on top of the changes
+                    continue
+                for file_layer, (signature, yaml_string) in changes.items():
+                    file_layer.signature = signature
+                    file_layer.digest = None if yaml_string is None else \
+                        _content_digest(yaml_string)
+                for file_layer, layer in new_layers.items():
+                    file_layer.layer = layer
+                self.configuration = top
+                self._stats.count("files_reloaded", len(changes))
+                if on_reload is not None:
+                    on_reload()
+                return True
+
+    def _rebuild_layers(self, parsed: dict) -> tuple:
+        """ Rebuild the configuration chain with the reloaded files.
+
+        :param parsed: Reloaded :class:`FileLayer` mapped to the parsed
+                       content.
+        :return: Tuple (new configuration, dict of :class:`FileLayer`
+                 mapped to the new layer).
+        """
+        layers = cascade_layers(self._config)
+        layer_files = {id(f.layer): f for f in self._file_layers
+                       if f.layer is not None}
+
+        # Files that did not exist are inserted right above the layer of the
+        # previous file
+        appeared: dict = {}
+        anchor = layers[0]
+        for file_layer in self._file_layers:
+            if file_layer.layer is not None:
+                anchor = file_layer.layer
+            elif file_layer in parsed:
+                appeared.setdefault(id(anchor), []).append(file_layer)
+
+        new_layers = {}
+        top = layers[0]
+        for i, layer in enumerate(layers):
+            if i > 0:
+                layer_file = layer_files.get(id(layer))
+                if layer_file in parsed:
+                    top = top.cascade(parsed[layer_file])
+                else:
+                    top = rebase_layer(layer, top)
+                if layer_file is not None:
+                    new_layers[layer_file] = top
+            for file_layer in appeared.get(id(layer), []):
+                top = top.cascade(parsed[file_layer])
+                new_layers[file_layer] = top
+
+        for file_layer in parsed:
+            if file_layer not in new_layers:
+                logger.warning("Config file %s is no longer a separate "
+                               "layer of the configuration, changes are "
+                               "not reloaded.", file_layer.path)
+        return top, new_layers
 
     def save_with_schema(self, config: dict, save_file: TextIO) -> None:
         """ Save the configuration to the YAML file, keeping the original
@@ -131,7 +962,20 @@ class ConfigFileHandler:
         # (that is valid YAML 1.2)
         # Leaving as it is, if it becomes problem, here is a solution:
         # https://stackoverflow.com/a/44314840
+        if self._pending_schema_yaml is not None:
+            self._schema_yaml = pickle.loads(self._pending_schema_yaml)
+            self._pending_schema_yaml = None
         YAML_ACCESS.dump(
             self._schema.schema_to_yaml(self._schema_yaml, config),
             save_file
         )
+
+    @staticmethod
+    def save_overlay(overlay: dict, save_file: TextIO) -> None:
+        """ Save the configuration overlay (e.g. only changed values, see
+            :func:`onacol.diff.config_delta`) to the YAML file.
+
+        :param overlay: The configuration overlay to be saved.
+        :param save_file: Destination file-like (text) object.
+        """
+        YAML_ACCESS.dump(overlay, save_file)
@@ -5,16 +5,20 @@
 
 .. moduleauthor:: Josef Nevrly <josef.nevrly@gmail.com>
 """
-from typing import Any, List, Union
+from typing import Any, List, Union, Iterable
 import copy
 import re
 import os
 import logging
 
 from cerberus.schema import SchemaRegistry  # type: ignore
+from ruamel.yaml.scalarstring import ScalarString
 
 from .base import OnacolException
 from .flat_schema import FlatValueType, FlatSchemaMetadata
+from .stats import ConfigStats, DISABLED_STATS
+from .records import compact_records
+from .fingerprint import config_fingerprint
 
 logger = logging.getLogger("onacol")
 
@@ -57,21 +61,39 @@ class ConfigSchema:
     OC_ENV_REGEX = re.compile(
         r"\$\{\s*oc_env\s*:\s*(?P<var_name>[a-zA-Z_]+[a-zA-Z0-9_]*)\s*}")
 
-    def __init__(self, schema_source: dict):
+    def __init__(self, schema_source: dict,
+                 stats: Union[ConfigStats, None] = None,
+                 lazy: bool = False,
+                 sections: Union[Iterable[str], None] = None):
         """
         :param schema_source: Configuration schema dictionary.
+        :param stats:         Stats collecting the schema processing
+                              duration and number of visited nodes.
+        :param lazy:          Parse the top-level sections of the schema
+                              on first access (see :meth:`section`).
+                              Accessing the whole :attr:`schema`,
+                              :attr:`defaults` etc. parses all the
+                              remaining sections.
+        :param sections:      Names of the top-level sections to be parsed,
+                              the other sections are ignored. None for all
+                              the sections.
         """
+        self._stats = stats if stats is not None else DISABLED_STATS
+        self._nodes_visited = 0
         self._schema_source: dict = schema_source
+        self._sections = None if sections is None else tuple(sections)
+        self._pending: dict = {}  # Top-level sections not parsed yet
         self._schema: dict = {}
         self._flat_schema: dict = {}  # Used for ENV_VAR list
         self._defaults: dict = {}
         self._descriptions: dict = {}
         self._validator = None
         self._schema_registry = SchemaRegistry()
-        self.parse_schema(self._schema_source)
+        self._fingerprint: Union[str, None] = None
+        self.parse_schema(self._schema_source, lazy=lazy)
 
     def __bool__(self):
-        return bool(self._schema)
+        return bool(self.schema)
 
     @classmethod
     def _substitute_explicit_env_var(cls, env_var_match):
@@ -97,6 +119,7 @@ class ConfigSchema:
     def schema(self) -> dict:
         """ Configuration schema.
         """
+        self._parse_pending()
         return self._schema
 
     @property
@@ -104,19 +127,104 @@ class ConfigSchema:
         """ Flattened configuration schema
             (used for mapping environment variables).
         """
+        self._parse_pending()
         return self._flat_schema
 
     @property
     def schema_registry(self) -> SchemaRegistry:
         """ Cerberus SchemaRegistry object used for configuration validation.
         """
+        # Referenced schema can be defined in any section
+        self._parse_pending()
         return self._schema_registry
 
     @property
     def defaults(self) -> dict:
         """ Configuration default values. """
+        self._parse_pending()
         return self._defaults
 
+    @property
+    def sections(self) -> Union[tuple, None]:
+        """ Names of the selected top-level sections (None if all the
+            sections are used).
+        """
+        return self._sections
+
+    @property
+    def pending_sections(self) -> list:
+        """ Names of the top-level sections not parsed yet (lazy mode). """
+        return list(self._pending)
+
+    def section(self, name: str) -> tuple:
+        """ Get single top-level section of the schema. In the lazy mode,
+            only this section is parsed (on first access).
+
+        :param name: Section name.
+        :return: Tuple (schema, defaults) of the section, schema is None
+                 if the section has no schema.
+        """
+        if name in self._pending:
+            self._parse_section(name)
+        return self._schema.get(name), self._defaults[name]
+
+    @property
+    def fingerprint(self) -> str:
+        """ Fingerprint of the parsed schema - validation schema, defaults
+            and schema references (hex string, see
+            :class:`onacol.fingerprint.ConfigFingerprint`).
+        """
+        if self._fingerprint is None:
+            self._fingerprint = config_fingerprint({
+                "schema": self.schema,
+                "defaults": self.defaults,
+                "schema_registry": self.schema_registry.all(),
+            })
+        return self._fingerprint
+
+    def compact_records(self, min_length: int) -> None:
+        """ Store homogeneous lists of dicts (all items with the same keys)
+            in the default configuration as compact
+            :class:`onacol.records.RecordList`.
+
+        :param min_length: Minimal length of lists to be compacted.
+        """
+        self._defaults = compact_records(self.defaults, min_length)
+
+    def to_compiled(self) -> dict:
+        """ Export the parsed schema state, so it can be stored (e.g. in the
+            schema cache) and restored without parsing the schema source
+            again.
+
+        :return: Dict with the parsed schema state.
+        """
+        self._parse_pending()
+        return {
+            "schema": self._schema,
+            "defaults": self._defaults,
+            "descriptions": self._descriptions,
+            "flat_schema": self._flat_schema,
+            "schema_registry": self._schema_registry.all(),
+            "sections": self._sections,
+        }
+
+    @classmethod
+    def from_compiled(cls, compiled: dict) -> "ConfigSchema":
+        """ Create schema instance from the state exported by
+            :meth:`to_compiled`.
+
+        :param compiled: Parsed schema state.
+        :return: ConfigSchema instance.
+        """
+        config_schema = cls({}, sections=compiled.get("sections"))
+        config_schema._schema = compiled["schema"]
+        config_schema._defaults = compiled["defaults"]
+        config_schema._descriptions = compiled["descriptions"]
+        config_schema._flat_schema = compiled["flat_schema"]
+        config_schema._schema_registry = SchemaRegistry(
+            compiled["schema_registry"])
+        return config_schema
+
     # @property
     # def descriptions(self) -> dict:
     #     """ Config item descriptions (not used in current version.)"""
@@ -140,20 +248,93 @@ class ConfigSchema:
             # It's just a value
             return True
 
-    def parse_schema(self, schema_source: dict):
+    def _splits_to_sections(self, schema_source: Any) -> bool:
+        """ Check if the top-level element can be parsed by sections
+            (mapping without schema metadata).
+        """
+        return isinstance(schema_source, dict) and \
+            not any(k in self.OC_TOKENS for k in schema_source)
+
+    def parse_schema(self, schema_source: dict, lazy: bool = False):
         """ Parse default configuration including schema metadata.
             During parsing, the schema for validation, default configuration
             values and flattened schema for environment variable parsing is
             processed.
+
+        :param schema_source: Configuration schema dictionary.
+        :param lazy:          Only register the top-level sections, they are
+                              parsed on first access.
         """
         self._flat_schema = {}
+        self._pending = {}
+        self._fingerprint = None
 
         # No meaning parsing empty schema
         if not schema_source:
             return
 
-        self._schema, self._defaults, self._descriptions = \
-            self._process_schema_element(schema_source, [], top_level=True)
+        if lazy or self._sections is not None:
+            if self._splits_to_sections(schema_source):
+                self._schema, self._defaults, self._descriptions = {}, {}, {}
+                self._pending = {k: v for k, v in schema_source.items()
+                                 if self._sections is None
+                                 or k in self._sections}
+                if not lazy:
+                    self._parse_pending()
+                return
+            if self._sections is not None:
+                raise SchemaException(
+                    "Schema sections can be selected only if the top level "
+                    "of the schema is a mapping without schema metadata.")
+            # Top level with schema metadata is parsed at once
+
+        self._nodes_visited = 0
+        with self._stats.phase("schema"):
+            self._schema, self._defaults, self._descriptions = \
+                self._process_schema_element(schema_source, [],
+                                             top_level=True)
+        self._stats.count("schema_nodes", self._nodes_visited)
+
+    def _parse_section(self, name: str) -> None:
+        """ Parse single top-level section (as in parsing of the whole
+            top-level element).
+        """
+        section_source = self._pending.pop(name)
+        self._nodes_visited = 0
+        with self._stats.phase("schema"):
+            schema, default, description = \
+                self._process_schema_element(section_source, [name])
+        self._stats.count("schema_nodes", self._nodes_visited)
+
+        if schema is not None:
+            self._schema[name] = schema
+        self._defaults[name] = default
+        self._descriptions[name] = description
+
+    def _parse_pending(self) -> None:
+        """ Parse all the remaining top-level sections. """
+        if not self._pending:
+            return
+        reorder = len(self._defaults) > 0
+        for name in list(self._pending):
+            self._parse_section(name)
+        if not reorder:
+            return
+
+        # Keep the document order of the sections (as if parsed at once)
+        order = {name: i for i, name in enumerate(self._schema_source)}
+        self._schema = {
+            k: self._schema[k]
+            for k in sorted(self._schema, key=lambda name: order[name])}
+        self._defaults = {
+            k: self._defaults[k]
+            for k in sorted(self._defaults, key=lambda name: order[name])}
+        self._descriptions = {
+            k: self._descriptions[k]
+            for k in sorted(self._descriptions, key=lambda name: order[name])}
+        self._flat_schema = {
+            k: self._flat_schema[k]
+            for k in sorted(self._flat_schema, key=lambda p: order[p[0]])}
 
     def _process_schema_element(self, schema_source: Any,
                                 document_path: Union[List[str], None],
@@ -174,6 +355,7 @@ class ConfigSchema:
         schema = None  # type: ignore
         default = None
         description = None
+        self._nodes_visited += 1
         if self._element_is_leaf(schema_source):
             if _has_subelement(schema_source, self.OC_SCHEMA):
                 schema = schema_source[self.OC_SCHEMA]
@@ -267,11 +449,33 @@ class ConfigSchema:
 
         return schema, default, description
 
+    @staticmethod
+    def _export_container(schema_element: Any) -> Any:
+        """ Empty container of the schema element type, with copy of its
+            YAML attributes (comments, format, anchor etc.).
+        """
+        container = schema_element.__class__()
+        if hasattr(schema_element, "copy_attributes"):
+            schema_element.copy_attributes(container, memo={})
+        return container
+
+    @staticmethod
+    def _export_value(schema_value: Any, value: Any) -> Any:
+        # Keep the scalar string style (as Ruamel YAML containers do on
+        # item replacement)
+        if isinstance(value, str) and \
+                not isinstance(value, ScalarString) and \
+                isinstance(schema_value, ScalarString):
+            return type(schema_value)(value)
+        return value
+
     def _export_schema_element(self, schema_element: Any,
                                config_data: Any) -> Any:
         """ Recursively parse through the schema and current config to generate
             YAML file that retains the format of the default config file
             (including comments etc.) but contains the current config data.
+            The schema element is not modified, new containers are created
+            for the export (sharing the config values).
 
         :param schema_element:  Element of the configuration schema.
         :param config_data:     Element of the current configuration, mathcing
@@ -280,43 +484,37 @@ class ConfigSchema:
         """
         if self._element_is_leaf(schema_element):
             return config_data
-        else:
-            # It's just a branching to deeper dict or list
-            pop_list = []
-            if isinstance(schema_element, dict):
-                for k, v in schema_element.items():
-                    if k in self.OC_TOKENS:
-                        pop_list.append(k)
-                        continue
-
-                    schema_element[k] = \
-                        self._export_schema_element(v, config_data[k])
-
-                for k in pop_list:
-                    schema_element.pop(k)
 
-            elif isinstance(schema_element, list):
-
-                trim_length = 0
-                for i, item in enumerate(schema_element):
-                    try:
-                        schema_element[i] = \
-                            self._export_schema_element(item, config_data[i])
-                    except IndexError:
-                        trim_length += 1
-
-                # Trim the end or append extra config
-                if trim_length > 0:
-                    for i in range(trim_length):
-                        schema_element.pop()
-                else:
-                    len_schema = len(schema_element)
-                    len_config = len(config_data)
-                    if len_schema < len_config:
-                        for i in range(len_schema, len_config):
-                            schema_element.append(config_data[i])
+        # It's just a branching to deeper dict or list
+        exported = self._export_container(schema_element)
+        if isinstance(schema_element, dict):
+            for k, v in schema_element.items():
+                if k in self.OC_TOKENS:
+                    continue
+
+                exported[k] = self._export_value(
+                    v, self._export_schema_element(v, config_data[k]))
+
+        elif isinstance(schema_element, list):
+
+            trim_length = 0
+            for i, item in enumerate(schema_element):
+                try:
+                    exported.append(self._export_value(
+                        item,
+                        self._export_schema_element(item, config_data[i])))
+                except IndexError:
+                    exported.append(item)
+                    trim_length += 1
+
+            # Trim the end or append extra config
+            if trim_length > 0:
+                for i in range(trim_length):
+                    exported.pop()
+            else:
+                exported.extend(config_data[len(schema_element):])
 
-            return schema_element
+        return exported
 
     def schema_to_yaml(self, schema_yaml, config):
         """ Strips original schema document of schema metadata, replacing them
@@ -327,9 +525,16 @@ class ConfigSchema:
         :return:  Schema dict updated by the configuration dict and stripped of
                     the Onacol metadata.
         """
-
-        temp = copy.deepcopy(schema_yaml)
-        self._export_schema_element(temp, config)
-        return temp
+        if self._element_is_leaf(schema_yaml):
+            # No configuration structure to export
+            return copy.deepcopy(schema_yaml)
+        if self._sections is not None:
+            # Only the selected sections are in the configuration
+            selected = self._export_container(schema_yaml)
+            for k, v in schema_yaml.items():
+                if k in self._sections:
+                    selected[k] = v
+            schema_yaml = selected
+        return self._export_schema_element(schema_yaml, config)
 
 
@@ -0,0 +1,194 @@
+"""
+.. module: onacol.diff
+   :synopsis: Differences between configurations.
+
+.. moduleauthor:: Josef Nevrly <josef.nevrly@gmail.com>
+"""
+from typing import Any, Iterable, List
+from collections import abc, namedtuple
+
+from cascadict import CascaDict  # type: ignore
+
+from .flat_schema import FlatValueType
+
+_MISSING = object()
+
+
+def _flat(config: Any) -> Any:
+    return config.copy_flat() if isinstance(config, CascaDict) else config
+
+
+# Base types of the values (round-trip YAML loads some of the values
+# as subclasses, e.g. float as ScalarFloat)
+_VALUE_TYPES = (bool, int, float, str, bytes)
+
+
+def _value_type(value: Any) -> type:
+    for value_type in _VALUE_TYPES:
+        if isinstance(value, value_type):
+            return value_type
+    return type(value)
+
+
+def _same_value(a: Any, b: Any) -> bool:
+    # Type is compared as well, so e.g. 1 -> True is a change
+    return a is b or (_value_type(a) is _value_type(b) and a == b)
+
+
+def _delta(config: abc.Mapping, base: abc.Mapping) -> dict:
+    delta = {}
+    for k, v in config.items():
+        base_v = base.get(k, _MISSING)
+        if isinstance(v, abc.Mapping) and isinstance(base_v, abc.Mapping):
+            sub_delta = _delta(v, base_v)
+            if sub_delta:
+                delta[k] = sub_delta
+        elif base_v is _MISSING or not _same_value(v, base_v):
+            # Lists are always overwritten completely by the overlays, so
+            # they are not compared element-wise
+            delta[k] = v
+    return delta
+
+
+def config_delta(config: abc.Mapping, base: abc.Mapping) -> dict:
+    """ Minimal overlay, that reproduces the configuration when merged on
+        top of the base configuration (e.g. with
+        :meth:`onacol.ConfigManager.config_from_file`).
+
+        Both configurations are flattened once and walked together, so the
+        cost is linear with the configuration size. Values (or subtrees)
+        missing in the configuration cannot be expressed by an overlay and
+        are ignored.
+
+    :param config: Configuration (:class:`CascaDict` or plain dict).
+    :param base:   Base configuration, typically the defaults or a lower
+                   layer of the configuration cascade.
+    :return: Nested dict with only the changed paths.
+    """
+    return _delta(_flat(config), _flat(base))
+
+
+class ConfigDiff(namedtuple("ConfigDiff", "added removed changed")):
+    """ Structural difference of two configurations - dicts of configuration
+        paths (list items have the index in the path):
+
+        * added   - path mapped to the new value,
+        * removed - path mapped to the old value,
+        * changed - path mapped to tuple (old value, new value).
+    """
+
+    __slots__ = ()
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+
+def _is_sequence(value: Any) -> bool:
+    return isinstance(value, abc.Sequence) and \
+        not isinstance(value, (str, bytes))
+
+
+class ConfigDiffer:
+    """ Compares configurations with a baseline (e.g. effective
+        configurations of many hosts with a reference). The baseline is
+        flattened only once for all the comparisons.
+
+        Subtrees shared by identity (e.g. values of the common defaults
+        layer) are skipped without comparison. Dicts are compared by keys,
+        lists element-wise. With the configuration schema, values of
+        the configuration paths of the schema (e.g. items with ``type: dict``
+        schema) are compared as whole values.
+
+            >>> differ = ConfigDiffer(reference_config, config_schema)
+            >>> for host_diff in differ.diff_many(host_configs):
+            ...     print(host_diff.changed)
+    """
+
+    def __init__(self, baseline: abc.Mapping,
+                 config_schema: Any = None):
+        """
+        :param baseline:      Baseline configuration (:class:`CascaDict` or
+                              plain dict).
+        :param config_schema: Optional
+                              :class:`onacol.config_schema.ConfigSchema`.
+        """
+        self._baseline = _flat(baseline)
+        self._value_paths = frozenset(
+            path for path, metadata in config_schema.flat_schema.items()
+            if metadata.value_type == FlatValueType.VALUE) \
+            if config_schema is not None else frozenset()
+
+    @property
+    def baseline(self) -> abc.Mapping:
+        return self._baseline
+
+    def diff(self, config: abc.Mapping) -> ConfigDiff:
+        """ Compare the configuration with the baseline.
+
+        :param config: Configuration (:class:`CascaDict` or plain dict).
+        :return: :class:`ConfigDiff` - changes from the baseline to
+                 the configuration.
+        """
+        result = ConfigDiff({}, {}, {})
+        self._compare(self._baseline, _flat(config), (), result)
+        return result
+
+    def diff_many(self, configs: Iterable[abc.Mapping]) -> List[ConfigDiff]:
+        """ Compare each of the configurations with the baseline. """
+        return [self.diff(config) for config in configs]
+
+    def _compare(self, old: Any, new: Any, path: tuple,
+                 result: ConfigDiff) -> None:
+        if old is new:
+            return
+
+        if isinstance(old, abc.Mapping) and isinstance(new, abc.Mapping) \
+                and path not in self._value_paths:
+            for k, old_v in old.items():
+                new_v = new.get(k, _MISSING)
+                if new_v is _MISSING:
+                    result.removed[path + (k,)] = old_v
+                else:
+                    self._compare(old_v, new_v, path + (k,), result)
+            for k, new_v in new.items():
+                if k not in old:
+                    result.added[path + (k,)] = new_v
+
+        elif _is_sequence(old) and _is_sequence(new):
+            common = min(len(old), len(new))
+            for i in range(common):
+                self._compare(old[i], new[i], path + (i,), result)
+            for i in range(common, len(old)):
+                result.removed[path + (i,)] = old[i]
+            for i in range(common, len(new)):
+                result.added[path + (i,)] = new[i]
+
+        elif not _same_tree(old, new):
+            result.changed[path] = (old, new)
+
+
+def _same_tree(a: Any, b: Any) -> bool:
+    """ Type-strict deep comparison (of whole values). """
+    if a is b:
+        return True
+    if isinstance(a, abc.Mapping) and isinstance(b, abc.Mapping):
+        return len(a) == len(b) and all(
+            k in b and _same_tree(v, b[k]) for k, v in a.items())
+    if _is_sequence(a) and _is_sequence(b):
+        return len(a) == len(b) and all(
+            _same_tree(x, y) for x, y in zip(a, b))
+    return _same_value(a, b)
+
+
+def config_diff(config: abc.Mapping, base: abc.Mapping,
+                config_schema: Any = None) -> ConfigDiff:
+    """ Structural difference of the configuration from the base
+        configuration (see :class:`ConfigDiffer`).
+
+    :param config:        Configuration (:class:`CascaDict` or plain dict).
+    :param base:          Base configuration.
+    :param config_schema: Optional
+                          :class:`onacol.config_schema.ConfigSchema`.
+    :return: :class:`ConfigDiff`.
+    """
+    return ConfigDiffer(base, config_schema).diff(config)
@@ -0,0 +1,176 @@
+"""
+.. module: onacol.fingerprint
+   :synopsis: Content fingerprints of configurations and schemas.
+
+.. moduleauthor:: Josef Nevrly <josef.nevrly@gmail.com>
+"""
+from typing import Any, Dict, Iterable, Union
+from collections import abc
+import hashlib
+import struct
+
+from cascadict import CascaDict  # type: ignore
+
+_MASK = (1 << 64) - 1
+_MISSING = object()
+# Contribution of a mapping node (so empty dict differs from missing one)
+_MAPPING_TAG = b"{}"
+
+
+def _encode(value: Any) -> bytes:
+    """ Stable (process independent) encoding of a configuration value.
+        Mappings are encoded order-independent, sequences order-dependent.
+    """
+    if value is None:
+        return b"N"
+    if value is True:
+        return b"T"
+    if value is False:
+        return b"F"
+    if isinstance(value, int):
+        return b"i%d;" % value
+    if isinstance(value, float):
+        return b"f" + struct.pack("<d", value)
+    if isinstance(value, str):
+        data = value.encode("utf-8", "surrogatepass")
+        return b"s%d:" % len(data) + data
+    if isinstance(value, bytes):
+        return b"b%d:" % len(value) + value
+    if isinstance(value, abc.Mapping):
+        return b"{" + b"".join(sorted(_encode(k) + _encode(v)
+                                      for k, v in value.items())) + b"}"
+    if isinstance(value, abc.Sequence):
+        return b"[" + b"".join(_encode(item) for item in value) + b"]"
+    data = f"{type(value).__name__}:{value!r}".encode()
+    return b"o%d:" % len(data) + data
+
+
+def _hash(path: tuple, encoded_value: bytes) -> int:
+    digest = hashlib.blake2b(_encode(path) + encoded_value, digest_size=8)
+    return int.from_bytes(digest.digest(), "little")
+
+
+class _Node:
+    """ Fingerprint of a configuration subtree - sum of the contributions
+        of all its paths.
+    """
+
+    __slots__ = ("sum", "children")
+
+    sum: int
+    children: Union[Dict[Any, "_Node"], None]
+
+    def __init__(self, value: Any, path: tuple):
+        if isinstance(value, abc.Mapping):
+            self.children = {k: _Node(v, path + (k,))
+                             for k, v in value.items()}
+            self.sum = (_hash(path, _MAPPING_TAG) +
+                        sum(child.sum for child in self.children.values())
+                        ) & _MASK
+        else:
+            self.children = None
+            self.sum = _hash(path, _encode(value))
+
+
+class ConfigFingerprint:
+    """ Additive fingerprint of the configuration content - sum of hashes of
+        all (configuration path, value) pairs. It's independent of the order
+        of dict items (and of the configuration layers), lists are hashed
+        as values (order-dependent).
+
+        When only some paths change, the fingerprint is updated from
+        the changed subtrees only (see :meth:`update`)::
+
+            >>> fingerprint = ConfigFingerprint(config)
+            >>> config["ui"]["port"] = 8080
+            >>> fingerprint.update(config, [("ui", "port")])
+            >>> fingerprint == ConfigFingerprint(config)
+            True
+    """
+
+    def __init__(self, config: abc.Mapping):
+        """
+        :param config: Configuration (:class:`CascaDict` or plain dict).
+        """
+        self._root = self._build(config)
+
+    @staticmethod
+    def _build(config: abc.Mapping) -> _Node:
+        if isinstance(config, CascaDict):
+            config = config.copy_flat()
+        return _Node(config, ())
+
+    @property
+    def value(self) -> int:
+        """ Fingerprint as 64-bit integer. """
+        return self._root.sum
+
+    def hexdigest(self) -> str:
+        """ Fingerprint as hex string (e.g. for a cache key). """
+        return f"{self._root.sum:016x}"
+
+    def update(self, config: abc.Mapping, paths: Iterable[tuple]) -> None:
+        """ Update the fingerprint after the configuration was changed.
+
+        :param config: The changed configuration.
+        :param paths:  Configuration paths that were changed (values or
+                       whole subtrees, that were replaced, added or
+                       removed).
+        """
+        for path in paths:
+            if not self._update_path(config, tuple(path)):
+                # Structure above the path changed
+                self._root = self._build(config)
+                return
+
+    def _update_path(self, config: abc.Mapping, path: tuple) -> bool:
+        if not path:
+            return False
+        nodes = [self._root]
+        value: Any = config
+        for k in path[:-1]:
+            children = nodes[-1].children
+            if children is None or k not in children:
+                return False
+            nodes.append(children[k])
+            try:
+                value = value[k]
+            except (KeyError, TypeError, IndexError):
+                return False
+
+        children = nodes[-1].children
+        if children is None or not isinstance(value, abc.Mapping):
+            return False
+        old_node = children.get(path[-1])
+        new_value = value.get(path[-1], _MISSING)
+        if new_value is _MISSING:
+            delta = 0
+            children.pop(path[-1], None)
+        else:
+            new_node = _Node(new_value, path)
+            children[path[-1]] = new_node
+            delta = new_node.sum
+        if old_node is not None:
+            delta -= old_node.sum
+        for node in nodes:
+            node.sum = (node.sum + delta) & _MASK
+        return True
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, ConfigFingerprint):
+            return NotImplemented
+        return self.value == other.value
+
+    __hash__ = None  # type: ignore
+
+    def __repr__(self):
+        return f"<ConfigFingerprint {self.hexdigest()}>"
+
+
+def config_fingerprint(config: abc.Mapping) -> str:
+    """ Fingerprint of the configuration (see :class:`ConfigFingerprint`).
+
+    :param config: Configuration (:class:`CascaDict` or plain dict).
+    :return: Hex string.
+    """
+    return ConfigFingerprint(config).hexdigest()
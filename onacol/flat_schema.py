@@ -5,7 +5,7 @@
 .. moduleauthor:: Josef Nevrly <josef.nevrly@gmail.com>
 """
 from functools import reduce
-from typing import Any
+from typing import Any, Union, Callable, Iterable
 from enum import Enum
 from collections import namedtuple
 from collections import abc
@@ -16,6 +16,7 @@ import ast
 from cerberus import Validator  # type: ignore
 
 from .base import OnacolException
+from .stats import ConfigStats, DISABLED_STATS
 
 
 class UnknownConfigError(OnacolException):
@@ -26,6 +27,19 @@ class InvalidValueError(OnacolException):
     pass
 
 
+class OverrideError(UnknownConfigError, InvalidValueError):
+    """ Some of the bulk set values are unknown or invalid. """
+
+    def __init__(self, errors: dict):
+        """
+        :param errors: Flat name (env var or CLI option name) mapped to
+                       the exception raised for its value.
+        """
+        self.errors = errors
+        super().__init__("Invalid configuration values: " + ", ".join(
+            f"{name}: {error}" for name, error in errors.items()))
+
+
 class FlatValueType(Enum):
     VALUE = "val"
     LIST = "list"
@@ -40,12 +54,30 @@ class FlatSchemaHandler:
     CLI_OPT_SEPARATOR_CHAR = "-"
     SEPARATOR = 2*ENV_VAR_SEPARATOR_CHAR
 
-    def __init__(self, flat_schema: dict, env_var_prefix: str = ""):
+    def __init__(self, flat_schema: dict, env_var_prefix: str = "",
+                 mappings: Union[tuple, None] = None,
+                 stats: Union[ConfigStats, None] = None):
+        """
+        :param flat_schema:     Flattened configuration schema.
+        :param env_var_prefix:  Prefix of the environment variables.
+        :param mappings:        Precomputed tuple (env_var_mapping,
+                                cli_opt_mapping) as returned by
+                                :attr:`mappings` (e.g. from the schema cache).
+                                If None, mappings are computed from the
+                                flat schema.
+        :param stats:           Stats collecting the mapping computation
+                                duration.
+        """
         self._flat_schema = flat_schema
         self._prefix = env_var_prefix.lstrip(
             self.ENV_VAR_SEPARATOR_CHAR).upper() + self.ENV_VAR_SEPARATOR_CHAR
 
+        self._stats = stats if stats is not None else DISABLED_STATS
+        with self._stats.phase("flat_schema_converters"):
+            self._converters = self._compile_converters(flat_schema)
+
         # Initialize env_var identifier mapping from the flat_schema
+        # (on first use, if not precomputed).
         # The point of this mapping is, that there should be no limits on
         # how is the configuration schema defined, including config elements
         # that contain separator strings. With this limit, there is no way
@@ -54,14 +86,42 @@ class FlatSchemaHandler:
         # to the real schema for both
         #   * env_vars (that are capitalized with prefix)
         #   * cli options (that may or may not be lowercase and have no prefix)
-        self._env_var_mapping = {self._prefix +
-                                 self.SEPARATOR.join(path).upper(): path
-                                 for path, v in self._flat_schema.items()}
-        self._cli_opt_mapping = {
-            self.SEPARATOR.join(path).replace(self.ENV_VAR_SEPARATOR_CHAR,
-                                              self.CLI_OPT_SEPARATOR_CHAR
-                                              ): path
-            for path, v in self._flat_schema.items()}
+        self._mappings: Union[tuple, None] = mappings
+
+    def _build_mappings(self) -> tuple:
+        with self._stats.phase("flat_schema"):
+            env_var_mapping = {self._prefix +
+                               self.SEPARATOR.join(path).upper(): path
+                               for path, v in self._flat_schema.items()}
+            cli_opt_mapping = {
+                self.SEPARATOR.join(path).replace(
+                    self.ENV_VAR_SEPARATOR_CHAR, self.CLI_OPT_SEPARATOR_CHAR
+                ): path
+                for path, v in self._flat_schema.items()}
+        self._stats.count("flat_paths", len(self._flat_schema))
+        return env_var_mapping, cli_opt_mapping
+
+    @property
+    def mappings(self) -> tuple:
+        """ Tuple (env_var_mapping, cli_opt_mapping) of flat name to
+            configuration path mappings.
+        """
+        if self._mappings is None:
+            self._mappings = self._build_mappings()
+        return self._mappings
+
+    @property
+    def mappings_built(self) -> bool:
+        """ Whether the mappings were already built (or precomputed). """
+        return self._mappings is not None
+
+    @property
+    def _env_var_mapping(self) -> dict:
+        return self.mappings[0]
+
+    @property
+    def _cli_opt_mapping(self) -> dict:
+        return self.mappings[1]
 
     @staticmethod
     def _get_config_value(config, config_path):
@@ -112,59 +172,118 @@ class FlatSchemaHandler:
         raise InvalidValueError(
             f"Only values of type mapping expected for {path}")
 
-    def _set_mapped_value(self, config, mapping, path, value):
-        mapped_path = self._get_mapped_path(mapping, path)
-        metadata = self._flat_schema[mapped_path]
+    def _list_conversion(self, path, value):
+        # For lists, we assume the contents is a JSON encoded list
+        try:
+            converted_value = json.loads(value)
+            if not isinstance(converted_value, list):
+                raise InvalidValueError(
+                    f"Only values of type list expected for {path}")
+        except json.JSONDecodeError as e:
+            raise InvalidValueError(
+                f"Value {value} is not valid JSON: {str(e)}")
+        return converted_value
 
-        # Check whether the mapped path points to a value or list
-        # If it's from the list, we assume the contents is a JSON encoded list
+    def _untyped_conversion(self, path, value):
+        if isinstance(value, str):
+            return self._single_value_conversion(value)
+        return value
+
+    def _type_conversion(self, val_type) -> Callable:
+        if isinstance(val_type, tuple):
+            # Somehow, the Cerberus types_mapping wraps int
+            # into an additional tuple...
+            val_type = val_type[0]
+
+        # List of exceptions here
+        if val_type == bool:
+            # One more conversion to bool to prevent JSON injection
+            return lambda path, value: bool(json.loads(value.lower()))
+        if issubclass(val_type, abc.Mapping):
+            return self._mapping_value_conversion
+        # End of exceptions
+        return lambda path, value: val_type(value)
+
+    def _compile_converter(self, metadata: FlatSchemaMetadata) -> Callable:
+        """ Create converter of the (string) value of the flat path.
+
+        :param metadata: Flat schema metadata of the path.
+        :return: Callable with arguments flat name (used in the errors)
+                 and value, that returns the converted value.
+        """
         if metadata.value_type == FlatValueType.LIST:
-            try:
-                converted_value = json.loads(value)
-                if not isinstance(converted_value, list):
-                    raise InvalidValueError(
-                        f"Only values of type list expected for {path}")
-            except json.JSONDecodeError as e:
-                raise InvalidValueError(
-                    f"Value {value} is not valid JSON: {str(e)}")
-        else:
+            return self._list_conversion
+
+        if metadata.data_type is None:
+            return self._untyped_conversion
+
+        data_type = metadata.data_type
+        try:
+            # Get possible conversion types from the Cerberos
+            type_def = Validator.types_mapping[data_type]
+        except (KeyError, TypeError):
+            # Unknown type fails on the conversion attempt (as the
+            # uncompiled conversion does)
+            def unknown_type_conversion(path, value):
+                if isinstance(value, str):
+                    Validator.types_mapping[data_type]
+                return value
+            return unknown_type_conversion
+
+        conversions = tuple(self._type_conversion(val_type)
+                            for val_type in type_def.included_types)
+        single_value_conversion = self._single_value_conversion
+
+        def typed_conversion(path, value):
             # For values, we may try to coerce type conversion, because all
             # values may be string
-            if isinstance(value, str) and metadata.data_type is not None:
-                # Get possible conversion types from the Cerberos
-                type_def = Validator.types_mapping[metadata.data_type]
-                # try to convert value from string
-                for val_type in type_def.included_types:
-                    if isinstance(val_type, tuple):
-                        # Somehow, the Cerberus types_mapping wraps int
-                        # into an additional tuple...
-                        val_type = val_type[0]
-                    try:
-                        # List of exceptions here
-                        if val_type == bool:
-                            # One more conversion to bool to prevent
-                            # JSON injection
-                            converted_value = bool(json.loads(value.lower()))
-                        elif issubclass(val_type, abc.Mapping):
-                            converted_value = self._mapping_value_conversion(
-                                path, value)
-                        # End of exceptions
-                        else:
-                            converted_value = val_type(value)
-                        break
-                    except (ValueError, TypeError):
-                        pass
-                else:
-                    converted_value = self._single_value_conversion(value)
-            else:
-                # For values
-                if isinstance(value, str):
-                    converted_value = self._single_value_conversion(value)
-                else:
-                    converted_value = value
+            if not isinstance(value, str):
+                return value
+            for conversion in conversions:
+                try:
+                    return conversion(path, value)
+                except (ValueError, TypeError):
+                    pass
+            return single_value_conversion(value)
+        return typed_conversion
+
+    def _compile_converters(self, flat_schema: dict) -> dict:
+        """ Compile value converters of all the flat schema paths
+            (converters are shared by paths with the same metadata).
+        """
+        compiled: dict = {}
+        converters = {}
+        for path, metadata in flat_schema.items():
+            try:
+                converter = compiled[metadata]
+            except KeyError:
+                converter = compiled[metadata] = \
+                    self._compile_converter(metadata)
+            except TypeError:
+                # Unhashable data type (e.g. list of types)
+                converter = self._compile_converter(metadata)
+            converters[path] = converter
+        return converters
+
+    def convert_value(self, config_path: tuple, name: str, value: Any) -> Any:
+        """ Convert the value (typically string) to the type of the
+            configuration path.
+
+        :param config_path: Configuration path (key of the flat schema).
+        :param name:        Flat name of the value (env var or CLI option
+                            name) used in the error messages.
+        :param value:       The value to be converted.
+        :return: Converted value.
+        """
+        return self._converters[config_path](name, value)
+
+    def _set_mapped_value(self, config, mapping, path, value):
+        mapped_path = self._get_mapped_path(mapping, path)
+        converted_value = self._converters[mapped_path](path, value)
 
         self._get_config_value(config, mapped_path[:-1])[mapped_path[-1]] = \
             converted_value
+        return mapped_path
 
     def _get_config_path_env_var(self, env_var_name):
         return self._get_mapped_path(self._env_var_mapping, env_var_name)
@@ -182,28 +301,100 @@ class FlatSchemaHandler:
 
     def set_config_from_env_var(self, config: dict,
                                 env_var_name: str,
-                                value: Any) -> None:
+                                value: Any) -> tuple:
         """ Sets value in configuration provided as environment variable.
 
         :param config:  The configuration dict.
         :param env_var_name:  Environment variable name.
         :param value:  Environment variable value.
+        :return: Configuration path of the value that was set.
         """
-        self._set_mapped_value(
+        return self._set_mapped_value(
             config, self._env_var_mapping, env_var_name, value)
 
     def set_config_from_cli_opt(self, config: dict,
                                 cli_opt_name: str,
-                                value: Any) -> None:
+                                value: Any) -> tuple:
         """ Sets value in configuration provided as CLI optional argument.
 
         :param config:  The configuration dict.
         :param cli_opt_name:  CLI optional argument name.
         :param value:  CLI optional argument value.
+        :return: Configuration path of the value that was set.
         """
-        self._set_mapped_value(
+        return self._set_mapped_value(
             config, self._cli_opt_mapping, cli_opt_name, value)
 
+    def set_config_values(self, config: dict,
+                          env_vars: Iterable[tuple] = (),
+                          cli_opts: Iterable[tuple] = ()) -> list:
+        """ Sets multiple values provided as environment variables and
+            CLI optional arguments (CLI options take precedence).
+
+            All the values are converted first, the configuration is not
+            modified if any of them fails. Values are grouped by their
+            parent configuration path, so every parent is looked up only
+            once.
+
+        :param config:   The configuration dict.
+        :param env_vars: Tuples (env_var_name, value).
+        :param cli_opts: Tuples (cli_opt_name, value).
+        :return: Configuration paths of the values that were set.
+        :raises: :class:`OverrideError` with all the unknown names and
+                 invalid values.
+        """
+        parents: dict = {}
+        errors = {}
+        for mapping, items in ((self._env_var_mapping, env_vars),
+                               (self._cli_opt_mapping, cli_opts)):
+            for name, value in items:
+                try:
+                    path = self._get_mapped_path(mapping, name)
+                    converted_value = self._converters[path](name, value)
+                except (OnacolException, KeyError, ValueError,
+                        TypeError) as e:
+                    errors[name] = e
+                    continue
+                parents.setdefault(path[:-1], {})[path[-1]] = converted_value
+
+        if errors:
+            raise OverrideError(errors)
+
+        paths = []
+        for parent_path, values in parents.items():
+            parent = self._get_config_value(config, parent_path)
+            for key, value in values.items():
+                parent[key] = value
+                paths.append(parent_path + (key,))
+        return paths
+
+    def get_env_vars(self, environ: abc.Mapping,
+                     ignore_unknown: bool = False) -> list:
+        """ Get the configuration environment variables from the
+            environment mapping.
+
+        :param environ:        Environment mapping (e.g. ``os.environ`` or
+                               environment prepared for a child process).
+        :param ignore_unknown: If True, only the environment variables
+                               of existing configuration paths are
+                               returned (the environment is intersected
+                               with the env var mapping, without scanning
+                               it). Otherwise, all the prefixed variables
+                               are returned, including the unknown ones.
+        :return: List of tuples (env_var_name, value).
+        """
+        if not ignore_unknown:
+            prefix = self._prefix
+            return [(name, environ[name]) for name in environ
+                    if name.startswith(prefix)]
+
+        mapping = self._env_var_mapping
+        if len(environ) <= len(mapping):
+            names = [name for name in environ if name in mapping]
+        else:
+            names = [name for name in mapping if name in environ]
+        return [(name, environ[name]) for name in names]
+
     def is_prefixed_env_var(self, env_var_name: str) -> bool:
         """ Checks if given environment variable has the specified prefix.
 
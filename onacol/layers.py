@@ -0,0 +1,181 @@
+"""
+.. module: onacol.layers
+   :synopsis: Utilities for inspection and compaction of the configuration
+                layers (CascaDict cascades).
+
+.. moduleauthor:: Josef Nevrly <josef.nevrly@gmail.com>
+"""
+from typing import List, Union
+from collections import abc
+
+from cascadict import CascaDict  # type: ignore
+
+
+def cascade_layers(config: CascaDict) -> List[CascaDict]:
+    """ Get all layers of the configuration.
+
+    :param config:  Top layer of the configuration.
+    :return: List of layers, starting with the root (defaults) layer.
+    """
+    layers = [config]
+    while not layers[-1].is_root():
+        layers.append(layers[-1].get_ancestor())
+    layers.reverse()
+    return layers
+
+
+def cascade_depth(config: CascaDict) -> int:
+    """ Number of layers in the configuration cascade. """
+    depth = 1
+    while not config.is_root():
+        config = config.get_ancestor()
+        depth += 1
+    return depth
+
+
+_MISSING = object()
+
+
+def _resolve_path(layer: CascaDict, path: tuple):
+    """ Resolved value of the path in the given layer (flattened, if it's
+        a sub-tree).
+    """
+    value = layer
+    try:
+        for k in path:
+            value = value[k]
+    except (KeyError, TypeError, IndexError):
+        return _MISSING
+    return value.copy_flat() if isinstance(value, CascaDict) else value
+
+
+def _squash(base: CascaDict, top: abc.Mapping, path: tuple,
+            squashed_paths: list) -> CascaDict:
+    """ Create single layer on top of the base, that results in the same
+        resolved configuration as `top`.
+    """
+    layer = base.cascade()
+    for k, v in top.items():
+        if k in base:
+            base_value = base[k]
+            if isinstance(base_value, CascaDict) and \
+                    isinstance(v, abc.Mapping):
+                if all(base_k in v for base_k in base_value):
+                    layer.final_dict[k] = _squash(base_value, v,
+                                                  path + (k,),
+                                                  squashed_paths)
+                    continue
+            elif base_value is v or base_value == v:
+                continue
+
+        # Value (or the whole sub-tree) differs from the base - it's stored
+        # in the layer as it is (sub-trees are not cascaded from the base,
+        # so the values missing in them are not inherited).
+        layer.final_dict[k] = CascaDict(v) if isinstance(v, abc.Mapping) \
+            else v
+        squashed_paths.append(path + (k,))
+
+    return layer
+
+
+def compact_cascade(config: CascaDict,
+                    base: Union[CascaDict, None] = None,
+                    provenance: Union[dict, None] = None) -> CascaDict:
+    """ Collapse all layers above the base layer into single layer.
+        The resolved configuration stays the same.
+
+    :param config:      Top layer of the configuration.
+    :param base:        Layer that is kept as it is (together with all its
+                        ancestors). Defaults to the root (defaults) layer.
+    :param provenance:  Optional dict, that is filled with the
+                        configuration paths stored in the new layer, mapped
+                        to the index of the original layer (in the list
+                        returned by :func:`cascade_layers`) that provided
+                        the value.
+    :return: New top layer.
+    """
+    layers = cascade_layers(config)
+    if base is None:
+        base = layers[0]
+
+    for base_index, layer in enumerate(layers):
+        if layer is base:
+            break
+    else:
+        raise ValueError("Base layer is not part of the configuration.")
+    if len(layers) - base_index <= 2:
+        # Nothing to collapse
+        return config
+
+    squashed_paths: list = []
+    compacted = _squash(base, config.copy_flat(), (), squashed_paths)
+
+    if provenance is not None:
+        for path in squashed_paths:
+            # The value is provided by the top-most layer that changed it
+            value = _resolve_path(layers[-1], path)
+            provider = len(layers) - 1
+            for i in range(len(layers) - 2, base_index - 1, -1):
+                layer_value = _resolve_path(layers[i], path)
+                if layer_value is not value and layer_value != value:
+                    break
+                value = layer_value
+                provider = i
+            provenance[path] = provider
+
+    return compacted
+
+
+def _is_base_wrapper(value, base: CascaDict, key) -> bool:
+    """ Whether the layer's nested value is just a wrapper cascaded from the
+        base's sub-tree (as opposed to a sub-tree replacing it).
+    """
+    return isinstance(value, CascaDict) and not value.is_root() and \
+        key in base and value.get_ancestor() is base[key]
+
+
+def _layer_values(layer: CascaDict, base: CascaDict) -> dict:
+    """ Values set in the layer itself (recursively, as plain dict). """
+    values = {}
+    for k, v in layer.final_dict.items():
+        if _is_base_wrapper(v, base, k):
+            nested = _layer_values(v, base[k])
+            if nested:
+                values[k] = nested
+        else:
+            values[k] = v.copy_flat() if isinstance(v, CascaDict) else v
+    return values
+
+
+def _rebase(layer: CascaDict, base: CascaDict,
+            new_base: CascaDict) -> CascaDict:
+    rebased = new_base.cascade()
+    for k, v in layer.final_dict.items():
+        if _is_base_wrapper(v, base, k):
+            new_base_value = new_base[k] if k in new_base else _MISSING
+            if isinstance(new_base_value, CascaDict):
+                rebased.final_dict[k] = _rebase(v, base[k], new_base_value)
+            else:
+                nested = _layer_values(v, base[k])
+                if nested:
+                    rebased[k] = nested
+        elif isinstance(v, CascaDict) and v.is_root():
+            # Sub-tree replacing the base one completely (see _squash)
+            rebased.final_dict[k] = v
+        elif isinstance(v, CascaDict):
+            rebased[k] = v.copy_flat()
+        else:
+            rebased.final_dict[k] = v
+    return rebased
+
+
+def rebase_layer(layer: CascaDict, new_base: CascaDict) -> CascaDict:
+    """ Re-create the layer on top of another base layer - the values set
+        in the layer are applied the same way, as if the layer was cascaded
+        from the new base originally.
+
+    :param layer:    The layer (not root).
+    :param new_base: New base layer.
+    :return: New layer cascaded from the `new_base`.
+    """
+    return _rebase(layer, layer.get_ancestor(), new_base)
@@ -5,16 +5,40 @@
 .. moduleauthor:: Josef Nevrly <josef.nevrly@gmail.com>
 """
 import os
-from typing import List, TextIO, Any
+import asyncio
+import logging
+import threading
+from typing import List, TextIO, Any, Union, Iterable, Callable
+from collections import abc
 
-from cerberus import Validator  # type: ignore
 from cascadict import CascaDict  # type: ignore
 
 from .config_file import ConfigFileHandler
 from .flat_schema import FlatSchemaHandler
+from .snapshot import ConfigSnapshot
+from .layers import cascade_depth, cascade_layers, compact_cascade
+from .diff import config_delta
+from .fingerprint import ConfigFingerprint
+from .accessors import (
+    ConfigAccessor,
+    accessor_class,
+    bind_accessor,
+    rebind_accessor,
+    rebind_path,
+)
+from .validation import SchemaValidator, get_validator_class
+from .subscriptions import (
+    Subscription,
+    SubscriptionIndex,
+    get_path_value,
+    notify_subscriptions,
+)
+from .stats import ConfigStats, DISABLED_STATS
 
 from .base import OnacolException
 
+logger = logging.getLogger("onacol")
+
 
 class ConfigValidationError(OnacolException):
     pass
@@ -24,7 +48,18 @@ class ConfigManager:
 
     def __init__(self, default_config_file_path: str,
                  optional_files: List[str] = None,
-                 env_var_prefix: str = ""):
+                 env_var_prefix: str = "",
+                 schema_cache_dir: Union[str, None] = None,
+                 overlay_loader: str = "safe",
+                 max_layers: Union[int, None] = None,
+                 incremental_validation: bool = False,
+                 validator_backend: str = "cerberus",
+                 hot_reload: bool = False,
+                 load: bool = True,
+                 stats: Union[bool, ConfigStats] = False,
+                 compact_lists: Union[int, None] = None,
+                 schema_sections: Union[Iterable[str], None] = None,
+                 artifact: Union[str, None] = None):
         """
 
         :param default_config_file_path: Path to the file with the default
@@ -33,19 +68,183 @@ class ConfigManager:
         :param optional_files:   List of optional config files.
         :param env_var_prefix:   Prefix used for environment variables that
                                  shall be loaded as config.
+        :param schema_cache_dir: Directory for caching of the compiled
+                                 default configuration schema. If set,
+                                 warm starts skip parsing of the default
+                                 configuration file.
+        :param overlay_loader:   YAML loader used for optional and additional
+                                 config files ("safe", "pure" or "rt", see
+                                 :data:`onacol.config_file.YAML_LOADERS`).
+        :param max_layers:       Maximal number of configuration layers
+                                 (including the defaults layer). When
+                                 exceeded after a merge, layers above the
+                                 defaults are compacted into a single one
+                                 (see :meth:`compact`). Use 2 to squash
+                                 on every merge. None means no limit.
+        :param incremental_validation: If True, :meth:`validate` checks only
+                                 the configuration paths changed since
+                                 the last successful validation (where
+                                 possible). Only changes made through
+                                 the ConfigManager methods are tracked,
+                                 call :meth:`invalidate_validation` after
+                                 changing the configuration directly.
+        :param validator_backend: Validation backend - "cerberus" (rules
+                                 interpreted by cerberus on every
+                                 validation) or "compiled" (schema compiled
+                                 once to specialized check functions, with
+                                 the same results), see
+                                 :data:`onacol.validation.VALIDATOR_BACKENDS`.
+        :param hot_reload:       Keep the layers of the optional/additional
+                                 config files separate on compaction, so
+                                 their changes can always be reloaded
+                                 (see :meth:`reload`).
+        :param load:             If False, the configuration files are not
+                                 loaded (see :meth:`load`,
+                                 :meth:`load_async` and
+                                 :meth:`create_async`).
+        :param stats:            Collect durations and counters of the
+                                 configuration processing phases (see
+                                 :attr:`stats`). True for new
+                                 :class:`onacol.stats.ConfigStats`, or
+                                 existing ConfigStats instance.
+        :param compact_lists:    Minimal length of homogeneous lists of
+                                 dicts (items with the same keys) in the
+                                 configuration files, that are stored
+                                 in compact read-only form
+                                 (:class:`onacol.records.RecordList`).
+                                 None to keep all lists as they are.
+        :param schema_sections:  Names of the top-level sections of the
+                                 default configuration file to be used
+                                 (e.g. by a service that needs only part of
+                                 a shared configuration). Other sections are
+                                 not parsed and are ignored in
+                                 the optional/additional files. None for
+                                 all the sections.
+        :param artifact:         Path of the compiled configuration artifact
+                                 (see :meth:`compile_artifact`). It's loaded
+                                 instead of the configuration files if it
+                                 was compiled from their current content,
+                                 otherwise the files are loaded.
         """
-        self._file_handler = ConfigFileHandler(default_config_file_path,
-                                               optional_files)
+        if stats is True:
+            stats = ConfigStats()
+        self._stats: ConfigStats = stats or DISABLED_STATS
+        self._validator_class = get_validator_class(validator_backend)
+        if max_layers is not None and max_layers < 2:
+            raise OnacolException("At least two layers must be allowed.")
+        self._max_layers = max_layers
+        self._env_var_prefix = env_var_prefix
+        self._file_handler = ConfigFileHandler(
+            default_config_file_path, optional_files, schema_cache_dir,
+            overlay_loader, env_var_prefix, load=False, stats=self._stats,
+            compact_lists=compact_lists, schema_sections=schema_sections,
+            artifact_path=artifact)
         self._flat_schema_handler = FlatSchemaHandler(
-            self._file_handler.flat_schema, env_var_prefix=env_var_prefix)
-        self._validator = None
+            {}, env_var_prefix=env_var_prefix)
+        self._validator: Union[SchemaValidator, None] = None
+        self._snapshot: Union[ConfigSnapshot, None] = None
+        self._fingerprint: Union[ConfigFingerprint, None] = None
+        self._accessor: Union[ConfigAccessor, None] = None
+        self._subscriptions = SubscriptionIndex()
+        self._fingerprint_paths: set = set()
+        self._incremental_validation = incremental_validation
+        self._full_validation_needed = True
+        self._dirty_paths: set = set()
+        self._hot_reload = hot_reload
+        self._reload_callbacks: List[Callable] = []
+        self._watcher: Union[threading.Thread, None] = None
+        self._stop_watching = threading.Event()
+
+        if load:
+            self.load()
+
+    @classmethod
+    async def create_async(cls, *args, executor: Any = None,
+                           **kwargs) -> "ConfigManager":
+        """ Create ConfigManager without blocking the event loop - the
+            configuration files are read and parsed concurrently in the
+            executor (see :meth:`load_async`).
+
+        :param args:     Arguments of :class:`ConfigManager`.
+        :param executor: :class:`concurrent.futures.Executor`, None for the
+                         default executor of the event loop.
+        :param kwargs:   Keyword arguments of :class:`ConfigManager`.
+        """
+        kwargs["load"] = False
+        manager = cls(*args, **kwargs)
+        await manager.load_async(executor)
+        return manager
+
+    def load(self) -> None:
+        """ Load the default and optional configuration files (replaces
+            the current configuration).
+        """
+        with self._stats.phase("load"):
+            self._file_handler.load_files()
+            self._schema_loaded()
+
+    async def load_async(self, executor: Any = None) -> None:
+        """ Asynchronous :meth:`load` - the files are read and parsed
+            concurrently in the executor and merged in the declared order.
+            Schema processing is done in the executor as well.
+
+        :param executor: :class:`concurrent.futures.Executor`, None for the
+                         default executor of the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await self._file_handler.load_files_async(executor)
+        await loop.run_in_executor(executor, self._schema_loaded)
+        self._stats.record("load", loop.time() - start)
+
+    def compile_artifact(self, artifact_path: str) -> None:
+        """ Compile the default and optional configuration files into
+            a binary artifact (e.g. in a deploy build step), that can be
+            loaded instead of the files (see the `artifact` argument).
+            Current configuration is not changed.
+
+        :param artifact_path: Destination path of the artifact.
+        """
+        with self._stats.phase("compile_artifact"):
+            self._file_handler.compile_artifact(artifact_path)
+
+    @property
+    def artifact_loaded(self) -> bool:
+        """ Whether the configuration files were loaded from the compiled
+            artifact.
+        """
+        return self._file_handler.artifact_loaded
 
-        if self._file_handler.config_schema:
-            self._validator = Validator(
-                self._file_handler.config_schema.schema,
-                schema_registry=self._file_handler.config_schema.schema_registry,
+    def _schema_loaded(self) -> None:
+        cached_mappings = self._file_handler.get_cached_flat_mappings(
+            self._env_var_prefix)
+        self._flat_schema_handler = FlatSchemaHandler(
+            self._file_handler.flat_schema,
+            env_var_prefix=self._env_var_prefix, mappings=cached_mappings,
+            stats=self._stats)
+        # Mappings are built on first use, unless they are to be cached
+        if cached_mappings is None and \
+                self._file_handler.schema_cache is not None:
+            self._file_handler.store_flat_mappings(
+                self._env_var_prefix, self._flat_schema_handler.mappings)
+
+        self._validator = None
+        self._accessor = None  # Classes are generated for the new schema
+        config_schema = self._file_handler.config_schema
+        if config_schema:
+            self._validator = self._validator_class(
+                config_schema.schema,
+                schema_registry=config_schema.schema_registry,
                 allow_unknown=True
             )
+        self._config_changed()
+
+    @property
+    def stats(self) -> ConfigStats:
+        """ Durations and counters of the configuration processing phases
+            (disabled unless enabled by the `stats` argument).
+        """
+        return self._stats
 
     @property
     def config(self) -> CascaDict:
@@ -54,8 +253,219 @@ class ConfigManager:
 
     @config.setter
     def config(self, value: CascaDict):
+        with self._file_handler.config_lock:
+            self._set_config(value)
+            self._config_changed()
+
+    def _set_config(self, value: CascaDict) -> None:
+        """ Replace the configuration without reporting any change
+            (for operations that do not change the resolved configuration).
+        """
         self._file_handler.configuration = value
 
+    def _config_changed(self, paths: Union[Iterable[tuple], None] = None
+                        ) -> None:
+        """ Register change of the configuration.
+
+        :param paths: Configuration paths that were changed. None means
+                      that any part of the configuration may have changed.
+        """
+        self.invalidate_snapshot()
+        if paths is None:
+            self.invalidate_validation()
+            self.invalidate_fingerprint()
+            self._rebind_accessor()
+            if self._subscriptions:
+                notify_subscriptions(self._subscriptions.all(), self.config)
+            return
+        paths = list(paths)
+        if not self._full_validation_needed:
+            self._dirty_paths.update(paths)
+        if self._fingerprint is not None:
+            self._fingerprint_paths.update(paths)
+        self._rebind_accessor(paths)
+        if self._subscriptions:
+            notify_subscriptions(self._subscriptions.affected(paths),
+                                 self.config)
+
+    @staticmethod
+    def _changed_paths(config_dict: abc.Mapping, config: abc.Mapping,
+                       path: tuple = ()) -> list:
+        """ Get paths changed by merging the dict to the configuration. """
+        paths = []
+        for k, v in config_dict.items():
+            try:
+                current = config[k]
+            except (KeyError, TypeError):
+                current = None
+            if isinstance(v, abc.Mapping) and \
+                    isinstance(current, abc.Mapping):
+                paths.extend(ConfigManager._changed_paths(v, current,
+                                                          path + (k,)))
+            else:
+                paths.append(path + (k,))
+        return paths
+
+    def subscribe(self, path: tuple, callback: Callable) -> Subscription:
+        """ Subscribe to the changes of the configuration path (including
+            the subtree under the path). Paths are the same as in the flat
+            schema, or any prefix of them (e.g. a section).
+
+            Callback is called after the configuration is changed via
+            ConfigManager methods (set/merge of the values, config files,
+            reload, ...) and the value of the path differs from the last
+            notified one. Only subscriptions of the changed paths are
+            checked, where the changed paths are known.
+
+        :param path:     Configuration path (tuple of keys).
+        :param callback: Callable with arguments path, old value and new
+                         value. Values are read-only (see
+                         :class:`onacol.snapshot.ConfigSnapshot`), or
+                         :data:`onacol.subscriptions.MISSING` if the path
+                         does not exist.
+        :return: :class:`onacol.subscriptions.Subscription` (to be used
+                 with :meth:`unsubscribe`).
+        """
+        path = tuple(path)
+        subscription = Subscription(path, callback,
+                                    get_path_value(self.config, path))
+        self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """ Cancel the subscription created by :meth:`subscribe`. """
+        self._subscriptions.remove(subscription)
+
+    @property
+    def layer_count(self) -> int:
+        """ Number of configuration layers (including the defaults). """
+        return cascade_depth(self.config)
+
+    def compact(self, provenance: Union[dict, None] = None) -> None:
+        """ Collapse all configuration layers above the defaults into single
+            layer. Resolved configuration does not change, but lookups
+            and validation no longer need to walk through all the layers.
+
+            With ``hot_reload`` enabled, only the layers above the top-most
+            config file layer are collapsed.
+
+        :param provenance:  Optional dict to be filled with configuration
+                            paths of the compacted layer, mapped to the
+                            index of the original layer that provided
+                            the value (0 being the defaults).
+        """
+        with self._file_handler.config_lock:
+            base = self._file_handler.top_file_layer(self.config) \
+                if self._hot_reload else None
+            self._set_config(compact_cascade(self.config, base=base,
+                                             provenance=provenance))
+
+    def _layers_added(self) -> None:
+        if self._max_layers is not None and \
+                self.layer_count > self._max_layers:
+            self.compact()
+
+    def invalidate_snapshot(self) -> None:
+        """ Drop the cached configuration snapshot.
+            Changes done via ConfigManager methods invalidate the snapshot
+            automatically, this is needed only after modifying
+            :attr:`config` directly.
+        """
+        self._snapshot = None
+
+    def invalidate_fingerprint(self) -> None:
+        """ Drop the maintained configuration fingerprint (it's computed
+            again on next access). Needed only after modifying
+            :attr:`config` directly.
+        """
+        self._fingerprint = None
+        self._fingerprint_paths.clear()
+
+    @property
+    def fingerprint(self) -> str:
+        """ Fingerprint of the resolved configuration (hex string), see
+            :class:`onacol.fingerprint.ConfigFingerprint`. Equal
+            configurations have equal fingerprints regardless of the
+            layering and order of dict items, so it can be used as
+            a cache key.
+
+            The fingerprint is computed on first access and then updated
+            only from the changed paths after env var/CLI option and dict
+            merges (other changes lead to full computation).
+        """
+        if self._fingerprint is None:
+            self._fingerprint = ConfigFingerprint(self.config)
+        elif self._fingerprint_paths:
+            self._fingerprint.update(self.config, self._fingerprint_paths)
+        self._fingerprint_paths.clear()
+        return self._fingerprint.hexdigest()
+
+    @property
+    def schema_fingerprint(self) -> str:
+        """ Fingerprint of the parsed configuration schema (see
+            :attr:`onacol.config_schema.ConfigSchema.fingerprint`).
+        """
+        return self._file_handler.config_schema.fingerprint
+
+    @property
+    def accessor(self) -> ConfigAccessor:
+        """ Typed attribute access to the resolved configuration
+            (see :class:`onacol.accessors.ConfigAccessor`)::
+
+                >>> config_manager.accessor.can_bus.sensor_can.channel
+                'can0'
+
+            Accessor classes (with slots for the configuration items) are
+            generated from the schema and defaults. The accessor is bound
+            to the configuration snapshot and it's rebound in place
+            whenever the configuration is changed via ConfigManager methods
+            (only the changed paths, where possible), so the root accessor
+            can be kept (nested accessors are replaced on the change).
+            Loading the default file (:meth:`load`) creates new accessor.
+        """
+        if self._accessor is None:
+            config_schema = self._file_handler.config_schema
+            self._accessor = bind_accessor(
+                accessor_class(config_schema.schema,
+                               self._file_handler.default_config),
+                self.snapshot().data)
+        return self._accessor
+
+    def _rebind_accessor(self, paths: Union[List[tuple], None] = None
+                         ) -> None:
+        if self._accessor is None:
+            return
+        if paths is not None and all(rebind_path(self._accessor,
+                                                 self.config, path)
+                                     for path in paths):
+            return
+        rebind_accessor(self._accessor, self.snapshot().data)
+
+    def snapshot(self, immutable: bool = True) -> ConfigSnapshot:
+        """ Get read-optimized snapshot of the current configuration.
+
+            Immutable snapshot is cached and rebuilt only after the
+            configuration changes, so it's cheap to call this in a hot path.
+            Mutable snapshot is always a new copy.
+
+        :param immutable: Whether the snapshot shall be read-only.
+        :return: :class:`onacol.snapshot.ConfigSnapshot` instance.
+        """
+        if not immutable:
+            return ConfigSnapshot(self.config, immutable=False)
+
+        if self._snapshot is None:
+            self._snapshot = ConfigSnapshot(self.config)
+        return self._snapshot
+
+    def invalidate_validation(self) -> None:
+        """ Make the next :meth:`validate` validate the whole configuration
+            (needed with incremental validation, if the configuration was
+            changed directly, not through the ConfigManager methods).
+        """
+        self._full_validation_needed = True
+        self._dirty_paths.clear()
+
     def validate(self):
         """ Validate the configuration.
 
@@ -65,14 +475,144 @@ class ConfigManager:
         if self._validator is None:
             return
 
-        res = self._validator.validate(self.config)
+        with self._stats.phase("validate"):
+            self._validate(self._validator)
+
+    def _validate(self, validator: SchemaValidator) -> None:
+        if self._incremental_validation and \
+                not self._full_validation_needed:
+            for path in self._dirty_paths:
+                if validator.validate_path(self.config, path) \
+                        is not True:
+                    # Invalid or not possible to validate separately,
+                    # full validation reports all the errors.
+                    break
+            else:
+                self._stats.count("incremental_validations")
+                self._stats.count("validated_paths", len(self._dirty_paths))
+                self._dirty_paths.clear()
+                return
+
+        self._stats.count("full_validations")
+        self._full_validation_needed = True
+        res = validator.validate(self.config)
 
         if res is False:
             raise ConfigValidationError(
-                f"Invalid configuration: {self._validator.errors}")
+                f"Invalid configuration: {validator.errors}")
+
+        self._full_validation_needed = False
+        self._dirty_paths.clear()
+
+    def add_reload_callback(self, callback: Callable) -> None:
+        """ Register callback called after the configuration is reloaded.
+
+        :param callback: Callable with single argument - this ConfigManager.
+        """
+        self._reload_callbacks.append(callback)
+
+    def reload(self, validate: bool = True) -> bool:
+        """ Reload optional/additional config files changed on the disk
+            (modification time/size is checked first, files are re-read
+            and re-parsed only if changed). All the other layers (including
+            env vars, CLI options etc.) are kept on top of the reloaded
+            ones. The new configuration replaces the current one in
+            a single step, after it is validated.
+
+            Default configuration file (the schema) is not reloaded.
+
+        :param validate: Whether to validate the new configuration.
+        :return: True if the configuration was reloaded.
+        :raises: :class:`onacol.ConfigValidationError` if the new
+                 configuration is not valid (current configuration is kept).
+        """
+        validated = validate and self._validator is not None
+        if not self._file_handler.reload_files(
+                self._check_reloaded if validated else None,
+                lambda: self._apply_reload(validated)):
+            return False
+        self._reloaded()
+        return True
+
+    async def reload_async(self, validate: bool = True,
+                           executor: Any = None) -> bool:
+        """ Asynchronous :meth:`reload` - files are checked, parsed and
+            merged in the executor, together with the validation, layer
+            compaction, accessor and subscription updates (subscription
+            callbacks are called from the executor thread). Reload callbacks
+            are called from the event loop.
+
+        :param validate: Whether to validate the new configuration.
+        :param executor: :class:`concurrent.futures.Executor`, None for the
+                         default executor of the event loop.
+        :return: True if the configuration was reloaded.
+        """
+        validated = validate and self._validator is not None
+        if not await asyncio.get_running_loop().run_in_executor(
+                executor, self._file_handler.reload_files,
+                self._check_reloaded if validated else None,
+                lambda: self._apply_reload(validated)):
+            return False
+        self._reloaded()
+        return True
+
+    def _check_reloaded(self, config: CascaDict) -> None:
+        validator = self._validator
+        if validator is None:
+            return
+        if not validator.validate(config):
+            raise ConfigValidationError(
+                f"Invalid configuration: {validator.errors}")
+
+    def _apply_reload(self, validated: bool) -> None:
+        """ Register the reloaded configuration (called with the config
+            lock held, right after the configuration was replaced).
+        """
+        self._config_changed()
+        if validated:
+            self._full_validation_needed = False
+        self._layers_added()
+
+    def _reloaded(self) -> None:
+        for callback in self._reload_callbacks:
+            callback(self)
+
+    def watch(self, interval: float = 1.0) -> None:
+        """ Start background thread polling the config files for changes
+            (see :meth:`reload`). Errors of the reload (e.g. invalid
+            configuration) are logged.
+
+            Polling is used, as there is no file change notification
+            in the standard library.
+
+        :param interval: Polling interval in seconds.
+        """
+        if self._watcher is not None:
+            return
+        self._stop_watching.clear()
+
+        def poll():
+            while not self._stop_watching.wait(interval):
+                try:
+                    self.reload()
+                except OnacolException as e:
+                    logger.error("Config reload failed: %s", e)
+
+        self._watcher = threading.Thread(target=poll, name="onacol-watch",
+                                         daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self) -> None:
+        """ Stop the background file polling (see :meth:`watch`). """
+        if self._watcher is None:
+            return
+        self._stop_watching.set()
+        self._watcher.join()
+        self._watcher = None
 
     def _generate_config_file(self, config: dict, output_file: TextIO) -> None:
-        self._file_handler.save_with_schema(config, output_file)
+        with self._stats.phase("export"):
+            self._file_handler.save_with_schema(config, output_file)
 
     def generate_config_example(self, output_file: TextIO) -> None:
         self._generate_config_file(self._file_handler.default_config,
@@ -81,15 +621,41 @@ class ConfigManager:
     def export_current_config(self, output_file: TextIO) -> None:
         self._generate_config_file(self.config, output_file)
 
+    def export_config_delta(self, output_file: TextIO,
+                            base: Union[CascaDict, int, None] = None
+                            ) -> None:
+        """ Export minimal overlay config file - only values that differ
+            from the base configuration. Loading the file on top of the base
+            (see :meth:`config_from_file`) reproduces the current
+            configuration.
+
+        :param output_file: Destination file-like (text) object.
+        :param base: Base configuration - a layer of the current
+                     configuration, or index of the layer (0 is the
+                     defaults layer, see :attr:`layer_count`). None for
+                     the defaults.
+        """
+        if base is None or isinstance(base, int):
+            layer_index = 0 if base is None else base
+            base_layer = cascade_layers(self.config)[layer_index]
+        else:
+            base_layer = base
+        with self._stats.phase("export"):
+            self._file_handler.save_overlay(
+                config_delta(self.config, base_layer), output_file)
+
     def get_cli_opt_conf_value(self, cli_opt_name: str) -> None:
         return self._flat_schema_handler.get_config_from_cli_opt(
             self.config, cli_opt_name
         )
 
     def set_cli_opt_conf_value(self, cli_opt_name: str, value: Any) -> Any:
-        self._flat_schema_handler.set_config_from_cli_opt(
-            self.config, cli_opt_name, value
-        )
+        with self._file_handler.config_lock:
+            path = self._flat_schema_handler.set_config_from_cli_opt(
+                self.config, cli_opt_name, value
+            )
+            self._file_handler.configuration_modified()
+            self._config_changed([path])
 
     def get_env_var_conf_value(self, env_var_name: str) -> Any:
         return self._flat_schema_handler.get_config_from_env_var(
@@ -97,40 +663,94 @@ class ConfigManager:
         )
 
     def set_env_var_conf_value(self, env_var_name: str, value: Any) -> None:
-        return self._flat_schema_handler.set_config_from_env_var(
-            self.config, env_var_name, value
-        )
+        with self._file_handler.config_lock:
+            path = self._flat_schema_handler.set_config_from_env_var(
+                self.config, env_var_name, value
+            )
+            self._file_handler.configuration_modified()
+            self._config_changed([path])
 
     def merge_env_vars(self, env_var_list: list) -> None:
         """ Merge environment variables from the list with the current
             configuration.
-            (Creates new layer in the layered config).
+            (Creates new layer in the layered config, unless the list
+            is empty).
 
         :param env_var_list:  List of tuples (env_var_name, env_var_value).
         """
-        self.config = self.config.cascade()
-        for env_var_name, value in env_var_list:
-            self.set_env_var_conf_value(env_var_name, value)
+        with self._stats.phase("env_vars"):
+            self._merge_overrides(env_var_list, ())
 
     def merge_cli_opts(self, cli_opt_list: list) -> None:
         """ Merge CLI optional arguments from the list with the
             current configuration.
-            (Creates new layer in the layered config).
+            (Creates new layer in the layered config, unless the list
+            is empty).
 
         :param cli_opt_list: List of tuples (cli_opt_name, cli_opt_value).
         """
-        self.config = self.config.cascade()
-        for cli_opt_name, value in cli_opt_list:
-            self.set_cli_opt_conf_value(cli_opt_name, value)
-
-    def config_from_env_vars(self) -> None:
+        with self._stats.phase("cli_args"):
+            self._merge_overrides((), cli_opt_list)
+
+    def apply_overrides(self, env_vars: Iterable[tuple] = (),
+                        cli_opts: Iterable[tuple] = (),
+                        validate: bool = False) -> None:
+        """ Merge environment variables and CLI optional arguments with
+            the current configuration in a single new layer (CLI options
+            take precedence). Unless some value is unknown or invalid -
+            then the configuration is not changed at all.
+
+        :param env_vars: Tuples (env_var_name, env_var_value).
+        :param cli_opts: Tuples (cli_opt_name, cli_opt_value).
+        :param validate: Whether to validate the configuration afterwards
+                         (see :meth:`validate`).
+        :raises: :class:`onacol.flat_schema.OverrideError` with all the
+                 unknown names and invalid values.
+        """
+        with self._stats.phase("overrides"):
+            self._merge_overrides(env_vars, cli_opts)
+        if validate:
+            self.validate()
+
+    def _merge_overrides(self, env_vars: Iterable[tuple],
+                         cli_opts: Iterable[tuple]) -> None:
+        env_vars = list(env_vars)
+        cli_opts = list(cli_opts)
+        if not env_vars and not cli_opts:
+            return
+        with self._file_handler.config_lock:
+            layer = self.config.cascade()
+            paths = self._flat_schema_handler.set_config_values(
+                layer, env_vars, cli_opts)
+            self._set_config(layer)
+            self._config_changed(paths)
+            self._stats.count("layers_created")
+            self._stats.count("env_vars_merged", len(env_vars))
+            self._stats.count("cli_opts_merged", len(cli_opts))
+            self._layers_added()
+
+    def config_from_env_vars(self,
+                             environ: Union[abc.Mapping, None] = None,
+                             ignore_unknown: bool = False) -> None:
         """ Parse current system's environment variables, merge those with
             valid prefix to the current configuration.
+
+        :param environ:        Environment mapping to be used instead of
+                               ``os.environ`` (e.g. environment of a child
+                               process).
+        :param ignore_unknown: If True, prefixed environment variables that
+                               do not match any configuration path are
+                               ignored (and the environment does not need
+                               to be scanned). Otherwise, they are
+                               reported all together by
+                               :class:`onacol.flat_schema.OverrideError`.
         """
-        env_var_list = [(env_var_name, value) for env_var_name, value
-                        in os.environ.items() if
-                        self._flat_schema_handler.is_prefixed_env_var(
-                            env_var_name)]
+        if environ is None:
+            environ = os.environ
+        env_var_list = self._flat_schema_handler.get_env_vars(
+            environ, ignore_unknown=ignore_unknown)
+        if not ignore_unknown:
+            self._stats.count("env_vars_scanned", len(environ))
         self.merge_env_vars(env_var_list)
 
     def config_from_cli_args(self, cli_args: list) -> None:
@@ -168,7 +788,32 @@ class ConfigManager:
 
         :param file_path: Configuration file path.
         """
-        self._file_handler.load_additional_file(file_path)
+        file_data = self._file_handler.read_file_layer(file_path)
+        while True:
+            config = self.config
+            layer = self._file_handler.cascade_file_layer(file_data, config)
+            with self._file_handler.config_lock:
+                if self.config is config:
+                    self._file_handler.add_file_layer(file_path, file_data,
+                                                      layer)
+                    self._config_changed()
+                    self._layers_added()
+                    return
+            # Configuration replaced meanwhile, cascade from the new one
+
+    async def config_from_file_async(self, file_path: str,
+                                     executor: Any = None) -> None:
+        """ Asynchronous :meth:`config_from_file` - the whole update (file
+            parsing, new layer, layer compaction, accessor and subscription
+            updates) is done in the executor. Subscription callbacks are
+            therefore called from the executor thread.
+
+        :param file_path: Configuration file path.
+        :param executor: :class:`concurrent.futures.Executor`, None for the
+                         default executor of the event loop.
+        """
+        await asyncio.get_running_loop().run_in_executor(
+            executor, self.config_from_file, file_path)
 
     def config_from_dict(self, config_dict: dict) -> None:
         """ Load configuration from a dictionary.
@@ -176,4 +821,9 @@ class ConfigManager:
 
         :param config_dict:  Configuration dict.
         """
-        self.config = self.config.cascade(config_dict)
+        with self._file_handler.config_lock:
+            changed_paths = self._changed_paths(config_dict, self.config)
+            self._set_config(self.config.cascade(config_dict))
+            self._stats.count("layers_created")
+            self._config_changed(changed_paths)
+            self._layers_added()
@@ -0,0 +1,218 @@
+"""
+.. module: onacol.records
+   :synopsis: Compact storage of homogeneous configuration lists
+                (lists of dicts with the same keys).
+
+.. moduleauthor:: Josef Nevrly <josef.nevrly@gmail.com>
+"""
+from typing import Any, Iterable
+from collections import abc
+import copy
+
+_MISSING = object()
+
+
+class Record(abc.Mapping):
+    """ Read-only mapping view of a single item of :class:`RecordList`. """
+
+    __slots__ = ("_keys", "_index", "_columns", "_row")
+
+    def __init__(self, records: "RecordList", row: int):
+        self._keys = records._keys
+        self._index = records._index
+        self._columns = records._columns
+        self._row = row
+
+    def __getitem__(self, key: Any) -> Any:
+        try:
+            value = self._columns[self._index[key]][self._row]
+        except (KeyError, TypeError):
+            raise KeyError(key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key: Any) -> bool:
+        try:
+            return self._columns[self._index[key]][self._row] \
+                is not _MISSING
+        except (KeyError, TypeError):
+            return False
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self) -> int:
+        return len(self.keys())
+
+    # Views are replaced by lists (cheaper for the item access)
+    def keys(self) -> list:  # type: ignore
+        row = self._row
+        return [key for key, column in zip(self._keys, self._columns)
+                if column[row] is not _MISSING]
+
+    def items(self) -> list:  # type: ignore
+        row = self._row
+        return [(key, column[row])
+                for key, column in zip(self._keys, self._columns)
+                if column[row] is not _MISSING]
+
+    def values(self) -> list:  # type: ignore
+        return [value for _, value in self.items()]
+
+    def copy(self) -> dict:
+        return dict(self.items())
+
+    def __repr__(self):
+        return repr(self.copy())
+
+
+class RecordList(abc.Sequence):
+    """ Read-only sequence of mappings, stored column-wise - single list of
+        values per key, instead of a dict per item. Items are
+        :class:`Record` views, that are created on access.
+
+            >>> sensors = RecordList([{"id": 1, "name": "a"},
+            ...                       {"id": 2, "name": "b"}])
+            >>> sensors[1]["name"]
+            'b'
+    """
+
+    __slots__ = ("_keys", "_index", "_columns", "_length")
+
+    def __init__(self, items: Iterable[abc.Mapping] = ()):
+        """
+        :param items: Mappings (items do not need to have the same keys,
+                      but it's efficient only if they do).
+        """
+        self._index: dict = {}
+        self._columns: list = []
+        length = 0
+        for item in items:
+            if not isinstance(item, abc.Mapping):
+                raise TypeError(
+                    f"Only mapping items can be stored in RecordList, "
+                    f"not {type(item).__name__}")
+            for key, value in item.items():
+                try:
+                    column = self._columns[self._index[key]]
+                except KeyError:
+                    self._index[key] = len(self._columns)
+                    column = [_MISSING] * length
+                    self._columns.append(column)
+                column.append(value)
+            length += 1
+            for column in self._columns:
+                if len(column) < length:
+                    column.append(_MISSING)
+        self._keys = tuple(self._index)
+        self._length = length
+
+    def __getitem__(self, index: Any) -> Any:
+        if isinstance(index, slice):
+            return RecordList(self[i]
+                              for i in range(*index.indices(self._length)))
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("RecordList index out of range")
+        return Record(self, index)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, abc.Sequence) or isinstance(other, str):
+            return NotImplemented
+        return len(self) == len(other) and \
+            all(a == b for a, b in zip(self, other))
+
+    __hash__ = None  # type: ignore
+
+    def to_list(self) -> list:
+        """ Convert to list of dicts. """
+        return [item.copy() for item in self]
+
+    def __reduce__(self):
+        # Pickled as plain list (e.g. in the schema cache), it's compacted
+        # again when loaded.
+        return list, (self.to_list(),)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo: dict):
+        return self.__class__(copy.deepcopy(self.to_list(), memo))
+
+    def __repr__(self):
+        return f"RecordList({self.to_list()!r})"
+
+
+_CONTAINERS = (abc.Mapping, list, RecordList)
+
+
+def is_homogeneous(element: Any) -> bool:
+    """ Check if the element is a list of dicts that all have the same
+        keys.
+    """
+    if not isinstance(element, list) or not element:
+        return False
+    first = element[0]
+    if not isinstance(first, abc.Mapping):
+        return False
+    keys = set(first)
+    return all(isinstance(item, abc.Mapping) and len(item) == len(keys)
+               and keys.issuperset(item) for item in element)
+
+
+def compact_records(element: Any, min_length: int) -> Any:
+    """ Replace homogeneous lists of dicts in the configuration element
+        by :class:`RecordList`. Dicts are updated in place.
+
+    :param element:    Configuration element (dict, list or value).
+    :param min_length: Minimal length of lists to be compacted.
+    :return: The element (or its compact replacement).
+    """
+    if isinstance(element, abc.MutableMapping):
+        for k, v in element.items():
+            if isinstance(v, (abc.Mapping, list)):
+                element[k] = compact_records(v, min_length)
+    elif isinstance(element, list):
+        if len(element) >= min_length and is_homogeneous(element):
+            return RecordList(compact_records(item, min_length)
+                              for item in element)
+        for i, item in enumerate(element):
+            if isinstance(item, (abc.Mapping, list)):
+                element[i] = compact_records(item, min_length)
+    return element
+
+
+def expand_records(element: Any) -> Any:
+    """ Replace all :class:`RecordList` instances in the configuration
+        element by lists of dicts. The element is not modified, containers
+        on the paths to the replaced lists are copied.
+
+    :param element: Configuration element (dict, list or value).
+    :return: The element (or its expanded copy).
+    """
+    if isinstance(element, RecordList):
+        return [expand_records(item.copy()) for item in element]
+
+    expanded: Any = None
+    if isinstance(element, abc.Mapping):
+        for k, v in element.items():
+            if isinstance(v, _CONTAINERS):
+                expanded_value = expand_records(v)
+                if expanded_value is not v:
+                    if expanded is None:
+                        expanded = dict(element)
+                    expanded[k] = expanded_value
+    elif isinstance(element, list):
+        for i, item in enumerate(element):
+            if isinstance(item, _CONTAINERS):
+                expanded_item = expand_records(item)
+                if expanded_item is not item:
+                    if expanded is None:
+                        expanded = list(element)
+                    expanded[i] = expanded_item
+    return element if expanded is None else expanded
@@ -0,0 +1,127 @@
+"""
+.. module: onacol.schema_cache
+   :synopsis: Persistent on-disk cache of the compiled configuration schema.
+
+.. moduleauthor:: Josef Nevrly <josef.nevrly@gmail.com>
+"""
+from typing import Union, Iterable
+import hashlib
+import logging
+import os
+import pickle
+import sys
+import tempfile
+
+from . import __version__
+from .config_schema import ConfigSchema
+
+logger = logging.getLogger("onacol")
+
+
+class SchemaCache:
+    """ Stores the parsed default configuration file (schema, defaults,
+        flat schema, schema registry and flat schema mappings) in the cache
+        directory, so the YAML parsing and schema traversal can be skipped
+        on the next start.
+
+        Cache entries are keyed by the content of the default file, onacol
+        version, Python version and values of explicit environment variables
+        referenced in the file. Entry is automatically invalidated (and
+        recompiled) whenever any of those changes.
+
+        .. note:: Cache entries are pickled, so the cache directory must
+                  be trusted (writable only by the application's user).
+    """
+
+    CACHE_FILE_SUFFIX = ".onacol-cache"
+
+    def __init__(self, cache_dir: str):
+        """
+        :param cache_dir:   Directory where the cache files are stored.
+                            It is created if it does not exist.
+        """
+        self._cache_dir = str(cache_dir)
+
+    @property
+    def cache_dir(self) -> str:
+        return self._cache_dir
+
+    @staticmethod
+    def cache_key(yaml_string: str,
+                  sections: Union[Iterable[str], None] = None) -> str:
+        """ Compute cache key for the default config file content.
+
+        :param yaml_string:  Raw (unresolved) content of the default file.
+        :param sections:     Selected top-level sections of the schema (see
+                             :class:`onacol.config_schema.ConfigSchema`).
+        :return: Hex digest identifying the compiled schema.
+        """
+        key = hashlib.sha256()
+        key.update(__version__.encode())
+        key.update(f"{sys.version_info[0]}.{sys.version_info[1]}".encode())
+        key.update(yaml_string.encode())
+        if sections is not None:
+            key.update(repr(tuple(sections)).encode())
+
+        # Explicit env vars are resolved before parsing, so they are part
+        # of the compiled result.
+        for env_var_match in ConfigSchema.OC_ENV_REGEX.finditer(yaml_string):
+            env_var_name = env_var_match.group("var_name")
+            key.update(repr((env_var_name,
+                             os.environ.get(env_var_name))).encode())
+
+        return key.hexdigest()
+
+    def cache_file_path(self, default_file_path: str) -> str:
+        """ Path of the cache file for given default config file.
+            There is a single cache file per default file (stale entries are
+            overwritten, not accumulated).
+        """
+        abs_path = os.path.abspath(str(default_file_path))
+        path_digest = hashlib.sha256(abs_path.encode()).hexdigest()[:16]
+        return os.path.join(
+            self._cache_dir,
+            f"{os.path.basename(abs_path)}-{path_digest}"
+            f"{self.CACHE_FILE_SUFFIX}")
+
+    def load(self, default_file_path: str, key: str) -> Union[dict, None]:
+        """ Load compiled schema entry from the cache.
+
+        :param default_file_path:  Path to the default config file.
+        :param key:  Expected cache key (see :meth:`cache_key`).
+        :return: Cached entry or None if there is no valid entry.
+        """
+        cache_file_path = self.cache_file_path(default_file_path)
+        try:
+            with open(cache_file_path, "rb") as cache_file:
+                entry = pickle.load(cache_file)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning("Cannot read schema cache file %s (%s), "
+                           "recompiling.", cache_file_path, str(e))
+            return None
+
+        if not isinstance(entry, dict) or entry.get("key") != key:
+            logger.debug("Schema cache file %s is stale.", cache_file_path)
+            return None
+
+        return entry
+
+    def store(self, default_file_path: str, entry: dict) -> None:
+        """ Atomically store the compiled schema entry in the cache.
+
+        :param default_file_path:  Path to the default config file.
+        :param entry: Cache entry (must contain the "key" item).
+        """
+        cache_file_path = self.cache_file_path(default_file_path)
+        try:
+            os.makedirs(self._cache_dir, exist_ok=True)
+            with tempfile.NamedTemporaryFile(dir=self._cache_dir,
+                                             delete=False) as tmp_file:
+                pickle.dump(entry, tmp_file,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file.name, cache_file_path)
+        except OSError as e:
+            logger.warning("Cannot write schema cache file %s: %s",
+                           cache_file_path, str(e))
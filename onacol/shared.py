@@ -0,0 +1,230 @@
+"""
+.. module: onacol.shared
+   :synopsis: Resolved configuration shared between processes through
+                a memory-mapped file (e.g. workers of a pre-fork server).
+
+.. moduleauthor:: Josef Nevrly <josef.nevrly@gmail.com>
+"""
+from typing import Any, Union
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+
+from .base import OnacolException
+from .snapshot import ConfigSnapshot
+
+# File layout: magic, sequence number, payload length, payload.
+# Sequence number is odd while the payload is being written (seqlock), so
+# the readers never see partially written configuration. Published version
+# is the sequence number divided by two.
+_MAGIC = b"ONACOLSH"
+_HEADER = struct.Struct("<8sQQ")
+_SEQUENCE = struct.Struct("<Q")
+_SEQUENCE_OFFSET = 8
+
+# Number of attempts to read consistent payload
+_READ_ATTEMPTS = 1000
+
+
+class SharedConfigError(OnacolException):
+    pass
+
+
+class ConfigPublisher:
+    """ Publishes resolved configuration to a memory-mapped file. Every
+        publication increases the version, that is checked by the
+        :class:`ConfigSubscriber` instances (typically in other processes).
+
+            >>> publisher = ConfigPublisher("/run/myapp/config.shm")
+            >>> publisher.publish(config_manager.config)
+            1
+            >>> config_manager.add_reload_callback(
+            ...     lambda manager: publisher.publish(manager.config))
+    """
+
+    def __init__(self, path: Union[str, os.PathLike],
+                 initial_size: int = 65536):
+        """
+        :param path:         Path of the shared file (preferably on tmpfs,
+                             e.g. in ``/dev/shm`` or ``/run``). Versions
+                             continue from the existing file.
+        :param initial_size: Initial file size in bytes (it grows as needed).
+        """
+        self._path = str(path)
+        self._lock = threading.Lock()
+        fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            size = os.fstat(fd).st_size
+            sequence = length = 0
+            if size >= _HEADER.size:
+                with mmap.mmap(fd, size) as existing:
+                    magic, sequence, length = _HEADER.unpack_from(existing)
+                if magic != _MAGIC:
+                    raise SharedConfigError(
+                        f"Not a shared configuration file: {self._path}")
+                if sequence & 1:
+                    # Unfinished write of a crashed publisher
+                    sequence += 1
+                    length = 0
+            if size < max(initial_size, _HEADER.size):
+                size = max(initial_size, _HEADER.size)
+                os.ftruncate(fd, size)
+            self._mmap = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self._sequence = sequence
+        _HEADER.pack_into(self._mmap, 0, _MAGIC, sequence, length)
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def version(self) -> int:
+        """ Last published version (0 if nothing was published yet). """
+        return self._sequence // 2
+
+    def _ensure_size(self, size: int) -> None:
+        if size <= len(self._mmap):
+            return
+        new_size = max(size, 2 * len(self._mmap))
+        self._mmap.close()
+        with open(self._path, "r+b") as shared_file:
+            os.ftruncate(shared_file.fileno(), new_size)
+            self._mmap = mmap.mmap(shared_file.fileno(), new_size)
+
+    def publish(self, config: Any) -> int:
+        """ Publish the configuration.
+
+        :param config: Configuration (:class:`CascaDict`, plain dict or
+                       :class:`onacol.snapshot.ConfigSnapshot`).
+        :return: Published version.
+        """
+        data = ConfigSnapshot(config, immutable=False).data
+        payload = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._ensure_size(_HEADER.size + len(payload))
+            sequence = self._sequence + 1
+            _SEQUENCE.pack_into(self._mmap, _SEQUENCE_OFFSET, sequence)
+            self._mmap[_HEADER.size:_HEADER.size + len(payload)] = payload
+            _HEADER.pack_into(self._mmap, 0, _MAGIC, sequence, len(payload))
+            self._sequence = sequence + 1
+            _SEQUENCE.pack_into(self._mmap, _SEQUENCE_OFFSET, self._sequence)
+        return self.version
+
+    def close(self) -> None:
+        """ Unmap the file (the file is kept for the subscribers). """
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ConfigSubscriber:
+    """ Reads configuration published by :class:`ConfigPublisher`.
+
+        Checking for a new version is a single read from the shared memory,
+        so :meth:`snapshot` can be called in a hot path. Configuration is
+        deserialized only once per published version - no YAML parsing or
+        schema processing is done in the subscribers.
+
+            >>> subscriber = ConfigSubscriber("/run/myapp/config.shm")
+            >>> subscriber.snapshot()["can_bus"]["sensor_can"]["channel"]
+            'can0'
+    """
+
+    def __init__(self, path: Union[str, os.PathLike],
+                 immutable: bool = True):
+        """
+        :param path:      Path of the shared file.
+        :param immutable: Whether the snapshots shall be read-only (see
+                          :class:`onacol.snapshot.ConfigSnapshot`).
+        """
+        self._path = str(path)
+        self._immutable = immutable
+        self._lock = threading.Lock()
+        self._mmap = self._map()
+        if self._mmap[:len(_MAGIC)] != _MAGIC:
+            self._mmap.close()
+            raise SharedConfigError(
+                f"Not a shared configuration file: {self._path}")
+        # Version and snapshot, replaced at once
+        self._current: tuple = (0, None)
+
+    def _map(self) -> mmap.mmap:
+        with open(self._path, "rb") as shared_file:
+            return mmap.mmap(shared_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def version(self) -> int:
+        """ Version of the current snapshot (0 if none was read yet). """
+        return self._current[0]
+
+    @property
+    def published_version(self) -> int:
+        """ Last version published (or being published). """
+        return (_SEQUENCE.unpack_from(self._mmap, _SEQUENCE_OFFSET)[0]
+                + 1) // 2
+
+    def _read_payload(self) -> tuple:
+        """ Read consistent payload.
+
+        :return: Tuple (version, payload).
+        """
+        for _ in range(_READ_ATTEMPTS):
+            _, sequence, length = _HEADER.unpack_from(self._mmap)
+            if sequence & 1:
+                # Being written
+                time.sleep(0)
+                continue
+            if _HEADER.size + length > len(self._mmap):
+                # The file grew (the old map is not closed, it can be still
+                # used for the version check in other threads)
+                self._mmap = self._map()
+                continue
+            payload = self._mmap[_HEADER.size:_HEADER.size + length]
+            if _SEQUENCE.unpack_from(self._mmap,
+                                     _SEQUENCE_OFFSET)[0] == sequence:
+                return sequence // 2, payload
+        raise SharedConfigError(
+            f"Cannot read consistent configuration from {self._path}")
+
+    def snapshot(self) -> ConfigSnapshot:
+        """ Get snapshot of the last published configuration (the snapshot
+            is replaced only when a new version is published).
+
+        :return: :class:`onacol.snapshot.ConfigSnapshot` instance.
+        """
+        version, snapshot = self._current
+        if snapshot is not None and self.published_version == version:
+            return snapshot
+        with self._lock:
+            version, snapshot = self._current
+            if snapshot is None or self.published_version != version:
+                version, payload = self._read_payload()
+                if not payload:
+                    raise SharedConfigError(
+                        f"No configuration published in {self._path}")
+                snapshot = ConfigSnapshot(pickle.loads(payload),
+                                          immutable=self._immutable)
+                self._current = (version, snapshot)
+            return snapshot
+
+    def close(self) -> None:
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,102 @@
+"""
+.. module: onacol.snapshot
+   :synopsis: Read-optimized snapshots of the layered configuration.
+
+.. moduleauthor:: Josef Nevrly <josef.nevrly@gmail.com>
+"""
+from typing import Any, Iterator
+from collections import abc
+from types import MappingProxyType
+
+from cascadict import CascaDict  # type: ignore
+
+from .records import RecordList
+
+
+def _materialize(element: Any, path: tuple, flat_index: dict,
+                 immutable: bool) -> Any:
+    """ Recursively convert flattened configuration element to plain
+        (or immutable) containers and register all dict paths in the flat
+        index.
+    """
+    if isinstance(element, abc.Mapping):
+        materialized = {}
+        for k, v in element.items():
+            v_path = path + (k,)
+            materialized[k] = _materialize(v, v_path, flat_index, immutable)
+            flat_index[v_path] = materialized[k]
+        return MappingProxyType(materialized) if immutable else materialized
+
+    elif isinstance(element, (list, RecordList)):
+        # Lists are leaves in terms of configuration paths (same as in the
+        # flat schema), items are not indexed.
+        materialized_list = [_materialize(item, (), {}, immutable)
+                             for item in element]
+        return tuple(materialized_list) if immutable else materialized_list
+
+    return element
+
+
+class ConfigSnapshot(abc.Mapping):
+    """ Resolved configuration materialized from all the configuration
+        layers into plain nested dicts, with flat index of all configuration
+        paths. Reading from the snapshot costs single dict lookup regardless
+        of the number of configuration layers.
+
+        Snapshot behaves as a read-only mapping of the top-level config
+        sections, and it can be also indexed by configuration path tuples::
+
+            >>> snapshot["can_bus"]["sensor_can"]["channel"]
+            'can0'
+            >>> snapshot["can_bus", "sensor_can", "channel"]
+            'can0'
+    """
+
+    def __init__(self, config: dict, immutable: bool = True):
+        """
+        :param config:     Configuration (:class:`CascaDict` or plain dict).
+        :param immutable:  If True, dicts are wrapped to read-only mapping
+                           proxies and lists are converted to tuples.
+        """
+        if isinstance(config, CascaDict):
+            config = config.copy_flat()
+        self._immutable = immutable
+        self._flat_index: dict = {}
+        self._data = _materialize(config, (), self._flat_index, immutable)
+
+    @property
+    def data(self) -> abc.Mapping:
+        """ Materialized configuration (nested dicts). """
+        return self._data
+
+    @property
+    def flat_index(self) -> abc.Mapping:
+        """ Mapping of configuration path tuples to values. """
+        return MappingProxyType(self._flat_index) \
+            if self._immutable else self._flat_index
+
+    @property
+    def immutable(self) -> bool:
+        return self._immutable
+
+    def get_path(self, path: tuple, default: Any = None) -> Any:
+        """ Get value by configuration path.
+
+        :param path:  Tuple of keys (e.g. ``("ui", "port")``).
+        :param default: Value returned if the path does not exist.
+        """
+        return self._flat_index.get(path, default)
+
+    def __getitem__(self, key: Any) -> Any:
+        if isinstance(key, tuple):
+            return self._flat_index[key]
+        return self._data[key]
+
+    def __iter__(self) -> Iterator:
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __repr__(self):
+        return f"<ConfigSnapshot {dict(self._data)}>"
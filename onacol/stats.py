@@ -0,0 +1,148 @@
+"""
+.. module: onacol.stats
+   :synopsis: Timing and counters of the configuration processing phases.
+
+.. moduleauthor:: Josef Nevrly <josef.nevrly@gmail.com>
+"""
+from typing import Callable, Union, List
+from contextlib import nullcontext
+import threading
+import time
+
+
+# Shared no-op context of the disabled stats
+_NULL_PHASE = nullcontext()
+
+
+class _Phase:
+    """ Context measuring single run of a phase. """
+
+    __slots__ = ("_stats", "_name", "_start")
+
+    def __init__(self, stats: "ConfigStats", name: str):
+        self._stats = stats
+        self._name = name
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stats.record(self._name, time.perf_counter() - self._start)
+
+
+class ConfigStats:
+    """ Durations and counters of the configuration processing phases
+        (file reading, YAML parsing, schema processing, env var/CLI
+        processing, validation, ...).
+
+        Disabled stats record nothing - phases are measured using shared
+        no-op context, so the overhead is just a method call.
+
+        Phases::
+
+            >>> with stats.phase("parse_yaml"):
+            ...     parse()
+            >>> stats.count("bytes_read", len(data))
+            >>> stats.phases["parse_yaml"]
+            {'count': 1, 'duration': 0.0012}
+    """
+
+    def __init__(self, enabled: bool = True,
+                 hooks: Union[List[Callable], None] = None):
+        """
+        :param enabled: Whether to collect the stats.
+        :param hooks:   Callbacks called after each phase with two
+                        arguments - phase name and duration in seconds.
+        """
+        self._enabled = enabled
+        self._hooks: List[Callable] = list(hooks or [])
+        self._lock = threading.Lock()
+        self._phases: dict = {}
+        self._counters: dict = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self._enabled
+
+    @property
+    def phases(self) -> dict:
+        """ Phase name mapped to dict with number of runs ("count") and total
+            duration in seconds ("duration").
+        """
+        return self._phases
+
+    @property
+    def counters(self) -> dict:
+        """ Counter name mapped to the counter value. """
+        return self._counters
+
+    def add_hook(self, callback: Callable) -> None:
+        """ Add callback called after each phase.
+
+        :param callback: Callable with two arguments - phase name and
+                         duration in seconds.
+        """
+        self._hooks.append(callback)
+
+    def phase(self, name: str):
+        """ Context manager measuring the phase duration.
+
+        :param name: Phase name.
+        """
+        if not self._enabled:
+            return _NULL_PHASE
+        return _Phase(self, name)
+
+    def record(self, name: str, duration: float) -> None:
+        """ Record single run of the phase.
+
+        :param name:     Phase name.
+        :param duration: Duration in seconds.
+        """
+        if not self._enabled:
+            return
+        with self._lock:
+            try:
+                phase = self._phases[name]
+            except KeyError:
+                phase = self._phases[name] = {"count": 0, "duration": 0.0}
+            phase["count"] += 1
+            phase["duration"] += duration
+        for hook in self._hooks:
+            hook(name, duration)
+
+    def count(self, name: str, value: int = 1) -> None:
+        """ Increase the counter.
+
+        :param name:  Counter name.
+        :param value: Increment.
+        """
+        if not self._enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def reset(self) -> None:
+        """ Clear all the collected stats. """
+        with self._lock:
+            self._phases = {}
+            self._counters = {}
+
+    def as_dict(self) -> dict:
+        """ Copy of the collected stats (dict with "phases" and "counters").
+        """
+        with self._lock:
+            return {
+                "phases": {name: dict(phase)
+                           for name, phase in self._phases.items()},
+                "counters": dict(self._counters),
+            }
+
+    def __repr__(self):
+        return f"<ConfigStats {self.as_dict()}>"
+
+
+# Stats of the handlers used without ConfigManager
+DISABLED_STATS = ConfigStats(enabled=False)
@@ -0,0 +1,167 @@
+"""
+.. module: onacol.subscriptions
+   :synopsis: Subscriptions to changes of configuration paths.
+
+.. moduleauthor:: Josef Nevrly <josef.nevrly@gmail.com>
+"""
+from typing import Any, Callable, Iterable, List
+from collections import abc
+import itertools
+
+from cascadict import CascaDict  # type: ignore
+
+from .fingerprint import _encode
+from .snapshot import _materialize
+
+
+class _Missing:
+    """ Value of a configuration path, that does not exist. """
+
+    def __repr__(self):
+        return "MISSING"
+
+    def __bool__(self):
+        return False
+
+
+MISSING = _Missing()
+
+
+def get_path_value(config: abc.Mapping, path: tuple) -> Any:
+    """ Get value of the configuration path, materialized to immutable
+        containers (see :class:`onacol.snapshot.ConfigSnapshot`).
+
+    :param config: Configuration (:class:`CascaDict` or plain dict).
+    :param path:   Configuration path.
+    :return: The value or :data:`MISSING`.
+    """
+    value: Any = config
+    for key in path:
+        try:
+            value = value[key]
+        except (KeyError, TypeError, IndexError):
+            return MISSING
+    if isinstance(value, CascaDict):
+        value = value.copy_flat()
+    return _materialize(value, (), {}, True)
+
+
+class Subscription:
+    """ Subscription to the changes of a configuration path (including
+        the whole subtree under the path).
+    """
+
+    __slots__ = ("path", "callback", "value", "_order")
+
+    _counter = itertools.count()
+
+    def __init__(self, path: tuple, callback: Callable, value: Any):
+        """
+        :param path:     Configuration path.
+        :param callback: Callable with arguments path, old value and new
+                         value (:data:`MISSING` if the path does not exist).
+        :param value:    Current value of the path.
+        """
+        self.path = path
+        self.callback = callback
+        self.value = value
+        self._order = next(self._counter)
+
+    def __repr__(self):
+        return f"<Subscription {self.path}>"
+
+
+class _IndexNode:
+
+    __slots__ = ("children", "subscriptions")
+
+    def __init__(self):
+        self.children: dict = {}
+        self.subscriptions: List[Subscription] = []
+
+    def walk(self) -> Iterable[Subscription]:
+        yield from self.subscriptions
+        for child in self.children.values():
+            yield from child.walk()
+
+
+class SubscriptionIndex:
+    """ Prefix tree of the subscribed configuration paths, to find
+        subscriptions affected by the changed paths without walking all
+        of them.
+    """
+
+    def __init__(self):
+        self._root = _IndexNode()
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def add(self, subscription: Subscription) -> None:
+        node = self._root
+        for key in subscription.path:
+            node = node.children.setdefault(key, _IndexNode())
+        node.subscriptions.append(subscription)
+        self._count += 1
+
+    def remove(self, subscription: Subscription) -> None:
+        nodes = [self._root]
+        for key in subscription.path:
+            try:
+                nodes.append(nodes[-1].children[key])
+            except KeyError:
+                raise ValueError(f"Not subscribed: {subscription}")
+        nodes[-1].subscriptions.remove(subscription)
+        self._count -= 1
+
+        # Prune empty branch
+        for key, node, parent in zip(reversed(subscription.path),
+                                     reversed(nodes[1:]),
+                                     reversed(nodes[:-1])):
+            if node.subscriptions or node.children:
+                break
+            del parent.children[key]
+
+    def affected(self, paths: Iterable[tuple]) -> List[Subscription]:
+        """ Subscriptions affected by the change of the paths - subscribed
+            to the changed path, to a path above it, or to a path in
+            the changed subtree.
+
+        :param paths: Changed configuration paths.
+        :return: Subscriptions in the subscription order.
+        """
+        found: dict = {}
+        for path in paths:
+            node = self._root
+            for key in path:
+                found.update((id(s), s) for s in node.subscriptions)
+                node = node.children.get(key)
+                if node is None:
+                    break
+            else:
+                found.update((id(s), s) for s in node.walk())
+        return sorted(found.values(), key=lambda s: s._order)
+
+    def all(self) -> List[Subscription]:
+        """ All subscriptions in the subscription order. """
+        return sorted(self._root.walk(), key=lambda s: s._order)
+
+
+def notify_subscriptions(subscriptions: Iterable[Subscription],
+                         config: abc.Mapping) -> None:
+    """ Call callbacks of the subscriptions, whose value was changed in
+        the configuration.
+
+    :param subscriptions: Subscriptions to be checked.
+    :param config:        The changed configuration.
+    """
+    for subscription in subscriptions:
+        new_value = get_path_value(config, subscription.path)
+        old_value = subscription.value
+        if new_value is old_value or (
+                new_value is not MISSING and old_value is not MISSING and
+                _encode(new_value) == _encode(old_value)):
+            continue
+        subscription.value = new_value
+        subscription.callback(subscription.path, old_value, new_value)
@@ -0,0 +1,513 @@
+"""
+.. module: onacol.validation
+   :synopsis: Configuration validation (full and per-path incremental).
+
+.. moduleauthor:: Josef Nevrly <josef.nevrly@gmail.com>
+"""
+from functools import reduce
+from typing import Any, Union, Callable, Dict
+from collections import abc
+import operator
+import re
+
+from cerberus import Validator, errors as cerberus_errors  # type: ignore
+from cerberus.schema import SchemaRegistry  # type: ignore
+from cascadict import CascaDict  # type: ignore
+
+from .base import OnacolException
+from .records import expand_records
+
+
+class _ConfigValidator(Validator):
+    """ Cerberus validator, that validates flat copy of the layered
+        configuration. Cerberus normalization writes to a shallow copy of
+        the document, that would change the configuration layers.
+        Compact record lists are expanded, as Cerberus re-creates the
+        normalized items by their type.
+    """
+
+    def validate(self, document, *args, **kwargs):
+        if isinstance(document, CascaDict):
+            document = document.copy_flat()
+        elif isinstance(document, abc.Mapping):
+            document = {k: v.copy_flat() if isinstance(v, CascaDict) else v
+                        for k, v in document.items()}
+        return super().validate(expand_records(document), *args, **kwargs)
+
+
+class SchemaValidator:
+    """ Cerberus based validator of the configuration, that can also
+        validate just the sub-tree of a single configuration path.
+    """
+
+    # Rules of the intermediate (dict) elements, that do not depend
+    # on the values deeper in the configuration tree. Sub-tree validation
+    # is not possible through elements with other rules.
+    PASS_THROUGH_RULES = {"type", "schema", "allow_unknown", "nullable"}
+    # Rules of the fields, that depend on the sibling fields. Fields in the
+    # mapping with such rules are validated only by the full validation.
+    CROSS_FIELD_RULES = {"dependencies", "excludes"}
+
+    def __init__(self, schema: dict, schema_registry: SchemaRegistry,
+                 allow_unknown: bool = True):
+        """
+        :param schema:          Configuration schema
+                                (see :attr:`ConfigSchema.schema`).
+        :param schema_registry: Registry of the referenced schemas.
+        :param allow_unknown:   Whether to allow config items not defined
+                                in the schema.
+        """
+        self._schema = schema
+        self._schema_registry = schema_registry
+        self._allow_unknown = allow_unknown
+        self._validator = self._create_validator(schema, allow_unknown)
+        self._path_validators: dict = {}
+
+    def _create_validator(self, schema: dict, allow_unknown: Any) -> Any:
+        """ Create validator of a mapping (object with cerberus-like
+            ``validate()`` method and ``errors`` attribute).
+        """
+        return _ConfigValidator(schema,
+                                schema_registry=self._schema_registry,
+                                allow_unknown=allow_unknown)
+
+    @property
+    def errors(self) -> Any:
+        """ Errors of the last full validation (cerberus format). """
+        return self._validator.errors
+
+    def validate(self, config: abc.Mapping) -> bool:
+        """ Validate the whole configuration.
+
+        :param config: The configuration.
+        :return: True if valid, False otherwise (see :attr:`errors`).
+        """
+        return self._validator.validate(config)
+
+    def _get_path_validator(self, path: tuple) -> Any:
+        """ Get validator for the last element of the path (cached).
+
+        :return: Validator, True if there are no rules for the path
+                 (any value is valid) or False if the path cannot be
+                 validated separately.
+        """
+        try:
+            return self._path_validators[path]
+        except KeyError:
+            pass
+
+        rules: Any = self._schema
+        allow_unknown = self._allow_unknown
+        path_validator: Any = True
+        for i, key in enumerate(path):
+            if isinstance(rules, str):
+                rules = self._schema_registry.get(rules)
+            if not isinstance(rules, abc.Mapping):
+                path_validator = False
+                break
+
+            if self._has_cross_field_rules(rules):
+                # Changed field can affect validity of its siblings
+                path_validator = False
+                break
+
+            if key not in rules:
+                # Unknown elements are valid only if allowed
+                path_validator = allow_unknown is not False
+                break
+
+            field_rules = rules[key]
+            if i == len(path) - 1:
+                path_validator = self._create_validator({key: field_rules},
+                                                        allow_unknown)
+                break
+
+            if not (isinstance(field_rules, abc.Mapping) and
+                    set(field_rules.keys()) <= self.PASS_THROUGH_RULES):
+                path_validator = False
+                break
+
+            allow_unknown = field_rules.get("allow_unknown", allow_unknown)
+            rules = field_rules.get("schema")
+            if rules is None:
+                # No rules for the rest of the path
+                break
+
+        self._path_validators[path] = path_validator
+        return path_validator
+
+    def _has_cross_field_rules(self, rules: abc.Mapping) -> bool:
+        return any(not isinstance(field_rules, abc.Mapping) or
+                   not self.CROSS_FIELD_RULES.isdisjoint(field_rules)
+                   for field_rules in rules.values())
+
+    def validate_path(self, config: abc.Mapping,
+                      path: tuple) -> Union[bool, None]:
+        """ Validate only the sub-tree of the configuration under given path,
+            assuming the rest of the configuration has not changed since
+            the last successful validation.
+
+        :param config: The configuration.
+        :param path:   Configuration path (tuple of keys).
+        :return: True if valid, False if invalid, None if the path cannot be
+                 validated separately (full validation is needed).
+        """
+        path_validator = self._get_path_validator(path)
+        if path_validator is False:
+            return None
+
+        try:
+            parent = reduce(operator.getitem, path[:-1], config)
+            if not isinstance(parent, abc.Mapping):
+                return None
+            value = parent[path[-1]]
+        except (KeyError, TypeError, IndexError):
+            return None
+
+        if path_validator is True:
+            return True
+        return path_validator.validate({path[-1]: value})
+
+
+_MESSAGES = cerberus_errors.BasicErrorHandler.messages
+_NOT_NULLABLE = _MESSAGES[cerberus_errors.NOT_NULLABLE.code]
+_UNKNOWN_FIELD = _MESSAGES[cerberus_errors.UNKNOWN_FIELD.code]
+_REQUIRED_FIELD = _MESSAGES[cerberus_errors.REQUIRED_FIELD.code]
+
+
+def _message(error: Any, constraint: Any = None, value: Any = None,
+             *info) -> str:
+    return _MESSAGES[error.code].format(*info, constraint=constraint,
+                                        value=value)
+
+
+def _compile_min(min_value: Any) -> Callable:
+    msg = _message(cerberus_errors.MIN_VALUE, min_value)
+
+    def check_min(value):
+        try:
+            if value < min_value:
+                return msg
+        except TypeError:
+            pass
+        return None
+    return check_min
+
+
+def _compile_max(max_value: Any) -> Callable:
+    msg = _message(cerberus_errors.MAX_VALUE, max_value)
+
+    def check_max(value):
+        try:
+            if value > max_value:
+                return msg
+        except TypeError:
+            pass
+        return None
+    return check_max
+
+
+def _compile_minlength(min_length: int) -> Callable:
+    msg = _message(cerberus_errors.MIN_LENGTH, min_length)
+
+    def check_minlength(value):
+        if isinstance(value, abc.Iterable) and len(value) < min_length:
+            return msg
+        return None
+    return check_minlength
+
+
+def _compile_maxlength(max_length: int) -> Callable:
+    msg = _message(cerberus_errors.MAX_LENGTH, max_length)
+
+    def check_maxlength(value):
+        if isinstance(value, abc.Iterable) and len(value) > max_length:
+            return msg
+        return None
+    return check_maxlength
+
+
+def _compile_allowed(allowed_values: Any) -> Callable:
+    def check_allowed(value):
+        if isinstance(value, abc.Iterable) and not isinstance(value, str):
+            unallowed = tuple(x for x in value if x not in allowed_values)
+            if unallowed:
+                return _message(cerberus_errors.UNALLOWED_VALUES,
+                                allowed_values, value, unallowed)
+        elif value not in allowed_values:
+            return _message(cerberus_errors.UNALLOWED_VALUE,
+                            allowed_values, value)
+        return None
+    return check_allowed
+
+
+def _compile_regex(pattern: str) -> Callable:
+    msg = _message(cerberus_errors.REGEX_MISMATCH, pattern)
+    re_obj = re.compile(pattern if pattern.endswith("$") else pattern + "$")
+
+    def check_regex(value):
+        if isinstance(value, str) and not re_obj.match(value):
+            return msg
+        return None
+    return check_regex
+
+
+class _CompiledMappingValidator:
+    """ Validator of a mapping compiled from the cerberus schema into
+        specialized check functions. Reports errors in the same format
+        as cerberus.
+
+        Only the common rules are compiled, fields (or whole mappings)
+        with other rules are validated by cerberus.
+    """
+
+    # Rules compiled to the value check functions (applied in the order
+    # cerberus reports their errors).
+    VALUE_RULES: Dict[str, Callable[[Any], Callable[[Any], Any]]] = {
+        "allowed": _compile_allowed,
+        "max": _compile_max,
+        "maxlength": _compile_maxlength,
+        "min": _compile_min,
+        "minlength": _compile_minlength,
+        "regex": _compile_regex,
+    }
+
+    SUPPORTED_RULES = set(VALUE_RULES) | {
+        "type", "nullable", "schema", "allow_unknown", "required", "meta"}
+
+    # Rules depending on the other fields of the mapping or changing
+    # the mapping - the whole mapping is validated by cerberus.
+    MAPPING_RULES = set(Validator.normalization_rules) | {
+        "dependencies", "excludes", "require_all", "readonly"}
+
+    def __init__(self, schema: Union[dict, str],
+                 schema_registry: SchemaRegistry,
+                 allow_unknown: Any = True):
+        """
+        :param schema:          Cerberus schema of the mapping
+                                (or name of the schema in the registry).
+        :param schema_registry: Registry of the referenced schemas.
+        :param allow_unknown:   Whether to allow items not defined
+                                in the schema.
+        """
+        self._schema_registry = schema_registry
+        self._check = self._compile_mapping(schema, allow_unknown)
+        self.errors: dict = {}
+
+    def validate(self, document: abc.Mapping) -> bool:
+        self.errors = self._check(document)
+        return not self.errors
+
+    def _delegate_mapping(self, schema: dict, allow_unknown: Any) -> Callable:
+        validator = _ConfigValidator(schema,
+                                     schema_registry=self._schema_registry,
+                                     allow_unknown=allow_unknown)
+
+        def check_mapping(document):
+            if validator.validate(document):
+                return {}
+            return validator.errors
+        return check_mapping
+
+    def _delegate_field(self, field: Any, rules: Any,
+                        allow_unknown: Any) -> tuple:
+        validator = _ConfigValidator({field: rules},
+                                     schema_registry=self._schema_registry,
+                                     allow_unknown=allow_unknown)
+
+        def check_field(value):
+            if validator.validate({field: value}):
+                return []
+            return validator.errors.get(field, [])
+
+        def check_missing():
+            if validator.validate({}):
+                return []
+            return validator.errors.get(field, [])
+        return check_field, check_missing
+
+    def _compile_mapping(self, schema: Union[dict, str],
+                         allow_unknown: Any) -> Callable:
+        mapping_schema: dict = self._schema_registry.get(schema) \
+            if isinstance(schema, str) else schema
+
+        if not isinstance(allow_unknown, bool) or any(
+                not isinstance(rules, abc.Mapping) or
+                not self.MAPPING_RULES.isdisjoint(rules)
+                for rules in mapping_schema.values()):
+            return self._delegate_mapping(mapping_schema, allow_unknown)
+
+        checks = {}
+        missing_checks = []
+        for field, rules in mapping_schema.items():
+            check, check_missing = self._compile_field(field, rules,
+                                                       allow_unknown)
+            checks[field] = check
+            if check_missing is not None:
+                missing_checks.append((field, check_missing))
+        unknown_errors = None if allow_unknown else [_UNKNOWN_FIELD]
+
+        def check_mapping(document):
+            errors = {}
+            for field, value in document.items():
+                check = checks.get(field)
+                if check is None:
+                    if unknown_errors is not None:
+                        errors[field] = list(unknown_errors)
+                    continue
+                field_errors = check(value)
+                if field_errors:
+                    errors[field] = field_errors
+
+            for field, check_missing in missing_checks:
+                if field not in document:
+                    field_errors = check_missing()
+                    if field_errors:
+                        errors[field] = field_errors
+            return errors
+        return check_mapping
+
+    def _compile_type(self, data_type: Any
+                      ) -> Union[Callable[[Any], bool], None]:
+        if not data_type:
+            return None
+        types = (data_type,) if isinstance(data_type, str) else data_type
+        type_definitions = [(Validator.types_mapping[t].included_types,
+                             Validator.types_mapping[t].excluded_types)
+                            for t in types]
+
+        if len(type_definitions) == 1:
+            included, excluded = type_definitions[0]
+            if not excluded:
+                return lambda value: isinstance(value, included)
+            return lambda value: isinstance(value, included) and \
+                not isinstance(value, excluded)
+
+        return lambda value: any(
+            isinstance(value, included) and not isinstance(value, excluded)
+            for included, excluded in type_definitions)
+
+    def _compile_schema_rule(self, schema: Any, mapping_allow_unknown: Any,
+                             allow_unknown: Any) -> Callable[[Any], Any]:
+        # Sub-schemas are compiled on first use, the same rule is used
+        # either for list items or for mapping (and the schemas may be
+        # recursive).
+        compiled: dict = {}
+
+        def check_schema(value):
+            if isinstance(value, abc.Sequence) and not isinstance(value, str):
+                try:
+                    check_item = compiled["items"]
+                except KeyError:
+                    check_item = compiled["items"] = self._compile_field(
+                        0, schema, allow_unknown)[0]
+                errors = {}
+                for i, item in enumerate(value):
+                    item_errors = check_item(item)
+                    if item_errors:
+                        errors[i] = item_errors
+                return errors
+
+            elif isinstance(value, abc.Mapping):
+                try:
+                    check_mapping = compiled["mapping"]
+                except KeyError:
+                    check_mapping = compiled["mapping"] = \
+                        self._compile_mapping(schema, mapping_allow_unknown)
+                return check_mapping(value)
+
+            return None
+        return check_schema
+
+    def _compile_field(self, field: Any, rules: Any,
+                       allow_unknown: Any) -> tuple:
+        """ Compile check of a single field.
+
+        :return: Tuple (check of the value, check of the missing field or
+                 None).
+        """
+        if not isinstance(rules, abc.Mapping) or \
+                not self.SUPPORTED_RULES.issuperset(rules) or \
+                not all(t in Validator.types_mapping
+                        for t in ((rules.get("type"),)
+                                  if isinstance(rules.get("type"), str)
+                                  else rules.get("type") or ())):
+            return self._delegate_field(field, rules, allow_unknown)
+
+        nullable = rules.get("nullable", False)
+        type_check = self._compile_type(rules.get("type"))
+        type_errors = [_message(cerberus_errors.BAD_TYPE, rules.get("type"))]
+        value_checks = [self.VALUE_RULES[rule](rules[rule])
+                        for rule in sorted(self.VALUE_RULES.keys() & rules)]
+        schema_check: Union[Callable[[Any], Any], None] = None
+        if rules.get("schema") is not None:
+            schema_check = self._compile_schema_rule(
+                rules["schema"], rules.get("allow_unknown", allow_unknown),
+                allow_unknown)
+
+        def check_field(value):
+            if value is None:
+                return [] if nullable else [_NOT_NULLABLE]
+            if type_check is not None and not type_check(value):
+                return list(type_errors)
+
+            field_errors = []
+            for value_check in value_checks:
+                msg = value_check(value)
+                if msg is not None:
+                    field_errors.append(msg)
+            if schema_check is not None:
+                schema_errors = schema_check(value)
+                if schema_errors:
+                    field_errors.append(schema_errors)
+            return field_errors
+
+        if rules.get("required") is True:
+            return check_field, lambda: [_REQUIRED_FIELD]
+        return check_field, None
+
+
+class CompiledValidator(SchemaValidator):
+    """ Validator with the same interface and results as
+        :class:`SchemaValidator`, but with the schema compiled once to
+        specialized check functions, instead of cerberus interpreting
+        the rules on every validation. Much faster for big configurations
+        (e.g. long lists of items).
+    """
+
+    def __init__(self, schema: dict, schema_registry: SchemaRegistry,
+                 allow_unknown: bool = True):
+        """
+        :param schema:          Configuration schema
+                                (see :attr:`ConfigSchema.schema`).
+        :param schema_registry: Registry of the referenced schemas.
+        :param allow_unknown:   Whether to allow config items not defined
+                                in the schema.
+        """
+        # Cerberus checks the schema itself
+        Validator(schema, schema_registry=schema_registry,
+                  allow_unknown=allow_unknown)
+        super().__init__(schema, schema_registry, allow_unknown)
+
+    def _create_validator(self, schema: dict, allow_unknown: Any) -> Any:
+        return _CompiledMappingValidator(schema, self._schema_registry,
+                                         allow_unknown)
+
+
+VALIDATOR_BACKENDS = {
+    "cerberus": SchemaValidator,
+    "compiled": CompiledValidator,
+}
+
+
+def get_validator_class(backend: str) -> type:
+    """ Get validator class of the validation backend.
+
+    :param backend: Backend name (see :data:`VALIDATOR_BACKENDS`).
+    """
+    try:
+        return VALIDATOR_BACKENDS[backend]
+    except KeyError:
+        raise OnacolException(
+            f"Unknown validator backend '{backend}', use one "
+            f"of: {', '.join(VALIDATOR_BACKENDS)}.") from None
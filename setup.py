@@ -35,6 +35,11 @@ setup(
         'Programming Language :: Python :: 3.14',
     ],
     description="Oh No! Another Configuration Library",
+    entry_points={
+        'console_scripts': [
+            'onacol=onacol.cli:main',
+        ],
+    },
     install_requires=requirements,
     license="MIT license",
     long_description=readme + '\n\n' + history,
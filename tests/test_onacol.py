@@ -3,18 +3,57 @@
 """Tests for `onacol` package."""
 
 
+import asyncio
+import copy
+import io
+import json
+import multiprocessing
 import unittest
+from unittest import mock
 import os
+import pickle
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Any, Union
 
 from ruamel.yaml import YAML
 
-from onacol import ConfigManager, ConfigValidationError
-from onacol.config_file import ConfigFileHandler, ConfigFileException
-from onacol.config_schema import SchemaException
+from cascadict import CascaDict  # type: ignore
+from cerberus.schema import SchemaRegistry  # type: ignore
+
+from onacol import ConfigManager, ConfigValidationError, OnacolException
+from onacol.config_file import (
+    ConfigFileHandler,
+    ConfigFileException,
+    YAML_ACCESS as ONACOL_YAML_ACCESS,
+    YAML_LOADERS,
+    _select_sections,
+)
+from onacol.config_schema import ConfigSchema, SchemaException
+from onacol.schema_cache import SchemaCache
+from onacol.artifact import ArtifactError, read_artifact
+from onacol.cli import main as cli_main
+from onacol.layers import cascade_layers, compact_cascade, rebase_layer
+from onacol.validation import SchemaValidator, CompiledValidator
+from onacol.stats import ConfigStats, DISABLED_STATS
+from onacol.diff import config_delta, config_diff, ConfigDiff, ConfigDiffer
+from onacol.fingerprint import ConfigFingerprint, config_fingerprint
+from onacol.accessors import ConfigAccessor, accessor_class, bind_accessor
+from onacol.subscriptions import MISSING, Subscription, SubscriptionIndex
+from onacol.shared import ConfigPublisher, ConfigSubscriber, SharedConfigError
+from onacol.records import (
+    RecordList,
+    compact_records,
+    expand_records,
+    is_homogeneous,
+)
 from onacol.flat_schema import (
     UnknownConfigError,
     InvalidValueError,
+    OverrideError,
     FlatSchemaHandler,
     FlatSchemaMetadata,
     FlatValueType,
@@ -26,6 +65,7 @@ TESTS_DIR = Path(__file__).parent
 
 DEFAULT_TEST_FILE = TESTS_DIR / "test_yamls/test_schema.yaml"
 DEFAULT_DEFAULTS_FILE = TESTS_DIR / "test_yamls/test_defaults.yaml"
+EXPLICIT_ENV_VAR_DEFAULT_TEST_FILE = TESTS_DIR / "test_yamls/test_schema_explicit_env_vars.yaml"
 INVALID_YAML_DEFAULT_TEST_FILE = TESTS_DIR / "test_yamls/test_schema_invalid_yaml.yaml"
 SELF_REFERENTIAL_DEFAULT_TEST_FILE = TESTS_DIR / "test_yamls/test_schema_self_reference.yaml"
 TEST_OVERLAY_1 = TESTS_DIR / "test_yamls/test_overlay_1.yaml"
@@ -70,6 +110,34 @@ class TestConfigFileHandler(unittest.TestCase):
         with self.assertRaises(SchemaException):
             fh = ConfigFileHandler(SELF_REFERENTIAL_DEFAULT_TEST_FILE)
 
+    @mock.patch.dict(os.environ, {"OCTEST_LOG_LEVEL": "DEBUG",
+                                  "OCTEST_TIMEOUT": "10"})
+    def test_single_pass_explicit_env_vars(self):
+        with open(EXPLICIT_ENV_VAR_DEFAULT_TEST_FILE) as yaml_file:
+            yaml_string = yaml_file.read()
+        with self.assertLogs("onacol", level="WARNING"):
+            textual_schema = ConfigSchema(YAML_ACCESS.load(
+                ConfigSchema.resolve_explicit_env_vars(yaml_string)))
+
+        with mock.patch.object(ONACOL_YAML_ACCESS, "load",
+                               wraps=ONACOL_YAML_ACCESS.load) as load:
+            with self.assertLogs("onacol", level="WARNING"):
+                fh = ConfigFileHandler(EXPLICIT_ENV_VAR_DEFAULT_TEST_FILE)
+            self.assertEqual(load.call_count, 1)
+
+        self.assertDictEqual(fh.default_config, textual_schema.defaults)
+        self.assertDictEqual(fh.config_schema.schema, textual_schema.schema)
+        self.assertEqual(fh.default_config["general"]["timeout"], 10)
+        self.assertEqual(fh.default_config["general"]["quoted_timeout"],
+                         "10")
+        self.assertEqual(fh.default_config["general"]["hosts"],
+                         [10, "10", "static"])
+        self.assertIn("DEBUG_key", fh.default_config["general"])
+
+        # Unchanged sub-trees are shared with the round-trip document
+        self.assertIs(fh.default_config["untouched"]["value"],
+                      fh._schema_yaml["untouched"]["value"])
+
     def test_optional_files(self):
         optional_configs = [TEST_OVERLAY_1, NONEXISTENT_OVERLAY]
 
@@ -80,6 +148,26 @@ class TestConfigFileHandler(unittest.TestCase):
                          [f"WARNING:onacol:Optional config file at {TESTS_DIR}/test_yamls/nonexistent_overlay.yaml not found."])
         self.assertEqual(fh.optional_config_files, optional_configs)
 
+    def test_overlay_loaders(self):
+        fh = ConfigFileHandler(DEFAULT_TEST_FILE, [TEST_OVERLAY_1])
+        # No round-trip (CommentedMap) objects for overlays by default
+        self.assertIs(type(fh._load_yaml_file(
+            TEST_OVERLAY_1, loader=fh._overlay_loader)), dict)
+        for loader in ("rt", "pure", YAML(typ="safe")):
+            fh_other = ConfigFileHandler(DEFAULT_TEST_FILE, [TEST_OVERLAY_1],
+                                         overlay_loader=loader)
+            self.assertDictEqual(fh_other.configuration.copy_flat(),
+                                 fh.configuration.copy_flat())
+
+    def test_unknown_overlay_loader(self):
+        with self.assertRaises(ConfigFileException):
+            ConfigFileHandler(DEFAULT_TEST_FILE, overlay_loader="fastest")
+
+    def test_invalid_overlay(self):
+        fh = ConfigFileHandler(DEFAULT_TEST_FILE)
+        with self.assertRaises(ConfigFileException):
+            fh.load_additional_file(INVALID_YAML_DEFAULT_TEST_FILE)
+
     def test_save_with_schema(self):
         fh = ConfigFileHandler(DEFAULT_TEST_FILE)
         with open(TMP_FILE, "w") as export_file:
@@ -121,6 +209,25 @@ class TestConfigFileHandler(unittest.TestCase):
         self.assertListEqual(dump["sensor_config"]["sensors"],
                              fh.configuration["sensor_config"]["sensors"])
 
+    def test_save_with_schema_keeps_schema(self):
+        fh = ConfigFileHandler(DEFAULT_TEST_FILE, [TEST_OVERLAY_SHORTER_LIST])
+        schema_dump = io.StringIO()
+        YAML_ACCESS.dump(fh._schema_yaml, schema_dump)
+
+        exports = []
+        for _ in range(2):
+            export_file = io.StringIO()
+            fh.save_with_schema(fh.configuration, export_file)
+            exports.append(export_file.getvalue())
+
+        self.assertEqual(exports[0], exports[1])
+        self.assertIn("# Port to on which the UI HTTP server", exports[0])
+        self.assertNotIn("oc_schema", exports[0])
+        # Schema document is not modified by the export
+        after_dump = io.StringIO()
+        YAML_ACCESS.dump(fh._schema_yaml, after_dump)
+        self.assertEqual(schema_dump.getvalue(), after_dump.getvalue())
+
 
 class TestConfigManagerInitialization(unittest.TestCase):
     """Tests for `onacol` package."""
@@ -176,6 +283,45 @@ class TestConfigManager(unittest.TestCase):
         with open(TMP_FILE, "w") as dump_file:
             self._cm.export_current_config(dump_file)
 
+    def test_export_config_delta(self):
+        self._cm.config_from_file(TEST_OVERLAY_LONGER_LIST)
+        self._cm.config_from_dict({"ui": {"port": 1000, "addr": "0.0.0.0"}})
+        self._cm.apply_overrides(
+            cli_opts=[("bottom-sensor--state-enabled", "false")])
+        with open(TMP_FILE, "w") as dump_file:
+            self._cm.export_config_delta(dump_file)
+
+        with open(TMP_FILE) as yaml_file:
+            delta = YAML_ACCESS.load(yaml_file)
+        self.assertEqual(delta["ui"], {"port": 1000})
+        self.assertEqual(delta["bottom_sensor"], {"state_enabled": False})
+        self.assertIn("sensors", delta["sensor_config"])
+
+        cm = ConfigManager(DEFAULT_TEST_FILE, env_var_prefix="ONAC")
+        cm.config_from_file(TMP_FILE)
+        self.assertEqual(cm.config.copy_flat(), self._cm.config.copy_flat())
+
+    def test_export_config_delta_base_layer(self):
+        self._cm.config_from_file(TEST_OVERLAY_LONGER_LIST)
+        self._cm.config_from_dict({"ui": {"port": 1000}})
+        dump_file = io.StringIO()
+        self._cm.export_config_delta(dump_file, base=1)
+        self.assertEqual(YAML_ACCESS.load(dump_file.getvalue()),
+                         {"ui": {"port": 1000}})
+
+        dump_file = io.StringIO()
+        self._cm.export_config_delta(dump_file, base=self._cm.config)
+        self.assertEqual(YAML_ACCESS.load(dump_file.getvalue()), {})
+
+    def test_config_delta(self):
+        base = {"a": {"b": 1, "c": [1, 2]}, "d": 1, "e": "x"}
+        config = {"a": {"b": 1, "c": [1, 3], "new": {"x": 1}},
+                  "d": True, "e": "x", "f": {}}
+        self.assertEqual(config_delta(config, base),
+                         {"a": {"c": [1, 3], "new": {"x": 1}},
+                          "d": True, "f": {}})
+        self.assertEqual(config_delta(CascaDict(base).cascade(), base), {})
+
     def test_implicit_env_var_config(self):
         # Add some env var
         PREAC_TIMEOUT = 6
@@ -219,6 +365,40 @@ class TestConfigManager(unittest.TestCase):
             self._cm.config_from_env_vars()
         del os.environ["ONAC_BOTTOM_SENSOR__SOMETHING_STUPID"]
 
+    def test_env_vars_from_mapping(self):
+        environ = {"ONAC_UI__PORT": "1000",
+                   "ONAC_BOTTOM_SENSOR__STATE_ENABLED": "false",
+                   "OTHER_UI__PORT": "2000"}
+        self._cm.config_from_env_vars(environ)
+        self.assertEqual(self._cm.config["ui"]["port"], 1000)
+        self.assertIs(self._cm.config["bottom_sensor"]["state_enabled"],
+                      False)
+
+    def test_unknown_env_vars_batch(self):
+        environ = {"ONAC_UI__PORT": "1000",
+                   "ONAC_UI__NONSENSE": "1",
+                   "ONAC_NONSENSE": "1"}
+        with self.assertRaises(OverrideError) as cm:
+            self._cm.config_from_env_vars(environ)
+        self.assertEqual(set(cm.exception.errors),
+                         {"ONAC_UI__NONSENSE", "ONAC_NONSENSE"})
+        self.assertEqual(self._cm.config["ui"]["port"], 8888)
+
+        self._cm.config_from_env_vars(environ, ignore_unknown=True)
+        self.assertEqual(self._cm.config["ui"]["port"], 1000)
+
+    def test_get_env_vars_intersection(self):
+        handler = self._cm._flat_schema_handler
+        small = {"ONAC_UI__PORT": "1", "ONAC_NONSENSE": "2"}
+        large = dict(small, **{f"VAR_{i}": str(i) for i in range(1000)})
+        for environ in (small, large):
+            self.assertEqual(
+                handler.get_env_vars(environ, ignore_unknown=True),
+                [("ONAC_UI__PORT", "1")])
+            self.assertEqual(
+                sorted(handler.get_env_vars(environ)),
+                [("ONAC_NONSENSE", "2"), ("ONAC_UI__PORT", "1")])
+
     def test_implicit_env_var_json(self):
         os.environ["ONAC_SENSOR_CONFIG__SENSORS"] = \
             '[{"id": 2, "name": "json_sensor", "min_trigger_limit": 65, "max_trigger_limit": 200}]'
@@ -243,6 +423,48 @@ class TestConfigManager(unittest.TestCase):
             self._cm.config_from_env_vars()
         del os.environ["ONAC_SENSOR_CONFIG__SENSORS"]
 
+    def test_apply_overrides(self):
+        layer_count = self._cm.layer_count
+        self._cm.apply_overrides(
+            env_vars=[("ONAC_UI__PORT", "1000"),
+                      ("ONAC_UI__ADDR", "127.0.0.1"),
+                      ("ONAC_BOTTOM_SENSOR__STATE_ENABLED", "false")],
+            cli_opts=[("ui--port", "2000")],
+            validate=True)
+        self.assertEqual(self._cm.layer_count, layer_count + 1)
+        self.assertEqual(self._cm.config["ui"]["port"], 2000)
+        self.assertEqual(self._cm.config["ui"]["addr"], "127.0.0.1")
+        self.assertIs(self._cm.config["bottom_sensor"]["state_enabled"],
+                      False)
+
+    def test_apply_overrides_errors(self):
+        expected = self._cm.config.copy_flat()
+        layer_count = self._cm.layer_count
+        with self.assertRaises(OverrideError) as cm:
+            self._cm.apply_overrides(
+                env_vars=[("ONAC_UI__PORT", "1000"),
+                          ("ONAC_UI__NONSENSE", "1"),
+                          ("ONAC_SENSOR_CONFIG__SENSORS", "[1,")],
+                cli_opts=[("nonsense", "1")])
+        self.assertEqual(set(cm.exception.errors),
+                         {"ONAC_UI__NONSENSE", "ONAC_SENSOR_CONFIG__SENSORS",
+                          "nonsense"})
+        self.assertIsInstance(cm.exception.errors["ONAC_UI__NONSENSE"],
+                              UnknownConfigError)
+        self.assertIsInstance(
+            cm.exception.errors["ONAC_SENSOR_CONFIG__SENSORS"],
+            InvalidValueError)
+        # Configuration is not changed
+        self.assertEqual(self._cm.layer_count, layer_count)
+        self.assertEqual(self._cm.config.copy_flat(), expected)
+
+    def test_apply_overrides_validation(self):
+        with self.assertRaises(ConfigValidationError):
+            self._cm.apply_overrides(
+                env_vars=[("ONAC_BOTTOM_SENSOR__PREACTIVATION_TIMEOUT",
+                           "11")],
+                validate=True)
+
     def test_explicit_env_var(self):
         NEW_VAL = 10
         os.environ["EXISTING_ENV_VAR"] = str(NEW_VAL)
@@ -335,6 +557,877 @@ class TestConfigManager(unittest.TestCase):
             val, self._cm.config["bottom_sensor"]["preactivation_timeout"]
         )
 
+    def test_snapshot(self):
+        snapshot = self._cm.snapshot()
+        self.assertDictEqual(dict(snapshot.data["ui"]),
+                             self._cm.config["ui"].copy_flat())
+        self.assertEqual(snapshot["can_bus", "sensor_can", "channel"],
+                         "can0")
+        self.assertEqual(snapshot["can_bus"]["sensor_can"]["channel"],
+                         "can0")
+        self.assertEqual(snapshot.get_path(("ui", "nonexistent"), 1), 1)
+        self.assertEqual(len(snapshot), len(self._cm.config))
+        self.assertListEqual(list(snapshot), list(self._cm.config))
+
+        # Snapshot is cached until the config changes
+        self.assertIs(self._cm.snapshot(), snapshot)
+
+        self._cm.config_from_dict({"ui": {"port": 9999}})
+        snapshot_2 = self._cm.snapshot()
+        self.assertIsNot(snapshot_2, snapshot)
+        self.assertEqual(snapshot_2["ui", "port"], 9999)
+        self.assertEqual(snapshot["ui", "port"], 8888)
+
+        self._cm.set_cli_opt_conf_value("ui--port", "7777")
+        self.assertEqual(self._cm.snapshot()["ui", "port"], 7777)
+
+        self._cm.set_env_var_conf_value("ONAC_UI__PORT", "6666")
+        self.assertEqual(self._cm.snapshot()["ui", "port"], 6666)
+
+        self._cm.config_from_file(TEST_OVERLAY_1)
+        self.assertEqual(self._cm.snapshot()["general", "log_level"],
+                         "DEBUG")
+
+    def test_snapshot_immutability(self):
+        snapshot = self._cm.snapshot()
+        with self.assertRaises(TypeError):
+            snapshot.data["ui"]["port"] = 1  # type: ignore
+        self.assertIsInstance(snapshot["sensor_config", "sensors"], tuple)
+        with self.assertRaises(TypeError):
+            snapshot.flat_index[("ui", "port")] = 1  # type: ignore
+
+        mutable = self._cm.snapshot(immutable=False)
+        self.assertFalse(mutable.immutable)
+        mutable.data["ui"]["port"] = 1
+        mutable["sensor_config", "sensors"].append({})
+        self.assertEqual(self._cm.config["ui"]["port"], 8888)
+        self.assertEqual(len(self._cm.config["sensor_config"]["sensors"]), 3)
+        self.assertIsNot(self._cm.snapshot(immutable=False), mutable)
+
+
+class TestLayerCompaction(unittest.TestCase):
+
+    def test_empty_merges(self):
+        cm = ConfigManager(DEFAULT_TEST_FILE, env_var_prefix="ONAC")
+        cm.merge_env_vars([])
+        cm.merge_cli_opts([])
+        cm.config_from_cli_args(["--unknown", "1"])
+        self.assertEqual(cm.layer_count, 1)
+
+    def test_compact(self):
+        cm = ConfigManager(DEFAULT_TEST_FILE, env_var_prefix="ONAC")
+        cm.config_from_file(TEST_OVERLAY_1)
+        cm.config_from_dict({"ui": {"port": 1000, "addr": "127.0.0.1"}})
+        cm.config_from_dict({"ui": {"port": 2000}})
+        cm.merge_cli_opts([("bottom-sensor--preactivation-timeout", "7")])
+        cm.config_from_file(TEST_OVERLAY_SHORTER_LIST)
+        expected = cm.config.copy_flat()
+        defaults = cm.config.get_root()
+        self.assertEqual(cm.layer_count, 6)
+        # TEST_OVERLAY_1 sets float sensor_reset_interval (invalid), the
+        # validation result must not change by the compaction.
+        valid_before = cm._validator.validate(cm.config)
+        errors_before = cm._validator.errors
+
+        provenance: dict = {}
+        cm.compact(provenance)
+        self.assertEqual(cm.layer_count, 2)
+        self.assertIs(cm.config.get_root(), defaults)
+        self.assertDictEqual(cm.config.copy_flat(), expected)
+        self.assertEqual(provenance[("ui", "port")], 3)
+        self.assertEqual(provenance[("ui", "addr")], 2)
+        self.assertEqual(provenance[("general", "log_level")], 1)
+        self.assertEqual(
+            provenance[("bottom_sensor", "preactivation_timeout")], 4)
+        self.assertNotIn(("ui",), provenance)
+        self.assertFalse(valid_before)
+        self.assertEqual(cm._validator.validate(cm.config), valid_before)
+        self.assertEqual(cm._validator.errors, errors_before)
+
+        # Already compact
+        config = cm.config
+        cm.compact()
+        self.assertIs(cm.config, config)
+
+    def test_compact_replaced_subtree(self):
+        root = CascaDict({"a": {"x": 1, "y": 2}, "b": 1})
+        config = root.cascade({"a": 5}).cascade({"a": {"z": 3}})
+        expected = config.copy_flat()
+        compacted = compact_cascade(config)
+        self.assertEqual(len(cascade_layers(compacted)), 2)
+        self.assertDictEqual(compacted.copy_flat(), expected)
+        self.assertDictEqual(compacted.copy_flat(),
+                             {"a": {"z": 3}, "b": 1})
+
+    def test_compact_invalid_base(self):
+        with self.assertRaises(ValueError):
+            compact_cascade(CascaDict({}).cascade({}).cascade({}),
+                            base=CascaDict({}))
+
+    def test_max_layers(self):
+        with self.assertRaises(OnacolException):
+            ConfigManager(DEFAULT_TEST_FILE, max_layers=1)
+
+        def lookup_cost(manager):
+            # Number of layers walked to look up a default value
+            with mock.patch.object(CascaDict, "get_ancestor",
+                                   autospec=True,
+                                   side_effect=lambda d: d._ancestor) as ga:
+                manager.config["ui"]["addr"]
+            return ga.call_count
+
+        cm = ConfigManager(DEFAULT_TEST_FILE, env_var_prefix="ONAC",
+                           max_layers=3)
+        lookup_costs = []
+        for i in range(50):
+            cm.merge_cli_opts([("ui--port", str(i))])
+            cm.merge_env_vars(
+                [("ONAC_BOTTOM_SENSOR__PREACTIVATION_TIMEOUT", str(i % 10))])
+            cm.config_from_dict({"general": {"log_level": str(i)}})
+            self.assertLessEqual(cm.layer_count, 3)
+            lookup_costs.append(lookup_cost(cm))
+
+        # Lookup cost stays constant regardless of the number of merges
+        self.assertLessEqual(max(lookup_costs), max(lookup_costs[:2]))
+
+        self.assertEqual(cm.config["ui"]["port"], 49)
+        self.assertEqual(cm.config["ui"]["addr"], "0.0.0.0")
+        self.assertEqual(
+            cm.config["bottom_sensor"]["preactivation_timeout"], 9)
+        self.assertEqual(cm.config["general"]["log_level"], "49")
+        self.assertEqual(cm.config.get_root().copy_flat(),
+                         cm._file_handler.default_config)
+        cm.validate()
+
+
+class TestIncrementalValidation(unittest.TestCase):
+
+    def setUp(self):
+        self._cm = ConfigManager(DEFAULT_TEST_FILE, env_var_prefix="ONAC",
+                                 incremental_validation=True)
+        self._cm.validate()
+
+    def test_changed_paths_only(self):
+        with mock.patch.object(SchemaValidator, "validate") as full, \
+                mock.patch.object(SchemaValidator, "validate_path",
+                                  autospec=True,
+                                  side_effect=SchemaValidator.validate_path
+                                  ) as validate_path:
+            self._cm.set_cli_opt_conf_value(
+                "bottom-sensor--preactivation-timeout", "7")
+            self._cm.set_env_var_conf_value(
+                "ONAC_CAN_BUS__VEHICLE_CAN__CHANNEL", "can7")
+            self._cm.config_from_dict({"ui": {"port": 1}})
+            self._cm.validate()
+            full.assert_not_called()
+            self.assertSetEqual(
+                {c.args[2] for c in validate_path.call_args_list},
+                {("bottom_sensor", "preactivation_timeout"),
+                 ("can_bus", "vehicle_can", "channel"),
+                 ("ui", "port")})
+
+            # Nothing changed, nothing validated
+            validate_path.reset_mock()
+            self._cm.validate()
+            validate_path.assert_not_called()
+            full.assert_not_called()
+
+    def test_invalid_change_reports_full_errors(self):
+        reference = ConfigManager(DEFAULT_TEST_FILE, env_var_prefix="ONAC")
+        for cm in (self._cm, reference):
+            cm.set_cli_opt_conf_value(
+                "bottom-sensor--preactivation-timeout", "11")
+
+        with self.assertRaises(ConfigValidationError) as incremental_error:
+            self._cm.validate()
+        with self.assertRaises(ConfigValidationError) as full_error:
+            reference.validate()
+        self.assertEqual(str(incremental_error.exception),
+                         str(full_error.exception))
+
+        # Still invalid on repeated validation
+        with self.assertRaises(ConfigValidationError):
+            self._cm.validate()
+
+        self._cm.set_cli_opt_conf_value(
+            "bottom-sensor--preactivation-timeout", "5")
+        self._cm.validate()
+
+    def test_registry_reference(self):
+        self._cm.config_from_dict(
+            {"can_bus": {"vehicle_can": {"channel": 1}}})
+        with self.assertRaises(ConfigValidationError):
+            self._cm.validate()
+
+    def test_structural_change(self):
+        # Replacing the whole section is validated as well
+        self._cm.config_from_dict({"ui": 5})
+        with self.assertRaises(ConfigValidationError):
+            self._cm.validate()
+
+        with mock.patch.object(SchemaValidator, "validate", autospec=True,
+                               side_effect=SchemaValidator.validate) as full:
+            self._cm.config_from_file(TEST_OVERLAY_INVALID_VALUE)
+            with self.assertRaises(ConfigValidationError):
+                self._cm.validate()
+            full.assert_called_once()
+
+            full.reset_mock()
+            self._cm.config = self._cm.config.get_root()
+            self._cm.validate()
+            full.assert_called_once()
+
+    def test_disabled_by_default(self):
+        cm = ConfigManager(DEFAULT_TEST_FILE)
+        cm.validate()
+        cm.config["general"]["log_level"] = 5
+        with self.assertRaises(ConfigValidationError):
+            cm.validate()
+
+    def test_direct_change(self):
+        self._cm.config["general"]["log_level"] = 5
+        # Not tracked
+        self._cm.validate()
+        self._cm.invalidate_validation()
+        with self.assertRaises(ConfigValidationError):
+            self._cm.validate()
+
+    def test_cross_field_rules(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        default_file = os.path.join(tmp_dir, "defaults.yaml")
+        with open(default_file, "w") as f:
+            f.write("net:\n"
+                    "    mode: a\n"
+                    "    port:\n"
+                    "        oc_default: 80\n"
+                    "        oc_schema:\n"
+                    "            type: integer\n"
+                    "            dependencies:\n"
+                    "                mode: [a]\n")
+        cm = ConfigManager(default_file, env_var_prefix="X",
+                           incremental_validation=True)
+        cm.validate()
+        cm.set_env_var_conf_value("X_NET__MODE", "b")
+        with self.assertRaises(ConfigValidationError) as error:
+            cm.validate()
+        self.assertIn("depends on these values", str(error.exception))
+        self.assertIsNone(cm._validator.validate_path(cm.config,
+                                                      ("net", "mode")))
+
+    def test_validate_path(self):
+        fh = ConfigFileHandler(DEFAULT_TEST_FILE)
+        validator = SchemaValidator(fh.config_schema.schema,
+                                    fh.config_schema.schema_registry)
+        config = fh.configuration
+        # No rules for the path
+        self.assertTrue(validator.validate_path(
+            config, ("bottom_sensor", "uart", "device")))
+        self.assertIsNone(validator.validate_path(config, ("unknown", "x")))
+        # Unknown item in the section not allowing unknown items
+        self.assertIsNone(validator.validate_path(
+            config, ("can_bus", "sensor_can", "unknown")))
+        # Through lists
+        self.assertIsNone(validator.validate_path(
+            config, ("sensor_config", "sensors", "id")))
+        # Non-existing value
+        self.assertIsNone(validator.validate_path(
+            config, ("bottom_sensor", "nonexistent")))
+        self.assertTrue(validator.validate_path(
+            config, ("can_bus", "vehicle_can", "channel")))
+
+
+class TestCompiledValidator(unittest.TestCase):
+
+    PARITY_SCHEMA = {
+        "items": {"type": "list", "schema": {"type": "dict", "schema": {
+            "id": {"type": "integer", "min": 0},
+            "name": {"type": "string"}}}},
+        "closed": {"type": "dict", "allow_unknown": False, "schema": {
+            "x": {"type": "integer", "allowed": [1, 2]}}},
+        "opt": {"nullable": True, "type": "integer", "allowed": [1]},
+        "req": {"type": "integer", "required": True},
+        "any_of": {"allowed": [1, 2]},
+        "text": {"regex": "a+", "minlength": 2, "maxlength": 3,
+                 "allowed": ["x"]},
+        "num": {"type": ["integer", "float"], "min": 1, "max": 3},
+        "keys": {"type": "dict", "allowed": ["a"],
+                 "schema": {"a": {"type": "integer"}}},
+        # Not compiled, validated by cerberus
+        "not_empty": {"type": "string", "empty": False},
+        "ref": {"type": "dict", "schema": "ref_def"},
+    }
+
+    PARITY_DOCUMENTS = [
+        {"req": 1},
+        {},
+        {"items": [{"id": -1, "name": 1}, {"id": "x"}, 5],
+         "closed": {"x": 3, "y": 1}, "opt": None, "any_of": [1, 3],
+         "text": "b", "keys": {"a": "s", "b": 1}, "not_empty": "",
+         "ref": {"q": "1"}, "unknown": 1},
+        {"closed": None, "opt": "s", "req": None, "any_of": None,
+         "num": True},
+        {"closed": {"x": None}, "req": 1.5, "items": "str", "num": 0.5,
+         "text": "aaaa"},
+        {"req": 2, "items": [], "num": "3", "text": ["a", "x"],
+         "keys": "a"},
+    ]
+
+    def setUp(self):
+        self._fh = ConfigFileHandler(DEFAULT_TEST_FILE)
+
+    def assertParity(self, schema, registry, documents,
+                     allow_unknown=True):
+        cerberus = SchemaValidator(schema, registry, allow_unknown)
+        compiled = CompiledValidator(schema, registry, allow_unknown)
+        for document in documents:
+            with self.subTest(document=document):
+                self.assertEqual(compiled.validate(document),
+                                 cerberus.validate(document))
+                self.assertEqual(compiled.errors, cerberus.errors)
+
+    def test_parity(self):
+        registry = SchemaRegistry(
+            {"ref_def": {"q": {"type": "string", "coerce": int}}})
+        for allow_unknown in (True, False):
+            self.assertParity(self.PARITY_SCHEMA, registry,
+                              self.PARITY_DOCUMENTS, allow_unknown)
+
+    def test_parity_config_schema(self):
+        config = self._fh.configuration.copy_flat()
+        invalid_values = [
+            (("bottom_sensor", "preactivation_timeout"), 11),
+            (("bottom_sensor", "preactivation_timeout"), -1),
+            (("bottom_sensor", "preactivation_timeout"), "5"),
+            (("bottom_sensor", "uart"), None),
+            (("can_bus", "sensor_can", "unknown"), 1),
+            (("can_bus", "vehicle_can", "channel"), 1),
+            (("can_bus", "vehicle_can"), []),
+            (("sensor_config", "sensors"), [{"id": "0", "name": 1}, 3]),
+            (("sensor_config", "sensor_configurations"),
+             [{"name": "a", "sensors": [0, "1"]}]),
+            (("ui",), 5),
+        ]
+        documents = [config]
+        for path, value in invalid_values:
+            document = copy.deepcopy(config)
+            parent = document
+            for key in path[:-1]:
+                parent = parent[key]
+            parent[path[-1]] = value
+            documents.append(document)
+
+        self.assertParity(self._fh.config_schema.schema,
+                          self._fh.config_schema.schema_registry, documents)
+
+    def test_recursive_schema(self):
+        registry = SchemaRegistry({"node": {
+            "name": {"type": "string"},
+            "child": {"type": "dict", "schema": "node"}}})
+        self.assertParity(
+            {"tree": {"type": "dict", "schema": "node"}}, registry,
+            [{"tree": {"name": "a", "child": {"name": "b"}}},
+             {"tree": {"name": "a", "child": {"child": {"name": 1}}}}])
+
+    def test_config_manager_backend(self):
+        cm = ConfigManager(DEFAULT_TEST_FILE, validator_backend="compiled")
+        self.assertIsInstance(cm._validator, CompiledValidator)
+        cm.validate()
+        cm.config_from_file(TEST_OVERLAY_INVALID_VALUE)
+        with self.assertRaises(ConfigValidationError):
+            cm.validate()
+
+        # Incremental validation
+        cm.config = cm.config.get_root()
+        cm.validate()
+        cm.set_cli_opt_conf_value(
+            "bottom-sensor--preactivation-timeout", "11")
+        with self.assertRaises(ConfigValidationError):
+            cm.validate()
+
+        with self.assertRaises(OnacolException):
+            ConfigManager(DEFAULT_TEST_FILE, validator_backend="unknown")
+
+
+class TestHotReload(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        self._overlay_1 = os.path.join(self._tmp_dir, "overlay_1.yaml")
+        self._overlay_2 = os.path.join(self._tmp_dir, "overlay_2.yaml")
+        self._write(self._overlay_1, "ui:\n    port: 1\n")
+        self._write(self._overlay_2, "general:\n    log_level: WARNING\n")
+        self._cm = ConfigManager(
+            DEFAULT_TEST_FILE, optional_files=[self._overlay_1,
+                                               self._overlay_2],
+            env_var_prefix="ONAC")
+
+    def tearDown(self):
+        self._cm.stop_watching()
+        shutil.rmtree(self._tmp_dir)
+
+    @staticmethod
+    def _write(path, content):
+        # Explicit mtime change, as the file system timestamps may be coarse
+        mtime = os.stat(path).st_mtime_ns if os.path.exists(path) else 0
+        with open(path, "w") as f:
+            f.write(content)
+        os.utime(path, ns=(mtime + 10**9, mtime + 10**9))
+
+    def test_changes_during_reload_kept(self):
+        self._cm.merge_env_vars([("ONAC_CAN_BUS__SENSOR_CAN__CHANNEL",
+                                  "from_env")])
+        self._write(self._overlay_1, "ui:\n    port: 2\n")
+
+        check_reloaded = self._cm._check_reloaded
+        checked = []
+
+        def concurrent_change(config):
+            # Changes made by another thread while the reload is checked
+            if not checked:
+                thread = threading.Thread(target=lambda: (
+                    self._cm.set_env_var_conf_value(
+                        "ONAC_GENERAL__LOG_LEVEL", "ERROR"),
+                    self._cm.config_from_dict({"ui": {"addr": "1.2.3.4"}})))
+                thread.start()
+                thread.join()
+            checked.append(config)
+            check_reloaded(config)
+
+        with mock.patch.object(self._cm, "_check_reloaded",
+                               side_effect=concurrent_change):
+            self.assertTrue(self._cm.reload())
+        # Rebuilt on top of the changes
+        self.assertEqual(len(checked), 2)
+        config = self._cm.config
+        self.assertEqual(config["ui"]["port"], 2)
+        self.assertEqual(config["ui"]["addr"], "1.2.3.4")
+        self.assertEqual(config["general"]["log_level"], "ERROR")
+        self.assertEqual(config["can_bus"]["sensor_can"]["channel"],
+                         "from_env")
+
+    def test_rebase_layer(self):
+        root = CascaDict({"a": {"x": 1, "y": 2}, "b": 1})
+        layer = root.cascade({"a": {"x": 5}}).cascade({"a": {"y": 7},
+                                                        "b": 3})
+        layer["c"] = {"q": 1}
+        new_base = root.cascade({"a": {"x": 6, "z": 0}})
+        rebased = rebase_layer(layer, new_base)
+        self.assertIs(rebased.get_ancestor(), new_base)
+        self.assertDictEqual(rebased.copy_flat(),
+                             {"a": {"x": 6, "y": 7, "z": 0}, "b": 3,
+                              "c": {"q": 1}})
+        self.assertDictEqual(
+            rebase_layer(layer, root.cascade({"a": 9})).copy_flat(),
+            {"a": {"y": 7}, "b": 3, "c": {"q": 1}})
+
+    def test_validation_keeps_layers(self):
+        for backend in ("cerberus", "compiled"):
+            cm = ConfigManager(DEFAULT_TEST_FILE,
+                               validator_backend=backend,
+                               incremental_validation=False)
+            cm.config_from_dict({"bottom_sensor": {"state_enabled": False}})
+            layer = cm.config.final_dict
+            cm.validate()
+            cm._validator.validate_path(cm.config, ("bottom_sensor",))
+            self.assertDictEqual(layer["general"].final_dict, {})
+            self.assertDictEqual(layer["bottom_sensor"]["uart"].final_dict,
+                                 {})
+
+    def test_reload_changed_layer(self):
+        callback = mock.Mock()
+        self._cm.add_reload_callback(callback)
+        self._cm.config_from_dict({"bottom_sensor": {"state_enabled": False}})
+        self._cm.merge_cli_opts([("ui--addr", "127.0.0.1")])
+        layer_count = self._cm.layer_count
+        self.assertFalse(self._cm.reload())
+
+        self._write(self._overlay_1, "ui:\n    port: 2\n    addr: 1.1.1.1\n")
+        with mock.patch.object(ConfigFileHandler, "_parse_yaml_string",
+                               side_effect=ConfigFileHandler._parse_yaml_string
+                               ) as parse:
+            self.assertTrue(self._cm.reload())
+            parse.assert_called_once()
+        callback.assert_called_once_with(self._cm)
+
+        self.assertEqual(self._cm.layer_count, layer_count)
+        self.assertEqual(self._cm.config["ui"]["port"], 2)
+        # Layers above the file are kept on top of it
+        self.assertEqual(self._cm.config["ui"]["addr"], "127.0.0.1")
+        self.assertFalse(self._cm.config["bottom_sensor"]["state_enabled"])
+        self.assertEqual(self._cm.config["general"]["log_level"], "WARNING")
+        self.assertEqual(self._cm.snapshot()["ui", "port"], 2)
+
+        # File layers are tracked across reloads
+        self._write(self._overlay_2, "general:\n    log_level: ERROR\n")
+        self.assertTrue(self._cm.reload())
+        self.assertEqual(self._cm.config["general"]["log_level"], "ERROR")
+        self.assertEqual(self._cm.config["ui"]["port"], 2)
+        self.assertFalse(self._cm.reload())
+
+    def test_touched_file(self):
+        stat = os.stat(self._overlay_1)
+        os.utime(self._overlay_1, ns=(stat.st_mtime_ns + 10**9,
+                                      stat.st_mtime_ns + 10**9))
+        config = self._cm.config
+        with mock.patch.object(ConfigFileHandler, "_parse_yaml_string") \
+                as parse:
+            self.assertFalse(self._cm.reload())
+            parse.assert_not_called()
+        self.assertIs(self._cm.config, config)
+
+    def test_invalid_change(self):
+        config = self._cm.config
+        self._write(self._overlay_1, "ui: 5\n")
+        with self.assertRaises(ConfigValidationError):
+            self._cm.reload()
+        self.assertIs(self._cm.config, config)
+
+        # Reported until fixed
+        with self.assertRaises(ConfigValidationError):
+            self._cm.reload()
+        self._write(self._overlay_1, "ui:\n    port: 3\n")
+        self.assertTrue(self._cm.reload())
+        self.assertEqual(self._cm.config["ui"]["port"], 3)
+
+        # Invalid YAML
+        self._write(self._overlay_1, "ui: [\n")
+        with self.assertRaises(ConfigFileException):
+            self._cm.reload()
+        self.assertEqual(self._cm.config["ui"]["port"], 3)
+
+    def test_appearing_and_deleted_files(self):
+        missing = os.path.join(self._tmp_dir, "missing.yaml")
+        cm = ConfigManager(DEFAULT_TEST_FILE,
+                           optional_files=[self._overlay_1, missing,
+                                           self._overlay_2])
+        self.assertEqual(cm.layer_count, 3)
+        self._write(missing, "ui:\n    port: 4\n"
+                             "general:\n    log_level: DEBUG\n")
+        self.assertTrue(cm.reload())
+        self.assertEqual(cm.layer_count, 4)
+        self.assertEqual(cm.config["ui"]["port"], 4)
+        # Inserted in the files order
+        self.assertEqual(cm.config["general"]["log_level"], "WARNING")
+
+        os.unlink(self._overlay_1)
+        os.unlink(missing)
+        self.assertTrue(cm.reload())
+        self.assertEqual(cm.config["ui"]["port"], 8888)
+        self.assertFalse(cm.reload(validate=False))
+
+    def test_compaction_keeps_file_layers(self):
+        cm = ConfigManager(DEFAULT_TEST_FILE, optional_files=[self._overlay_1],
+                           env_var_prefix="ONAC", max_layers=3,
+                           hot_reload=True)
+        for i in range(5):
+            cm.config_from_dict({"general": {"log_level": str(i)}})
+            self.assertLessEqual(cm.layer_count, 3)
+        self._write(self._overlay_1, "ui:\n    port: 5\n")
+        self.assertTrue(cm.reload())
+        self.assertEqual(cm.config["ui"]["port"], 5)
+        self.assertEqual(cm.config["general"]["log_level"], "4")
+
+    def test_watch(self):
+        reloaded = threading.Event()
+        self._cm.add_reload_callback(lambda cm: reloaded.set())
+        self._cm.watch(interval=0.01)
+        self._write(self._overlay_1, "ui:\n    port: 6\n")
+        self.assertTrue(reloaded.wait(5))
+        self._cm.stop_watching()
+        self.assertEqual(self._cm.config["ui"]["port"], 6)
+
+
+class TestAsyncLoading(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self._optional_files = [TEST_OVERLAY_1, NONEXISTENT_OVERLAY,
+                                TEST_OVERLAY_LONGER_LIST]
+        self._executor = ThreadPoolExecutor(4)
+
+    def tearDown(self):
+        self._executor.shutdown()
+
+    async def test_create_async(self):
+        parse_threads = set()
+        parse = ConfigFileHandler._parse_yaml_string
+
+        def record_thread(*args, **kwargs):
+            parse_threads.add(threading.current_thread())
+            return parse(*args, **kwargs)
+
+        with mock.patch.object(ConfigFileHandler, "_parse_yaml_string",
+                               side_effect=record_thread) as parse_mock:
+            cm = await ConfigManager.create_async(
+                DEFAULT_TEST_FILE, optional_files=self._optional_files,
+                env_var_prefix="ONAC", executor=self._executor)
+            self.assertEqual(parse_mock.call_count, 3)
+        self.assertNotIn(threading.main_thread(), parse_threads)
+
+        reference = ConfigManager(DEFAULT_TEST_FILE,
+                                  optional_files=self._optional_files,
+                                  env_var_prefix="ONAC")
+        self.assertDictEqual(cm.config.copy_flat(),
+                             reference.config.copy_flat())
+        self.assertEqual(cm.layer_count, reference.layer_count)
+        self.assertEqual(
+            [f.path for f in cm._file_handler.file_layers],
+            [f.path for f in reference._file_handler.file_layers])
+        self.assertEqual(cm.get_cli_opt_conf_value("general--log-level"),
+                         "DEBUG")
+        self.assertIsNotNone(cm._validator)
+
+    async def test_not_loaded(self):
+        cm = ConfigManager(DEFAULT_TEST_FILE, load=False)
+        self.assertEqual(cm.config, {})
+        await cm.load_async()
+        self.assertEqual(cm.config["ui"]["port"], 8888)
+        cm.validate()
+
+    async def test_config_from_file_async(self):
+        cm = ConfigManager(DEFAULT_TEST_FILE)
+        reference = ConfigManager(DEFAULT_TEST_FILE)
+        await cm.config_from_file_async(TEST_OVERLAY_SHORTER_LIST,
+                                        executor=self._executor)
+        reference.config_from_file(TEST_OVERLAY_SHORTER_LIST)
+        self.assertDictEqual(cm.config.copy_flat(),
+                             reference.config.copy_flat())
+        self.assertEqual(cm.layer_count, 2)
+        with self.assertRaises(FileNotFoundError):
+            await cm.config_from_file_async(NONEXISTENT_OVERLAY)
+
+    async def test_reload_async(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        overlay = os.path.join(tmp_dir, "overlay.yaml")
+        with open(overlay, "w") as f:
+            f.write("ui:\n    port: 1\n")
+        cm = await ConfigManager.create_async(DEFAULT_TEST_FILE,
+                                              optional_files=[overlay])
+        callback_threads = []
+        cm.add_reload_callback(
+            lambda m: callback_threads.append(threading.current_thread()))
+        self.assertFalse(await cm.reload_async())
+
+        with open(overlay, "w") as f:
+            f.write("ui:\n    port: 2000\n")
+        os.utime(overlay, ns=(10**9, 10**9))
+        self.assertTrue(await cm.reload_async(executor=self._executor))
+        self.assertEqual(cm.config["ui"]["port"], 2000)
+        self.assertEqual(callback_threads, [threading.current_thread()])
+
+    async def test_update_in_executor(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        overlay = os.path.join(tmp_dir, "overlay.yaml")
+        with open(overlay, "w") as f:
+            f.write("ui:\n    port: 1\n")
+        cm = await ConfigManager.create_async(DEFAULT_TEST_FILE,
+                                              optional_files=[overlay])
+        update_threads = []
+
+        def callback(path, old, new):
+            update_threads.append(threading.current_thread())
+
+        cm.subscribe(("ui", "port"), callback)
+        cm.subscribe(("sensor_config", "sensors"), callback)
+        layers_added = cm._layers_added
+
+        def record_thread():
+            update_threads.append(threading.current_thread())
+            layers_added()
+
+        with mock.patch.object(cm, "_layers_added",
+                               side_effect=record_thread):
+            await cm.config_from_file_async(TEST_OVERLAY_SHORTER_LIST,
+                                            executor=self._executor)
+            self.assertEqual(len(update_threads), 2)
+
+            with open(overlay, "w") as f:
+                f.write("ui:\n    port: 2000\n")
+            os.utime(overlay, ns=(10**9, 10**9))
+            self.assertTrue(await cm.reload_async(executor=self._executor))
+        self.assertEqual(len(update_threads), 4)
+        self.assertNotIn(threading.current_thread(), update_threads)
+
+    def test_concurrent_parsing(self):
+        yaml_string = Path(TEST_OVERLAY_LONGER_LIST).read_text()
+        expected = ConfigFileHandler._parse_yaml_string(
+            yaml_string, loader=YAML_LOADERS["safe"])
+        for loader in ("safe", "rt"):
+            results = list(self._executor.map(
+                lambda _: ConfigFileHandler._parse_yaml_string(
+                    yaml_string, loader=YAML_LOADERS[loader]), range(40)))
+            for result in results:
+                self.assertEqual(result, expected)
+
+
+class TestConfigStats(unittest.TestCase):
+
+    def test_disabled_by_default(self):
+        cm = ConfigManager(DEFAULT_TEST_FILE, env_var_prefix="ONAC")
+        self.assertIs(cm.stats, DISABLED_STATS)
+        cm.validate()
+        self.assertEqual(cm.stats.as_dict(),
+                         {"phases": {}, "counters": {}})
+        self.assertIs(cm.stats.phase("a"), cm.stats.phase("b"))
+
+    def test_phases_and_counters(self):
+        cm = ConfigManager(DEFAULT_TEST_FILE, env_var_prefix="ONAC",
+                           stats=True, incremental_validation=True)
+        with mock.patch.dict(os.environ, {"ONAC_UI__PORT": "1234"},
+                             clear=True):
+            cm.config_from_env_vars()
+        cm.config_from_cli_args(["--bottom-sensor--feature-enabled", "true"])
+        cm.validate()
+        cm.config_from_dict({"ui": {"port": 4321}})
+        cm.validate()
+        cm.export_current_config(io.StringIO())
+
+        phases = cm.stats.phases
+        for name in ("load", "read_file", "parse_yaml", "schema",
+                     "flat_schema", "env_vars", "cli_args", "validate",
+                     "export"):
+            self.assertIn(name, phases)
+            self.assertGreater(phases[name]["duration"], 0)
+        self.assertEqual(phases["validate"]["count"], 2)
+
+        counters = cm.stats.counters
+        self.assertEqual(counters["files_read"], 1)
+        self.assertGreater(counters["bytes_read"], 0)
+        self.assertGreater(counters["schema_nodes"], 0)
+        self.assertEqual(counters["env_vars_merged"], 1)
+        self.assertEqual(counters["cli_opts_merged"], 1)
+        self.assertEqual(counters["full_validations"], 1)
+        self.assertEqual(counters["incremental_validations"], 1)
+        self.assertEqual(counters["validated_paths"], 1)
+        self.assertEqual(counters["layers_created"], 3)
+
+        cm.stats.reset()
+        self.assertEqual(cm.stats.as_dict(),
+                         {"phases": {}, "counters": {}})
+
+    def test_hooks(self):
+        calls = []
+        stats = ConfigStats(hooks=[lambda *args: calls.append(args)])
+        cm = ConfigManager(DEFAULT_TEST_FILE, stats=stats)
+        self.assertIs(cm.stats, stats)
+        self.assertIn("load", [name for name, _ in calls])
+        calls.clear()
+        cm.validate()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(calls[0][0], "validate")
+        self.assertIsInstance(calls[0][1], float)
+
+
+class TestCompactRecords(unittest.TestCase):
+
+    ITEMS = [{"id": 1, "name": "a"}, {"id": 2, "name": "b"},
+             {"id": 3, "name": "c"}]
+
+    def test_record_list(self):
+        records = RecordList(self.ITEMS)
+        self.assertEqual(len(records), 3)
+        self.assertEqual(records[1]["name"], "b")
+        self.assertEqual(records[-1], {"id": 3, "name": "c"})
+        self.assertEqual(records[1:], self.ITEMS[1:])
+        self.assertIsInstance(records[1:], RecordList)
+        self.assertEqual(records, self.ITEMS)
+        self.assertEqual(self.ITEMS, records)
+        self.assertNotEqual(records, self.ITEMS[:2])
+        self.assertIn("id", records[0])
+        self.assertNotIn("other", records[0])
+        with self.assertRaises(IndexError):
+            records[3]
+        with self.assertRaises(KeyError):
+            records[0]["other"]
+        with self.assertRaises(TypeError):
+            records[0]["id"] = 5
+        with self.assertRaises(TypeError):
+            RecordList([1, 2])
+
+    def test_heterogeneous_items(self):
+        records = RecordList([{"a": 1}, {"b": 2}])
+        self.assertEqual(records.to_list(), [{"a": 1}, {"b": 2}])
+        self.assertEqual(len(records[0]), 1)
+        self.assertFalse(is_homogeneous([{"a": 1}, {"b": 2}]))
+        self.assertFalse(is_homogeneous([{"a": 1}, 2]))
+        self.assertTrue(is_homogeneous(self.ITEMS))
+
+    def test_copies(self):
+        records = RecordList(self.ITEMS)
+        unpickled = pickle.loads(pickle.dumps(records))
+        self.assertIs(type(unpickled), list)
+        self.assertEqual(unpickled, self.ITEMS)
+        self.assertIs(copy.copy(records), records)
+        deep = copy.deepcopy(records)
+        self.assertIsInstance(deep, RecordList)
+        self.assertEqual(deep, records)
+
+    def test_compact_and_expand(self):
+        config = {"a": {"items": [dict(i) for i in self.ITEMS],
+                        "short": [{"x": 1}],
+                        "mixed": [{"x": 1}, {"y": 1}]}}
+        compact = compact_records(config, 2)
+        self.assertIsInstance(compact["a"]["items"], RecordList)
+        self.assertIsInstance(compact["a"]["short"], list)
+        self.assertIsInstance(compact["a"]["mixed"], list)
+
+        expanded = expand_records(compact)
+        self.assertIsNot(expanded, compact)
+        self.assertIs(type(expanded["a"]["items"]), list)
+        self.assertEqual(expanded["a"]["items"], self.ITEMS)
+        self.assertIsInstance(compact["a"]["items"], RecordList)
+        self.assertIs(expand_records(expanded), expanded)
+
+    def _managers(self, overlay=None, **kwargs):
+        managers = []
+        for compact_lists in (None, 1):
+            for backend in ("cerberus", "compiled"):
+                cm = ConfigManager(DEFAULT_TEST_FILE,
+                                   compact_lists=compact_lists,
+                                   validator_backend=backend, **kwargs)
+                if overlay is not None:
+                    cm.config_from_file(overlay)
+                managers.append(cm)
+        return managers
+
+    def test_config_manager(self):
+        for overlay in (None, TEST_OVERLAY_LONGER_LIST,
+                        TEST_OVERLAY_SHORTER_LIST):
+            results = []
+            for cm in self._managers(overlay):
+                cm.validate()
+                export = io.StringIO()
+                cm.export_current_config(export)
+                delta = io.StringIO()
+                cm.export_config_delta(delta)
+                results.append((export.getvalue(), delta.getvalue(),
+                                cm.snapshot()["sensor_config"]["sensors"]))
+            self.assertIsInstance(cm.config["sensor_config"]["sensors"],
+                                  RecordList)
+            for result in results[1:]:
+                self.assertEqual(result, results[0])
+
+    def test_validation_errors(self):
+        items = [{"id": i, "name": f"Sensor {i}", "min_trigger_limit": 30,
+                  "max_trigger_limit": 120} for i in range(5)]
+        items[1]["min_trigger_limit"] = "low"
+        items[3]["id"] = None
+        with open(TMP_FILE, "w") as overlay_file:
+            YAML_ACCESS.dump({"sensor_config": {"sensors": items}},
+                             overlay_file)
+
+        errors = []
+        for cm in self._managers(TMP_FILE):
+            with self.assertRaises(ConfigValidationError) as ctx:
+                cm.validate()
+            errors.append(str(ctx.exception))
+        self.assertIsInstance(cm.config["sensor_config"]["sensors"],
+                              RecordList)
+        self.assertIn("min_trigger_limit", errors[0])
+        self.assertEqual(len(set(errors)), 1)
+
 
 class TestFlatSchemaHandler(unittest.TestCase):
 
@@ -362,9 +1455,860 @@ class TestFlatSchemaHandler(unittest.TestCase):
             {"x": 1, "y": "abc"},
         )
 
+    def _convert(self, value_type, data_type, value):
+        fsh = FlatSchemaHandler(
+            {("section", "value"): FlatSchemaMetadata(value_type, data_type)},
+            env_var_prefix="ONAC")
+        config = {"section": {"value": None}}
+        fsh.set_config_from_env_var(config, "ONAC_SECTION__VALUE", value)
+        return config["section"]["value"]
+
+    def test_value_conversions(self):
+        cases = [
+            ("integer", "42", 42),
+            ("integer", "abc", "abc"),
+            ("integer", "true", True),
+            ("float", "1.5", 1.5),
+            ("float", "2", 2.0),
+            ("number", "3", 3),
+            ("number", "3.5", 3.5),
+            ("boolean", "False", False),
+            ("boolean", "1", True),
+            ("boolean", "[1]", True),
+            ("boolean", "yes", "yes"),
+            ("string", "123", "123"),
+            ("dict", '{"a": 1}', {"a": 1}),
+            (None, "12", 12),
+            (None, "1.2", 1.2),
+            (None, "TRUE", True),
+            (None, "[1, 2]", "[1, 2]"),
+            (None, "text", "text"),
+            ("integer", 7, 7),
+            (None, 7, 7),
+        ]
+        for data_type, value, expected in cases:
+            with self.subTest(data_type=data_type, value=value):
+                converted = self._convert(FlatValueType.VALUE, data_type,
+                                          value)
+                self.assertEqual(converted, expected)
+                self.assertIs(type(converted), type(expected))
+
+    def test_list_conversion(self):
+        self.assertEqual(self._convert(FlatValueType.LIST, None, "[1, 2]"),
+                         [1, 2])
+        with self.assertRaises(InvalidValueError):
+            self._convert(FlatValueType.LIST, None, '{"a": 1}')
+        with self.assertRaises(InvalidValueError):
+            self._convert(FlatValueType.LIST, None, "[1,")
+
+    def test_invalid_mapping_value(self):
+        with self.assertRaises(InvalidValueError):
+            self._convert(FlatValueType.VALUE, "dict", "[1, 2]")
+
+    def test_unknown_type(self):
+        fsh = FlatSchemaHandler(
+            {("section", "value"): FlatSchemaMetadata(FlatValueType.VALUE,
+                                                      ["integer", "string"])},
+            env_var_prefix="ONAC")
+        self.assertEqual(fsh.convert_value(("section", "value"), "x", 5), 5)
+        with self.assertRaises(TypeError):
+            fsh.convert_value(("section", "value"), "x", "5")
+
+    def test_converters_shared(self):
+        fsh = FlatSchemaHandler(
+            {("a",): FlatSchemaMetadata(FlatValueType.VALUE, "integer"),
+             ("b",): FlatSchemaMetadata(FlatValueType.VALUE, "integer")})
+        self.assertIs(fsh._converters[("a",)], fsh._converters[("b",)])
+
+
+class TestLazySchema(unittest.TestCase):
+
+    def setUp(self):
+        with open(DEFAULT_TEST_FILE) as yaml_file:
+            self._source = YAML_ACCESS.load(yaml_file)
+
+    def test_lazy_parity(self):
+        eager = ConfigSchema(self._source)
+        lazy = ConfigSchema(self._source, lazy=True)
+        self.assertEqual(lazy.pending_sections, list(self._source))
+
+        # Partial access first, sections are in the document order anyway
+        lazy.section("ui")
+        lazy.section("can_bus")
+        self.assertEqual(list(lazy.defaults), list(eager.defaults))
+        self.assertEqual(lazy.defaults, eager.defaults)
+        self.assertEqual(lazy.schema, eager.schema)
+        self.assertEqual(list(lazy.flat_schema), list(eager.flat_schema))
+        self.assertEqual(lazy.schema_registry.all(),
+                         eager.schema_registry.all())
+        self.assertEqual(lazy.pending_sections, [])
+
+    def test_section_access(self):
+        stats = ConfigStats()
+        lazy = ConfigSchema(self._source, lazy=True, stats=stats)
+        self.assertNotIn("schema", stats.phases)
+
+        schema, defaults = lazy.section("general")
+        self.assertEqual(schema, ConfigSchema(self._source).schema["general"])
+        self.assertEqual(defaults["log_level"], "INFO")
+        self.assertNotIn("general", lazy.pending_sections)
+        self.assertIn("can_bus", lazy.pending_sections)
+        self.assertEqual(stats.phases["schema"]["count"], 1)
+        with self.assertRaises(KeyError):
+            lazy.section("nonexistent")
+
+    def test_top_level_metadata(self):
+        source = {"oc_schema": {"allow_unknown": False},
+                  "item": {"oc_default": 1, "oc_schema": {"type": "integer"}}}
+        lazy = ConfigSchema(source, lazy=True)
+        # Parsed at once
+        self.assertEqual(lazy.pending_sections, [])
+        self.assertEqual(lazy.schema, ConfigSchema(source).schema)
+        with self.assertRaises(SchemaException):
+            ConfigSchema(source, sections=["item"])
+
+    def test_selected_sections(self):
+        config_schema = ConfigSchema(self._source,
+                                     sections=["general", "can_bus"])
+        self.assertEqual(list(config_schema.defaults), ["general", "can_bus"])
+        self.assertEqual({path[0] for path in config_schema.flat_schema},
+                         {"general", "can_bus"})
+
+    def test_config_manager_sections(self):
+        cm = ConfigManager(DEFAULT_TEST_FILE,
+                           optional_files=[TEST_OVERLAY_1],
+                           env_var_prefix="ONAC",
+                           schema_sections=["general", "can_bus"])
+        # Sections not selected are dropped from the optional files
+        self.assertEqual(list(cm.config.keys()), ["general", "can_bus"])
+        self.assertEqual(cm.config["general"]["log_level"], "DEBUG")
+        self.assertEqual(cm.config["can_bus"]["vehicle_can"]["channel"],
+                         "can2")
+        cm.validate()
+
+        with self.assertRaises(UnknownConfigError):
+            cm.set_cli_opt_conf_value("ui--enabled", "false")
+        cm.set_env_var_conf_value("ONAC_GENERAL__LOG_LEVEL", "ERROR")
+        self.assertEqual(cm.config["general"]["log_level"], "ERROR")
+
+        output = io.StringIO()
+        cm.export_current_config(output)
+        exported = YAML_ACCESS.load(output.getvalue())
+        self.assertEqual(list(exported), ["general", "can_bus"])
+        self.assertEqual(exported["general"]["log_level"], "ERROR")
+
+    def test_sections_schema_cache(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            full = ConfigManager(DEFAULT_TEST_FILE, schema_cache_dir=tmp_dir)
+            partial = ConfigManager(DEFAULT_TEST_FILE,
+                                    schema_cache_dir=tmp_dir,
+                                    schema_sections=["general"])
+            self.assertEqual(list(partial.config.keys()), ["general"])
+            with mock.patch.object(ConfigSchema,
+                                   "_process_schema_element") as parse:
+                warm = ConfigManager(DEFAULT_TEST_FILE,
+                                     schema_cache_dir=tmp_dir,
+                                     schema_sections=["general"])
+                parse.assert_not_called()
+            self.assertEqual(list(warm.config.keys()), ["general"])
+            self.assertEqual(warm._file_handler.config_schema.sections,
+                             ("general",))
+            self.assertNotEqual(list(full.config.keys()), ["general"])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_select_sections_source(self):
+        source = ("# Header\n"
+                  "general:\n"
+                  "    log_level: INFO  # Comment\n"
+                  "\n"
+                  "ui:\n"
+                  "    enabled: true\n"
+                  "can_bus: {channel: can0}\n")
+        self.assertEqual(_select_sections(source, ("general", "can_bus")),
+                         "# Header\n"
+                         "general:\n"
+                         "    log_level: INFO  # Comment\n"
+                         "\n"
+                         "can_bus: {channel: can0}\n")
+        # Not split
+        for unsafe in ("---\n" + source,
+                       source + "other: &anchor 1\n",
+                       source + "? complex key\n"):
+            with self.subTest(unsafe=unsafe):
+                self.assertEqual(_select_sections(unsafe, ("general",)),
+                                 unsafe)
+
+    def test_flat_mappings_on_demand(self):
+        cm = ConfigManager(DEFAULT_TEST_FILE, env_var_prefix="ONAC")
+        self.assertFalse(cm._flat_schema_handler.mappings_built)
+        self.assertTrue(cm._flat_schema_handler.is_valid_cli_opt(
+            "general--log-level"))
+        self.assertTrue(cm._flat_schema_handler.mappings_built)
+
+
+class TestConfigDiff(unittest.TestCase):
+
+    def test_diff(self):
+        base = {"a": {"x": 1, "y": 2, "z": {"deep": True}},
+                "items": [1, 2, {"k": "v"}],
+                "removed": None}
+        config = {"a": {"x": 1, "y": 3, "w": 4, "z": {"deep": 1}},
+                  "items": [1, 5, {"k": "w"}, 4],
+                  "added": {"q": 1}}
+        self.assertEqual(config_diff(config, base), ConfigDiff(
+            added={("a", "w"): 4, ("items", 3): 4, ("added",): {"q": 1}},
+            removed={("removed",): None},
+            changed={("a", "y"): (2, 3), ("a", "z", "deep"): (True, 1),
+                     ("items", 1): (2, 5), ("items", 2, "k"): ("v", "w")}))
+        self.assertFalse(config_diff(copy.deepcopy(base), base))
+        self.assertTrue(config_diff(config, base))
+
+    def test_identity_skip(self):
+        shared = [{"id": i} for i in range(100)]
+        with mock.patch("onacol.diff._same_tree") as same_tree:
+            self.assertFalse(config_diff({"items": shared},
+                                         {"items": shared}))
+            same_tree.assert_not_called()
+
+    def test_schema_value_paths(self):
+        cm = ConfigManager(DEFAULT_TEST_FILE)
+        config_schema = cm._file_handler.config_schema
+        base = cm.config.copy_flat()
+        config = copy.deepcopy(base)
+        config["ui"]["port"] = 1
+        config["can_bus"]["vehicle_can"]["channel"] = "can3"
+        config["sensor_config"]["sensors"][0]["name"] = "renamed"
+        diff = config_diff(config, base, config_schema)
+        self.assertEqual(diff.changed, {
+            ("ui", "port"): (8888, 1),
+            ("can_bus", "vehicle_can", "channel"): ("can1", "can3"),
+            ("sensor_config", "sensors", 0, "name"): (
+                "The first sensor", "renamed")})
+
+        # Dict values of the schema paths are compared as a whole
+        schema = ConfigSchema({"section": {"options": {
+            "oc_default": {"a": 1}, "oc_schema": {"type": "dict"}}}})
+        diff = config_diff({"section": {"options": {"a": 2}}},
+                           schema.defaults, schema)
+        self.assertEqual(diff.changed, {("section", "options"): (
+            {"a": 1}, {"a": 2})})
+
+    def test_batch(self):
+        cm = ConfigManager(DEFAULT_TEST_FILE, env_var_prefix="ONAC")
+        differ = ConfigDiffer(cm.config, cm._file_handler.config_schema)
+        hosts = []
+        for port in (8888, 1, 2):
+            host = ConfigManager(DEFAULT_TEST_FILE, env_var_prefix="ONAC")
+            host.set_env_var_conf_value("ONAC_UI__PORT", str(port))
+            hosts.append(host.config)
+        diffs = differ.diff_many(hosts)
+        self.assertFalse(diffs[0])
+        self.assertEqual([d.changed for d in diffs[1:]],
+                         [{("ui", "port"): (8888, 1)},
+                          {("ui", "port"): (8888, 2)}])
+
+
+class TestFingerprint(unittest.TestCase):
+
+    def test_content_equality(self):
+        config = {"a": {"x": 1, "y": [1, 2]}, "b": "text"}
+        reordered = {"b": "text", "a": {"y": [1, 2], "x": 1}}
+        self.assertEqual(config_fingerprint(config),
+                         config_fingerprint(reordered))
+        layered = CascaDict({"a": {"x": 0, "y": [1, 2]}}).cascade(
+            {"a": {"x": 1}, "b": "text"})
+        self.assertEqual(config_fingerprint(layered),
+                         config_fingerprint(config))
+
+        for changed in ({"a": {"x": 1, "y": [2, 1]}, "b": "text"},
+                        {"a": {"x": 1.0, "y": [1, 2]}, "b": "text"},
+                        {"a": {"x": True, "y": [1, 2]}, "b": "text"},
+                        {"a": {"x": 1, "y": [1, 2]}, "b": "text", "c": {}},
+                        {"a": {"x": 1, "y": [1, 2]}},
+                        {"a": {"x": 1, "y": [1, 2], "b": "text"}}):
+            with self.subTest(changed=changed):
+                self.assertNotEqual(config_fingerprint(changed),
+                                    config_fingerprint(config))
+
+    def test_update(self):
+        config = {"a": {"x": 1, "y": {"z": None}}, "b": [{"c": 1}]}
+        fingerprint = ConfigFingerprint(config)
+        config["a"]["x"] = 2
+        config["a"]["y"] = "replaced subtree"
+        config["b"] = RecordList([{"c": 1}, {"c": 2}])
+        config["new"] = {"d": 1}
+        del config["a"]["x"]
+        fingerprint.update(config, [("a", "x"), ("a", "y"), ("b",),
+                                    ("new",)])
+        self.assertEqual(fingerprint, ConfigFingerprint(config))
+
+        # Structural change above the path
+        config["a"] = 1
+        fingerprint.update(config, [("a", "y")])
+        self.assertEqual(fingerprint, ConfigFingerprint(config))
+
+    def test_config_manager(self):
+        cm = ConfigManager(DEFAULT_TEST_FILE, env_var_prefix="ONAC")
+        other = ConfigManager(DEFAULT_TEST_FILE, env_var_prefix="ONAC")
+        fingerprint = cm.fingerprint
+        self.assertEqual(fingerprint, other.fingerprint)
+
+        with mock.patch.object(ConfigFingerprint, "_build") as build:
+            cm.set_cli_opt_conf_value("general--log-level", "ERROR")
+            cm.apply_overrides(
+                env_vars=[("ONAC_CONTROL_CONFIG__CAN_TRANSMIT", "false")])
+            cm.config_from_dict({"ui": {"port": 1234}})
+            updated = cm.fingerprint
+            build.assert_not_called()
+        self.assertNotEqual(updated, fingerprint)
+        self.assertEqual(updated, ConfigFingerprint(cm.config).hexdigest())
+
+        other.config_from_dict({
+            "general": {"log_level": "ERROR"},
+            "control_config": {"can_transmit": False},
+            "ui": {"port": 1234}})
+        self.assertEqual(other.fingerprint, updated)
+        # Compaction does not change the content
+        cm.compact()
+        self.assertEqual(cm.fingerprint, updated)
+
+        cm.config_from_file(TEST_OVERLAY_1)
+        self.assertEqual(cm.fingerprint,
+                         ConfigFingerprint(cm.config).hexdigest())
+
+    def test_schema_fingerprint(self):
+        cm = ConfigManager(DEFAULT_TEST_FILE)
+        self.assertEqual(cm.schema_fingerprint,
+                         ConfigManager(DEFAULT_TEST_FILE).schema_fingerprint)
+        self.assertEqual(cm.schema_fingerprint,
+                         ConfigManager(DEFAULT_TEST_FILE,
+                                       compact_lists=1).schema_fingerprint)
+        self.assertNotEqual(
+            cm.schema_fingerprint,
+            ConfigManager(DEFAULT_TEST_FILE,
+                          schema_sections=["general"]).schema_fingerprint)
+
+
+class TestAccessors(unittest.TestCase):
+
+    def test_accessor_class(self):
+        schema = {"section": {"type": "dict", "schema": {
+            "port": {"type": "integer"}, "ratio": {"type": "number"}}}}
+        defaults = {"section": {"port": 1, "ratio": 0.5, "name": "x",
+                                "non-identifier": 1, "_private": 2},
+                    "items": [1, 2]}
+        cls = accessor_class(schema, defaults)
+        self.assertTrue(issubclass(cls, ConfigAccessor))
+        section_cls = cls._children["section"]
+        self.assertEqual(section_cls.__slots__, ("port", "ratio", "name"))
+        self.assertIs(section_cls.__annotations__["port"], int)
+        self.assertEqual(section_cls.__annotations__["ratio"],
+                         Union[int, float])
+
+        accessor = bind_accessor(cls, defaults)
+        self.assertFalse(hasattr(accessor, "__dict__"))
+        self.assertEqual(accessor.section.port, 1)
+        self.assertEqual(accessor.items, [1, 2])
+        self.assertEqual(accessor["section"]["non-identifier"], 1)
+        self.assertEqual(accessor["section"]["name"], "x")
+        self.assertIn("_private", accessor.section)
+        with self.assertRaises(AttributeError):
+            accessor.section.port = 2
+        with self.assertRaises(KeyError):
+            accessor["unknown"]
+
+    def test_config_manager(self):
+        cm = ConfigManager(DEFAULT_TEST_FILE, env_var_prefix="ONAC")
+        config = cm.accessor
+        self.assertIs(cm.accessor, config)
+        self.assertEqual(config.can_bus.sensor_can.channel, "can0")
+        self.assertEqual(config.bottom_sensor.uart.baud_rate, 115200)
+        self.assertEqual(config.sensor_config.sensors[0]["id"], 0)
+        self.assertIs(type(config.ui).__annotations__["port"], Any)
+        self.assertIs(type(config.bottom_sensor).__annotations__[
+            "preactivation_timeout"], int)
+
+        # Rebound on changes (only the changed paths)
+        ui = config.ui
+        cm.set_cli_opt_conf_value("can-bus--sensor-can--channel", "can5")
+        self.assertEqual(config.can_bus.sensor_can.channel, "can5")
+        self.assertIs(config.ui, ui)
+        cm.apply_overrides(env_vars=[("ONAC_UI__PORT", "1234")])
+        self.assertEqual(config.ui.port, 1234)
+        cm.config_from_dict({"bottom_sensor": {"uart": {"baud_rate": 9600}},
+                             "new_section": {"value": 1}})
+        self.assertEqual(config.bottom_sensor.uart.baud_rate, 9600)
+        self.assertEqual(config["new_section"]["value"], 1)
+
+        cm.config_from_file(TEST_OVERLAY_1)
+        self.assertEqual(config.general.log_level, "DEBUG")
+        self.assertEqual(config.can_bus.vehicle_can.channel, "can2")
+        self.assertEqual(config.ui.port, 1234)
+
+        cm.load()
+        self.assertIsNot(cm.accessor, config)
+        self.assertEqual(cm.accessor.ui.port, 8888)
+
+
+class TestSubscriptions(unittest.TestCase):
+
+    def test_index(self):
+        index = SubscriptionIndex()
+        section = Subscription(("a",), None, None)
+        leaf = Subscription(("a", "b", "c"), None, None)
+        other = Subscription(("d",), None, None)
+        for subscription in (section, leaf, other):
+            index.add(subscription)
+        self.assertEqual(len(index), 3)
+
+        self.assertEqual(index.affected([("a", "b", "c")]), [section, leaf])
+        self.assertEqual(index.affected([("a", "b")]), [section, leaf])
+        self.assertEqual(index.affected([("a", "x")]), [section])
+        self.assertEqual(index.affected([("d", "x"), ("a",)]),
+                         [section, leaf, other])
+        self.assertEqual(index.affected([("x",)]), [])
+
+        index.remove(leaf)
+        self.assertEqual(index.affected([("a", "b", "c")]), [section])
+        self.assertEqual(index.all(), [section, other])
+        with self.assertRaises(ValueError):
+            index.remove(leaf)
+
+    def test_config_manager(self):
+        cm = ConfigManager(DEFAULT_TEST_FILE, env_var_prefix="ONAC")
+        calls = []
+
+        def callback(path, old, new):
+            calls.append((path, old, new))
+
+        channel = cm.subscribe(("can_bus", "sensor_can", "channel"), callback)
+        section = cm.subscribe(("ui",), callback)
+        cm.subscribe(("new", "value"), callback)
+
+        cm.set_cli_opt_conf_value("can-bus--sensor-can--channel", "can5")
+        self.assertEqual(calls, [(("can_bus", "sensor_can", "channel"),
+                                  "can0", "can5")])
+        calls.clear()
+
+        # Same value - not notified
+        cm.apply_overrides(env_vars=[("ONAC_CAN_BUS__SENSOR_CAN__CHANNEL",
+                                      "can5"), ("ONAC_UI__PORT", "1234")])
+        self.assertEqual(len(calls), 1)
+        path, old, new = calls[0]
+        self.assertEqual(path, ("ui",))
+        self.assertEqual((old["port"], new["port"]), (8888, 1234))
+        with self.assertRaises(TypeError):
+            new["port"] = 1
+        calls.clear()
+
+        cm.config_from_dict({"new": {"value": 1}, "general": {"x": 1}})
+        self.assertEqual(calls, [(("new", "value"), MISSING, 1)])
+        calls.clear()
+
+        cm.unsubscribe(section)
+        cm.config_from_file(TEST_OVERLAY_1)
+        self.assertEqual(calls, [])
+        cm.unsubscribe(channel)
+        cm.subscribe(("general", "log_level"), callback)
+        # Load drops the file layer as well
+        cm.load()
+        self.assertEqual(calls, [(("new", "value"), 1, MISSING),
+                                 (("general", "log_level"), "DEBUG",
+                                  "INFO")])
+
+
+def _read_shared_config(path, queue):
+    subscriber = ConfigSubscriber(path)
+    queue.put((subscriber.snapshot()["general", "log_level"],
+               subscriber.version))
+
+
+class TestSharedConfig(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        self._path = os.path.join(self._tmp_dir, "config.shm")
+        self._cm = ConfigManager(DEFAULT_TEST_FILE)
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def test_publish_and_read(self):
+        with ConfigPublisher(self._path) as publisher, \
+                ConfigSubscriber(self._path) as subscriber:
+            self.assertEqual(publisher.version, 0)
+            with self.assertRaises(SharedConfigError):
+                subscriber.snapshot()
+
+            self.assertEqual(publisher.publish(self._cm.config), 1)
+            snapshot = subscriber.snapshot()
+            self.assertEqual(subscriber.version, 1)
+            self.assertEqual(dict(snapshot.flat_index),
+                             dict(self._cm.snapshot().flat_index))
+            # Not deserialized again
+            self.assertIs(subscriber.snapshot(), snapshot)
+
+            self._cm.set_cli_opt_conf_value("general--log-level", "ERROR")
+            publisher.publish(self._cm.config)
+            self.assertEqual(subscriber.published_version, 2)
+            self.assertEqual(subscriber.snapshot()["general"]["log_level"],
+                             "ERROR")
+            self.assertEqual(snapshot["general"]["log_level"], "INFO")
+
+    def test_file_growth(self):
+        with ConfigPublisher(self._path, initial_size=64) as publisher, \
+                ConfigSubscriber(self._path) as subscriber:
+            publisher.publish({"small": 1})
+            self.assertEqual(subscriber.snapshot()["small"], 1)
+            publisher.publish({"big": list(range(10000))})
+            self.assertEqual(len(subscriber.snapshot()["big"]), 10000)
+
+    def test_publisher_restart(self):
+        with ConfigPublisher(self._path) as publisher:
+            publisher.publish({"value": 1})
+        with ConfigPublisher(self._path) as publisher:
+            # Last configuration is kept until the next publication
+            with ConfigSubscriber(self._path) as subscriber:
+                self.assertEqual(subscriber.snapshot()["value"], 1)
+            self.assertEqual(publisher.publish({"value": 2}), 2)
+
+    def test_invalid_file(self):
+        with open(self._path, "wb") as invalid_file:
+            invalid_file.write(b"x" * 100)
+        with self.assertRaises(SharedConfigError):
+            ConfigSubscriber(self._path)
+        with self.assertRaises(SharedConfigError):
+            ConfigPublisher(self._path)
+
+    def test_other_process(self):
+        context = multiprocessing.get_context("spawn")
+        queue = context.Queue()
+        with ConfigPublisher(self._path) as publisher:
+            publisher.publish(self._cm.config)
+            process = context.Process(target=_read_shared_config,
+                                      args=(self._path, queue))
+            process.start()
+            self.assertEqual(queue.get(timeout=30), ("INFO", 1))
+            process.join()
+
+
+class TestSchemaCache(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        self._cache_dir = os.path.join(self._tmp_dir, "cache")
+        self._default_file = os.path.join(self._tmp_dir, "defaults.yaml")
+        shutil.copy(DEFAULT_TEST_FILE, self._default_file)
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def test_cold_and_warm_start(self):
+        with mock.patch.object(SchemaCache, "store", autospec=True,
+                               side_effect=SchemaCache.store) as store:
+            cold = ConfigManager(self._default_file, env_var_prefix="ONAC",
+                                 schema_cache_dir=self._cache_dir)
+            # Cache entry (including flat mappings) is written only once
+            self.assertEqual(store.call_count, 1)
+        cache_file = SchemaCache(self._cache_dir).cache_file_path(
+            self._default_file)
+        self.assertTrue(os.path.exists(cache_file))
+
+        with mock.patch.object(ConfigFileHandler, "_parse_yaml_string") as p, \
+                mock.patch.object(SchemaCache, "store") as store:
+            warm = ConfigManager(self._default_file, env_var_prefix="ONAC",
+                                 schema_cache_dir=self._cache_dir)
+            p.assert_not_called()
+            store.assert_not_called()
+
+        self.assertDictEqual(warm.config.copy_flat(), cold.config.copy_flat())
+        self.assertDictEqual(warm._file_handler.flat_schema,
+                             cold._file_handler.flat_schema)
+        self.assertEqual(warm._flat_schema_handler.mappings,
+                         cold._flat_schema_handler.mappings)
+
+        warm.config_from_cli_opts(
+            [("bottom-sensor--preactivation-timeout", "11")])
+        with self.assertRaises(ConfigValidationError):
+            warm.validate()
+
+        # Export still retains the original file form
+        with open(TMP_FILE, "w") as export_file:
+            warm.generate_config_example(export_file)
+        with open(TMP_FILE) as yaml_file:
+            dump = YAML_ACCESS.load(yaml_file)
+        with open(DEFAULT_DEFAULTS_FILE) as yaml_file:
+            orig = YAML_ACCESS.load(yaml_file)
+        self.assertDictEqual(dump, orig)
+
+    def test_invalidation_on_change(self):
+        ConfigManager(self._default_file, schema_cache_dir=self._cache_dir)
+        with open(self._default_file, "a") as default_file:
+            default_file.write("\nextra_section:\n    value: 42\n")
+
+        cm = ConfigManager(self._default_file,
+                           schema_cache_dir=self._cache_dir)
+        self.assertEqual(cm.config["extra_section"]["value"], 42)
+
+    def test_invalidation_on_explicit_env_var(self):
+        with open(self._default_file, "a") as default_file:
+            default_file.write(
+                "\nextra_section:\n    value: ${oc_env:ONAC_CACHE_TEST}\n")
+
+        with mock.patch.dict(os.environ, {"ONAC_CACHE_TEST": "1"}):
+            cm = ConfigManager(self._default_file,
+                               schema_cache_dir=self._cache_dir)
+        self.assertEqual(cm.config["extra_section"]["value"], 1)
 
+        with mock.patch.dict(os.environ, {"ONAC_CACHE_TEST": "2"}):
+            cm = ConfigManager(self._default_file,
+                               schema_cache_dir=self._cache_dir)
+        self.assertEqual(cm.config["extra_section"]["value"], 2)
 
+    def test_corrupted_cache(self):
+        cache = SchemaCache(self._cache_dir)
+        os.makedirs(self._cache_dir)
+        with open(cache.cache_file_path(self._default_file), "wb") as f:
+            f.write(b"garbage")
 
+        with self.assertLogs("onacol", level="WARNING"):
+            cm = ConfigManager(self._default_file,
+                               schema_cache_dir=self._cache_dir)
+        self.assertEqual(cm.config["ui"]["port"], 8888)
 
 
+class TestConfigArtifact(unittest.TestCase):
 
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        self._default_file = os.path.join(self._tmp_dir, "defaults.yaml")
+        self._overlay = os.path.join(self._tmp_dir, "overlay.yaml")
+        self._missing = os.path.join(self._tmp_dir, "missing.yaml")
+        self._artifact = os.path.join(self._tmp_dir, "config.onacol")
+        shutil.copy(DEFAULT_TEST_FILE, self._default_file)
+        shutil.copy(TEST_OVERLAY_1, self._overlay)
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def _manager(self, **kwargs) -> ConfigManager:
+        kwargs.setdefault("env_var_prefix", "ONAC")
+        return ConfigManager(self._default_file,
+                             [self._overlay, self._missing], **kwargs)
+
+    def test_compile_and_load(self):
+        compiler = self._manager(load=False)
+        compiler.compile_artifact(self._artifact)
+        # Compiling does not load the configuration
+        self.assertFalse(compiler._file_handler.config_schema)
+        self.assertIsInstance(read_artifact(self._artifact), dict)
+
+        files = self._manager()
+        with mock.patch.object(ConfigFileHandler,
+                               "_parse_yaml_string") as parse, \
+                mock.patch.object(FlatSchemaHandler,
+                                  "_build_mappings") as build:
+            compiled = self._manager(artifact=self._artifact)
+            parse.assert_not_called()
+            compiled._flat_schema_handler.mappings
+            build.assert_not_called()
+        self.assertTrue(compiled.artifact_loaded)
+        self.assertFalse(files.artifact_loaded)
+
+        self.assertDictEqual(compiled.config.copy_flat(),
+                             files.config.copy_flat())
+        self.assertEqual(compiled.config["general"]["log_level"], "DEBUG")
+        self.assertEqual(compiled._flat_schema_handler.mappings,
+                         files._flat_schema_handler.mappings)
+        self.assertEqual(
+            [(f.path, f.digest) for f in compiled._file_handler.file_layers],
+            [(f.path, f.digest) for f in files._file_handler.file_layers])
+
+        compiled.config_from_cli_opts(
+            [("bottom-sensor--preactivation-timeout", "11")])
+        with self.assertRaises(ConfigValidationError):
+            compiled.validate()
+
+        # Export still retains the original file form
+        with open(TMP_FILE, "w") as export_file:
+            compiled.generate_config_example(export_file)
+        with open(TMP_FILE) as yaml_file:
+            dump = YAML_ACCESS.load(yaml_file)
+        with open(DEFAULT_DEFAULTS_FILE) as yaml_file:
+            orig = YAML_ACCESS.load(yaml_file)
+        self.assertDictEqual(dump, orig)
+
+    def test_reload_after_artifact_load(self):
+        self._manager(load=False).compile_artifact(self._artifact)
+        cm = self._manager(artifact=self._artifact)
+        self.assertFalse(cm.reload(validate=False))
+
+        with open(self._missing, "w") as missing_file:
+            missing_file.write("ui:\n    port: 9000\n")
+        # Overlay 1 is not valid, validation is not relevant here
+        self.assertTrue(cm.reload(validate=False))
+        self.assertEqual(cm.config["ui"]["port"], 9000)
+        self.assertEqual(cm.config["general"]["log_level"], "DEBUG")
+
+    def test_stale_artifact(self):
+        self._manager(load=False).compile_artifact(self._artifact)
+        with open(self._overlay, "a") as overlay:
+            overlay.write("\nui:\n    port: 9001\n")
+
+        with self.assertLogs("onacol", level="INFO") as logs:
+            cm = self._manager(artifact=self._artifact)
+        self.assertIn("stale", logs.output[0])
+        self.assertFalse(cm.artifact_loaded)
+        self.assertEqual(cm.config["ui"]["port"], 9001)
+
+        # Different set of the optional files
+        cm = ConfigManager(self._default_file, [self._overlay],
+                           env_var_prefix="ONAC", artifact=self._artifact)
+        self.assertFalse(cm.artifact_loaded)
+
+        with mock.patch("onacol.artifact.__version__", "0.0.0"):
+            self._manager(load=False).compile_artifact(self._artifact)
+        cm = self._manager(artifact=self._artifact)
+        self.assertFalse(cm.artifact_loaded)
+
+    def test_stale_on_explicit_env_var(self):
+        with open(self._overlay, "a") as overlay:
+            overlay.write("\nui:\n    port: ${oc_env:ONAC_ARTIFACT_TEST}\n")
+
+        with mock.patch.dict(os.environ, {"ONAC_ARTIFACT_TEST": "1"}):
+            self._manager(load=False).compile_artifact(self._artifact)
+            cm = self._manager(artifact=self._artifact)
+        self.assertTrue(cm.artifact_loaded)
+        self.assertEqual(cm.config["ui"]["port"], 1)
+
+        with mock.patch.dict(os.environ, {"ONAC_ARTIFACT_TEST": "2"}):
+            cm = self._manager(artifact=self._artifact)
+        self.assertFalse(cm.artifact_loaded)
+        self.assertEqual(cm.config["ui"]["port"], 2)
+
+    def test_missing_and_invalid_artifact(self):
+        with self.assertLogs("onacol", level="WARNING"):
+            cm = self._manager(artifact=self._artifact)
+        self.assertFalse(cm.artifact_loaded)
+        self.assertEqual(cm.config["general"]["log_level"], "DEBUG")
+
+        with open(self._artifact, "wb") as artifact_file:
+            artifact_file.write(b"garbage")
+        with self.assertRaises(ArtifactError):
+            read_artifact(self._artifact)
+        with self.assertLogs("onacol", level="WARNING"):
+            cm = self._manager(artifact=self._artifact)
+        self.assertFalse(cm.artifact_loaded)
+        self.assertEqual(cm.config["general"]["log_level"], "DEBUG")
+
+    def test_compact_lists(self):
+        self._manager(load=False).compile_artifact(self._artifact)
+        cm = self._manager(artifact=self._artifact, compact_lists=2)
+        files = self._manager(compact_lists=2)
+        self.assertTrue(cm.artifact_loaded)
+        self.assertDictEqual(expand_records(cm.config.copy_flat()),
+                             expand_records(files.config.copy_flat()))
+
+    async def _load_async(self) -> ConfigManager:
+        return await ConfigManager.create_async(
+            self._default_file, [self._overlay, self._missing],
+            env_var_prefix="ONAC", artifact=self._artifact)
+
+    def test_async_load(self):
+        self._manager(load=False).compile_artifact(self._artifact)
+        cm = asyncio.run(self._load_async())
+        self.assertTrue(cm.artifact_loaded)
+        self.assertEqual(cm.config["general"]["log_level"], "DEBUG")
+
+
+class TestCommandLine(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def _run(self, *argv) -> tuple:
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        exit_code = cli_main([str(arg) for arg in argv], stdout, stderr)
+        return exit_code, stdout.getvalue(), stderr.getvalue()
+
+    def test_validate(self):
+        exit_code, stdout, _ = self._run("validate", DEFAULT_TEST_FILE)
+        self.assertEqual(exit_code, 0)
+        self.assertIn("valid", stdout)
+
+        exit_code, _, stderr = self._run("validate", DEFAULT_TEST_FILE,
+                                         "--overlay", TEST_OVERLAY_1)
+        self.assertEqual(exit_code, 1)
+        self.assertIn("sensor_reset_interval", stderr)
+
+        with mock.patch.dict(os.environ, {
+                "ONACOLCLI_BOTTOM_SENSOR__PREACTIVATION_TIMEOUT": "11"}):
+            exit_code, _, stderr = self._run("validate", DEFAULT_TEST_FILE,
+                                             "-e", "ONACOLCLI")
+        self.assertEqual(exit_code, 1)
+        self.assertIn("preactivation_timeout", stderr)
+
+        exit_code, _, stderr = self._run(
+            "validate", os.path.join(self._tmp_dir, "missing.yaml"))
+        self.assertEqual(exit_code, 1)
+
+    def test_show(self):
+        with mock.patch.dict(os.environ, {"ONACOLCLI_UI__PORT": "9000"}):
+            exit_code, stdout, _ = self._run("show", DEFAULT_TEST_FILE,
+                                             "-e", "ONACOLCLI")
+            self.assertEqual(exit_code, 0)
+            self.assertEqual(YAML_ACCESS.load(stdout)["ui"]["port"], 9000)
+
+            output = os.path.join(self._tmp_dir, "delta.yaml")
+            exit_code, stdout, _ = self._run("show", DEFAULT_TEST_FILE,
+                                             "-e", "ONACOLCLI", "--delta",
+                                             "-o", output)
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(stdout, "")
+        with open(output) as delta_file:
+            self.assertDictEqual(YAML_ACCESS.load(delta_file),
+                                 {"ui": {"port": 9000}})
+
+    def test_example(self):
+        exit_code, stdout, _ = self._run("example", DEFAULT_TEST_FILE,
+                                         "--overlay", TEST_OVERLAY_1)
+        self.assertEqual(exit_code, 0)
+        with open(DEFAULT_DEFAULTS_FILE) as yaml_file:
+            orig = YAML_ACCESS.load(yaml_file)
+        self.assertDictEqual(YAML_ACCESS.load(stdout), orig)
+
+    def test_compile(self):
+        cache_dir = os.path.join(self._tmp_dir, "cache")
+        artifact = os.path.join(self._tmp_dir, "config.onacol")
+        exit_code, _, stderr = self._run("compile", DEFAULT_TEST_FILE)
+        self.assertEqual(exit_code, 1)
+        self.assertIn("Nothing to compile", stderr)
+
+        exit_code, _, _ = self._run("compile", DEFAULT_TEST_FILE,
+                                    "--schema-cache", cache_dir,
+                                    "--artifact", artifact)
+        self.assertEqual(exit_code, 0)
+        self.assertTrue(os.path.exists(
+            SchemaCache(cache_dir).cache_file_path(DEFAULT_TEST_FILE)))
+        cm = ConfigManager(DEFAULT_TEST_FILE, artifact=artifact)
+        self.assertTrue(cm.artifact_loaded)
+
+    def test_timing(self):
+        exit_code, stdout, _ = self._run("timing", DEFAULT_TEST_FILE,
+                                         "-n", 2, "--json")
+        self.assertEqual(exit_code, 0)
+        stats = json.loads(stdout)
+        self.assertEqual(stats["phases"]["load"]["count"], 2)
+        self.assertEqual(stats["phases"]["validate"]["count"], 2)
+        self.assertEqual(stats["phases"]["export"]["count"], 2)
+
+        exit_code, stdout, _ = self._run("timing", DEFAULT_TEST_FILE)
+        self.assertEqual(exit_code, 0)
+        self.assertIn("parse_yaml", stdout)
+        self.assertIn("files_read", stdout)